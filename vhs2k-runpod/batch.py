@@ -0,0 +1,318 @@
+import collections
+import os
+import shutil
+import time
+
+import progress
+import scheduler
+import scratch
+import storage
+from cache import get_input_cache
+from config import Config, PROFILES
+from pipeline import (
+    ERR_DEINTERLACE, ERR_ENCODE, ERR_INTERNAL, ERR_VALIDATION, LADDER_MANIFESTS, PipelineError,
+    admission_failed, analyze_input, apply_profile, audio_codec_args,
+    audio_stream_info, build_multi_encode_cmd, build_preprocess_filters, choose_encoder,
+    dedup_summary, download_input, enforce_max_job_seconds, estimate_input_size_gb,
+    estimate_job_bytes, ffprobe_metadata, head_input, input_duration, input_identity, job_entry,
+    link_cached_input, log_line, plan_stages, resolve_params, resource_slot, run_cmd,
+    run_preprocess, scratch_estimate_bytes, stage_threads, timed, upload_output, upscale_video_file,
+    validate_request, video_stream_info,
+)
+
+BATCH_KEYS = ("inputs", "profiles", "variants")
+# Per-item modes that need their own pass over the input; batch items always run staged
+UNSUPPORTED_ITEM_FLAGS = ("streaming", "segmented", "stream_input", "live_upload", "preview", "dry_run")
+
+
+def is_batch_request(request):
+    return any(isinstance(request.get(k), list) for k in BATCH_KEYS)
+
+
+def expand_items(request, logs):
+    # inputs x (profiles | variants); shared top-level fields apply to every item and
+    # per-input / per-variant dicts override them
+    errors = []
+    inputs = request.get("inputs")
+    if inputs is None:
+        inputs = [request["input_url"]] if request.get("input_url") else []
+    if not isinstance(inputs, list) or not inputs:
+        errors.append("inputs must be a non-empty list")
+    if request.get("profiles") is not None and request.get("variants") is not None:
+        errors.append("use either profiles or variants, not both")
+    variants = request.get("variants")
+    if request.get("profiles") is not None:
+        profiles = request["profiles"]
+        if not isinstance(profiles, list) or not profiles or any(p not in PROFILES for p in profiles):
+            errors.append("profiles must be a non-empty list of %s" % "|".join(sorted(PROFILES)))
+        else:
+            variants = [{"profile": p} for p in profiles]
+    if variants is None:
+        variants = [{}]
+    if not isinstance(variants, list) or not variants or not all(isinstance(v, dict) for v in variants):
+        errors.append("variants must be a non-empty list of objects")
+    if not errors:
+        for entry in inputs:
+            if not isinstance(entry, (str, dict)) or (isinstance(entry, dict) and not entry.get("input_url")):
+                errors.append("each input must be a URL or an object with input_url")
+                break
+    if not errors and len(inputs) * len(variants) > Config.BATCH_MAX_ITEMS:
+        errors.append("batch has %d items, limit is %d" % (len(inputs) * len(variants), Config.BATCH_MAX_ITEMS))
+    if errors:
+        for e in errors:
+            log_line(logs, "Validation error: %s" % e, "warning")
+        raise PipelineError(ERR_VALIDATION, "Invalid batch request", logs)
+
+    shared = dict((k, v) for k, v in request.items() if k not in BATCH_KEYS and k != "input_url")
+    items = []
+    for input_index, entry in enumerate(inputs):
+        source = {"input_url": entry} if isinstance(entry, str) else dict(entry)
+        for variant in variants:
+            item_request = dict(shared)
+            item_request.update(source)
+            item_request.update(variant)
+            items.append({
+                "index": len(items),
+                "input_index": input_index,
+                "request": apply_profile(item_request),
+            })
+    return items
+
+
+def _fail(item, code, message):
+    item["result"] = {"status": "failed", "error_code": code, "error_message": message}
+
+
+def _prepare_input(input_url, head, tmp_dir, logs):
+    # One download, probe and analysis per input, shared by all of its items
+    input_path = os.path.join(tmp_dir, "input")
+    cache = get_input_cache(Config.CACHE_DIR, Config.CACHE_MAX_GB)
+    cache_key = cache.key_for(input_identity(input_url, head)) if cache is not None else None
+    cached = cache.lookup(cache_key) if cache_key else None
+    if cached:
+        log_line(logs, "Input cache hit")
+        input_path = link_cached_input(cached["input"], input_path)
+    else:
+        with resource_slot(logs, "download"):
+            download_input(input_url, input_path, logs, head)
+        if cache_key:
+            try:
+                cache.store_input(cache_key, input_path)
+            except Exception as exc:
+                log_line(logs, "Input cache store failed: %s" % exc, "warning")
+    if cached and cached.get("probe") and cached["probe"].get("analysis"):
+        log_line(logs, "Probe cache hit")
+        return input_path, cached["probe"]["meta"], cached["probe"]["analysis"]
+    meta = ffprobe_metadata(input_path, logs)
+    analysis = analyze_input(input_path, meta, logs)
+    if cache_key:
+        cache.store_probe(cache_key, {"meta": meta, "analysis": analysis})
+    return input_path, meta, analysis
+
+
+def _encode_outputs(video_input, audio, members, logs, stage, split_stage):
+    # One ffmpeg for the whole group; a bwdif failure retries the group with yadif.
+    # The outputs share the group's encoder threads.
+    threads = stage_threads(logs, split_stage, record=stage)
+    video_input = threads.input_args(complex_graph=True) + list(video_input)
+    outputs = [dict(m["output"], video_args=list(m["output"]["video_args"]) + threads.encoder_args(m["encoder"].name, len(members))) for m in members]
+    try:
+        run_cmd(build_multi_encode_cmd(video_input, audio, outputs), Config.STAGE_TIMEOUT_PROCESS, logs, stage, ERR_ENCODE)
+    except PipelineError:
+        if not any("bwdif" in (o.get("prefilter") or "") for o in outputs):
+            raise
+        log_line(logs, "bwdif failed; retrying with yadif", "warning")
+        retry = [dict(o, prefilter=(o.get("prefilter") or "").replace("bwdif", "yadif")) for o in outputs]
+        run_cmd(build_multi_encode_cmd(video_input, audio, retry), Config.STAGE_TIMEOUT_PROCESS, logs, stage + "_yadif", ERR_DEINTERLACE)
+
+
+def _render_input(members, input_path, meta, analysis, batch_id, work_dir, tmp_dir, logs, start_time):
+    # Items without an ML upscale share one decode of the input; upscaled items share a
+    # preprocess + upscale per (filter chain, model) and one decode of the upscaled result
+    has_audio = bool(audio_stream_info(meta))
+    groups = collections.OrderedDict()
+    for item in members:
+        params, spec = item["params"], item["spec"]
+        name = "%s-%d-%s.%s" % (batch_id, item["index"], params["profile"] or "custom", params["container"])
+        item["output"] = {
+            "target_wh": params["target_wh"],
+            "video_args": spec["video_args"],
+            "output_path": os.path.join(work_dir, name),
+            "audio_args": audio_codec_args(meta, params["container"]) if params["keep_audio"] and has_audio else None,
+            "prefilter": None if spec["upscale"] else spec["filter_chain"],
+        }
+        key = ("upscale", spec["filter_chain"], spec["model"], spec["scale"], spec["dedup"]) if spec["upscale"] else ("direct",)
+        groups.setdefault(key, []).append(item)
+
+    for group_index, (key, group) in enumerate(groups.items()):
+        label = "direct" if key[0] == "direct" else "upscale-%d" % group_index
+        for item in group:
+            item["group"] = label
+        log_line(logs, "Group %s: items %s" % (label, ", ".join(str(i["index"]) for i in group)))
+        try:
+            if key[0] == "direct":
+                audio = {"path": input_path, "same_input": True} if has_audio else None
+                with resource_slot(logs, "cpu"), timed(logs, "encode"):
+                    _encode_outputs(["-i", input_path], audio, group, logs, "encode", "direct")
+            else:
+                spec = group[0]["spec"]
+                stage4_path = os.path.join(tmp_dir, "%s_stage4.mp4" % label)
+                stage6_path = os.path.join(tmp_dir, "%s_stage6.mp4" % label)
+                with resource_slot(logs, "cpu"):
+                    used_chain = run_preprocess(input_path, stage4_path, spec["filter_chain"], logs)
+                enforce_max_job_seconds(start_time, logs)
+                with resource_slot(logs, "gpu"):
+                    upscale_video_file(stage4_path, stage6_path, used_chain, meta, spec, tmp_dir, logs)
+                enforce_max_job_seconds(start_time, logs)
+                audio = {"path": input_path} if has_audio else None
+                with resource_slot(logs, "cpu"), timed(logs, "encode"):
+                    _encode_outputs(["-i", stage6_path], audio, group, logs, "encode", "encode")
+                if not Config.KEEP_INTERMEDIATES:
+                    for path in (stage4_path, stage6_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+        except PipelineError as pe:
+            for item in group:
+                _fail(item, pe.code, pe.message)
+            continue
+        enforce_max_job_seconds(start_time, logs)
+
+        for item in group:
+            try:
+                with resource_slot(logs, "upload"):
+                    output_url = upload_output(batch_id, item["output"]["output_path"], logs)
+            except PipelineError as pe:
+                _fail(item, pe.code, pe.message)
+                continue
+            item["result"] = {
+                "status": "completed",
+                "output_url": output_url,
+                "metadata": _item_metadata(item, meta, analysis),
+            }
+
+
+def _item_metadata(item, meta, analysis):
+    params, spec = item["params"], item["spec"]
+    video = video_stream_info(meta)
+    w, h = params["target_wh"]
+    b, g, c = item["applied"]
+    return {
+        "duration_sec": input_duration(meta),
+        "input_resolution": "%dx%d" % (video["width"], video["height"]) if video.get("width") else "",
+        "output_resolution": "%dx%d" % (w, h),
+        "interlace_detected": bool(analysis["interlaced"]),
+        "analysis": analysis,
+        "plan": item["plan"],
+        "encoder": item["encoder"].name,
+        "shared_group": item["group"],
+        "applied_exposure": {"brightness": b, "gamma": g, "contrast": c, "auto_exposure": bool(params["auto_exposure"])},
+    }
+
+
+def _run_input(input_url, members, batch_id, space, logs):
+    start_time = time.time()
+    head = head_input(input_url, logs)
+    size_gb = estimate_input_size_gb(input_url, logs, head)
+    if size_gb is not None and size_gb > Config.MAX_INPUT_GB:
+        log_line(logs, "Input too large: %.2f GB" % size_gb)
+        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+    work_dir = space.work_dir
+    tmp_dir = os.path.join(space.tmp_dir, "input-%d" % members[0]["input_index"])
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        # Reserve scratch for every item of this input: outputs plus the shared intermediates
+        with space.admit(scratch_estimate_bytes((size_gb or 1.0) * len(members))):
+            input_path, meta, analysis = _prepare_input(input_url, head, tmp_dir, logs)
+            enforce_max_job_seconds(start_time, logs)
+            for item in members:
+                item["filter_chain"], item["applied"] = build_preprocess_filters(item["params"], analysis, logs)
+                item["plan"] = plan_stages(meta, item["params"], logs)
+                item["spec"] = {
+                    "filter_chain": item["filter_chain"],
+                    "upscale": item["plan"]["upscale"],
+                    "model": item["plan"]["model"],
+                    "scale": item["plan"]["scale"],
+                    "target_wh": item["params"]["target_wh"],
+                    "video_args": item["encoder"].video_args(item["params"]["crf"], item["params"]["preset"]),
+                    "encoder": item["encoder"].name,
+                    "output_args": [],
+                    "streaming": False,
+                    "dedup": item["params"]["dedup"],
+                }
+            # Earlier inputs' outputs stay in the work dir; only this input's files count as written
+            input_bytes = os.path.getsize(input_path) if os.path.dirname(input_path) == tmp_dir else 0
+            space.reserve(estimate_job_bytes(meta, [item["spec"] for item in members], input_bytes), scratch.dir_bytes(tmp_dir))
+            _render_input(members, input_path, meta, analysis, batch_id, work_dir, tmp_dir, logs, start_time)
+    except scheduler.AdmissionError as exc:
+        raise admission_failed(exc, logs)
+    finally:
+        if Config.CLEANUP_TEMP and not Config.KEEP_INTERMEDIATES:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@job_entry
+def run_batch(request, logs):
+    log_line(logs, "Batch started")
+    items = expand_items(request, logs)
+    batch_id = scratch.new_job_id("batch-")
+
+    # Item-level validation: a bad variant fails alone instead of failing the batch
+    for item in items:
+        item_logs = progress.JobLog()
+        item_request = item["request"]
+        try:
+            flags = [f for f in UNSUPPORTED_ITEM_FLAGS if item_request.get(f)]
+            if flags:
+                log_line(item_logs, "Validation error: %s not supported in batch requests" % ", ".join(flags), "warning")
+                raise PipelineError(ERR_VALIDATION, "Invalid request", item_logs)
+            validate_request(item_request, item_logs)
+            item["params"] = resolve_params(item_request, item_logs)
+            if item["params"]["container"] in LADDER_MANIFESTS:
+                log_line(item_logs, "Validation error: %s output not supported in batch requests" % item["params"]["container"], "warning")
+                raise PipelineError(ERR_VALIDATION, "Invalid request", item_logs)
+            item["encoder"] = choose_encoder(item["params"], item_logs)
+        except PipelineError as pe:
+            _fail(item, pe.code, pe.message)
+            item["result"]["logs"] = item_logs.events()
+
+    by_input = collections.OrderedDict()
+    for item in items:
+        if "result" not in item:
+            by_input.setdefault(item["request"]["input_url"], []).append(item)
+    with scratch.job_space(batch_id) as space:
+        for number, (input_url, members) in enumerate(by_input.items()):
+            log_line(logs, "Input %d/%d: %d item(s)" % (number + 1, len(by_input), len(members)))
+            try:
+                _run_input(input_url, members, batch_id, space, logs)
+            except PipelineError as pe:
+                for item in members:
+                    if "result" not in item:
+                        _fail(item, pe.code, pe.message)
+            except Exception as exc:
+                log_line(logs, "Unhandled error: %s" % exc, "error")
+                for item in members:
+                    if "result" not in item:
+                        _fail(item, ERR_INTERNAL, "Internal error")
+        # Outputs that made it are in S3; failed items have nothing worth keeping
+        space.uploaded = storage.s3_enabled()
+
+    results = []
+    for item in items:
+        result = dict(item.get("result") or {"status": "failed", "error_code": ERR_INTERNAL, "error_message": "Internal error"})
+        result.update(index=item["index"], input_url=item["request"].get("input_url"), profile=item["request"].get("profile"))
+        results.append(result)
+    completed = sum(1 for r in results if r["status"] == "completed")
+    log_line(logs, "Batch finished: %d/%d items completed" % (completed, len(results)))
+    return {
+        "status": "completed" if completed == len(results) else ("partial" if completed else "failed"),
+        "items": results,
+        "metadata": {
+            "batch_id": batch_id,
+            "items": len(results),
+            "completed": completed,
+            "inputs": len(by_input),
+            "timings": logs.timings.as_dict(),
+            "dedup": dedup_summary(logs),
+        },
+        "logs": logs,
+    }
@@ -0,0 +1,50 @@
+import os
+import subprocess
+
+# 480i NTSC capture stand-ins: lavfi renders 59.94 progressive fields and `interlace`
+# weaves them into 29.97 top-field-first frames, so idet and bwdif/yadif see real combing
+FIELD_RATE = "60000/1001"
+SIZE = "720x480"
+
+# kind -> filters applied to the progressive field source before weaving
+CLIP_KINDS = {
+    "interlaced": [],
+    "noisy": [
+        "noise=c0s=22:c1s=14:c2s=14:allf=t+u",
+        "gblur=sigma=0.6",
+    ],
+    "dark": [
+        "eq=brightness=-0.22:contrast=0.65:gamma=0.85",
+        "noise=c0s=10:allf=t+u",
+    ],
+}
+
+
+def clip_filter(kind):
+    if kind not in CLIP_KINDS:
+        raise ValueError("unknown clip kind %s (choose from %s)" % (kind, ", ".join(sorted(CLIP_KINDS))))
+    chain = ["testsrc2=size=%s:rate=%s" % (SIZE, FIELD_RATE)]
+    chain += CLIP_KINDS[kind]
+    chain += ["format=yuv420p", "interlace=scan=tff:lowpass=complex", "setfield=tff", "setdar=4/3"]
+    return ",".join(chain)
+
+
+def generate_clip(out_dir, kind, seconds, audio=True):
+    # Deterministic for a given kind and length; an existing file is reused
+    path = os.path.join(out_dir, "%s_%ds.mkv" % (kind, seconds))
+    if os.path.exists(path):
+        return path
+    os.makedirs(out_dir, exist_ok=True)
+    cmd = ["ffmpeg", "-hide_banner", "-v", "error", "-y", "-f", "lavfi", "-i", clip_filter(kind)]
+    if audio:
+        cmd += ["-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000"]
+    cmd += [
+        "-t", str(seconds),
+        "-c:v", "mpeg2video", "-q:v", "3", "-flags", "+ilme+ildct", "-top", "1",
+    ]
+    if audio:
+        cmd += ["-c:a", "aac", "-b:a", "192k"]
+    tmp = path + ".part.mkv"
+    subprocess.run(cmd + [tmp], check=True, timeout=max(120, seconds * 10))
+    os.replace(tmp, path)
+    return path
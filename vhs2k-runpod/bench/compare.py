@@ -0,0 +1,81 @@
+"""Compare two bench/run.py result files.
+
+    python bench/compare.py base.json new.json [--stages]
+
+Prints the median wall time per clip/profile (and optionally per stage) with the
+relative change; negative deltas are faster.
+"""
+import argparse
+import json
+import statistics
+import sys
+
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def group(report):
+    runs = {}
+    for entry in report.get("results", []):
+        if entry.get("status") != "completed":
+            continue
+        runs.setdefault((entry["clip"], entry["profile"]), []).append(entry)
+    return runs
+
+
+def median_wall(entries, stage=None):
+    if stage is None:
+        values = [e["wall_sec"] for e in entries]
+    else:
+        values = [e["stages"][stage]["wall_sec"] for e in entries if stage in e.get("stages", {})]
+    return statistics.median(values) if values else None
+
+
+def fmt_delta(base, new):
+    if base is None or new is None:
+        return "n/a"
+    if base <= 0:
+        return "+0.0%" if new <= 0 else "new"
+    return "%+.1f%%" % (100.0 * (new - base) / base)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--stages", action="store_true", help="also compare per-stage wall time")
+    args = parser.parse_args(argv)
+
+    base_report, new_report = load(args.base), load(args.new)
+    for label, report in (("base", base_report), ("new", new_report)):
+        host = report.get("host", {})
+        print("%-4s %s on %s cpus (budget %s), %s" % (label, report.get("revision"), host.get("cpus"), host.get("cpu_budget", "-"), host.get("ffmpeg")))
+    if base_report.get("settings") != new_report.get("settings"):
+        print("warning: settings differ between runs; deltas may not be comparable")
+    print("")
+
+    base_runs, new_runs = group(base_report), group(new_report)
+    print("%-12s %-14s %-18s %10s %10s %9s" % ("clip", "profile", "stage", "base_s", "new_s", "delta"))
+    for key in sorted(set(base_runs) | set(new_runs)):
+        base_entries, new_entries = base_runs.get(key, []), new_runs.get(key, [])
+        rows = [("total", median_wall(base_entries) if base_entries else None,
+                 median_wall(new_entries) if new_entries else None)]
+        if args.stages:
+            names = []
+            for e in base_entries + new_entries:
+                names.extend(n for n in e.get("stages", {}) if n != "total" and n not in names)
+            rows.extend((n, median_wall(base_entries, n), median_wall(new_entries, n)) for n in names)
+        for stage, base, new in rows:
+            print("%-12s %-14s %-18s %10s %10s %9s" % (
+                key[0], key[1], stage,
+                "-" if base is None else "%.2f" % base,
+                "-" if new is None else "%.2f" % new,
+                fmt_delta(base, new),
+            ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
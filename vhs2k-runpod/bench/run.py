@@ -0,0 +1,212 @@
+"""End-to-end throughput benchmark.
+
+Generates synthetic 480i clips, serves them over a local HTTP server and runs
+handler() once per clip/profile with the stub upscaler, then writes per-stage
+wall time and fps as JSON:
+
+    python bench/run.py --seconds 10 --output bench-results/$(git rev-parse --short HEAD).json
+    python bench/compare.py bench-results/old.json bench-results/new.json
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+SCHEMA_VERSION = 1
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the VHS2K pipeline on synthetic clips")
+    parser.add_argument("--seconds", type=int, default=10, help="clip length in seconds")
+    parser.add_argument("--clips", default="interlaced,noisy,dark", help="comma list of clip kinds")
+    parser.add_argument("--profiles", default="", help="comma list of profiles (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per clip/profile")
+    parser.add_argument("--target-resolution", default="", help="override target_resolution, e.g. 1440x1080")
+    parser.add_argument("--request", default="{}", help="extra request fields as JSON, e.g. '{\"segmented\": true}'")
+    parser.add_argument("--work-dir", default="", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--clip-dir", default="", help="where generated clips are cached (default: <work-dir>/clips)")
+    parser.add_argument("--output", default="-", help="result JSON path, - for stdout")
+    parser.add_argument("--keep", action="store_true", help="keep outputs and scratch files")
+    return parser.parse_args(argv)
+
+
+def configure_env(work_dir):
+    # Config reads the environment at import time, so this runs before any pipeline import.
+    # Forced values keep runs comparable: no GPU, no resume shortcuts, no uploads.
+    os.environ["UPSCALER_BACKEND"] = "stub"
+    os.environ["RESUME_JOBS"] = "false"
+    os.environ["CACHE_MAX_GB"] = "0"
+    os.environ["ALLOW_HTTP_INPUT"] = "true"
+    os.environ["S3_ENDPOINT"] = ""
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["METRICS_TEXTFILE"] = ""
+    os.environ.setdefault("PROGRESS_SINK", "none")
+    os.environ["WORK_DIR"] = os.path.join(work_dir, "jobs")
+    os.environ["TMP_DIR"] = os.path.join(work_dir, "tmp")
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The input probe hangs up after the first bytes; that broken pipe is expected
+        pass
+
+
+def serve_directory(path):
+    server = _QuietServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=path))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def git_revision():
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, stderr=subprocess.DEVNULL)
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "."], cwd=APP_DIR, stderr=subprocess.DEVNULL)
+        return rev.decode().strip() + ("-dirty" if dirty else "")
+    except Exception:
+        return None
+
+
+def ffmpeg_version():
+    try:
+        out = subprocess.check_output(["ffmpeg", "-hide_banner", "-version"], stderr=subprocess.DEVNULL, timeout=30)
+        return out.decode("utf-8", errors="ignore").splitlines()[0]
+    except Exception:
+        return None
+
+
+def stage_summary(timings):
+    stages = {}
+    for name, data in (timings or {}).items():
+        stages[name] = {
+            "wall_sec": data.get("wall_sec"),
+            "cpu_sec": round(data.get("cpu_sec", 0.0) + data.get("self_cpu_sec", 0.0), 3),
+            "frames": data.get("frames"),
+            "fps": data.get("fps"),
+        }
+        if data.get("threads"):
+            stages[name]["threads"] = data["threads"]
+    return stages
+
+
+def run_one(handler, url, profile, extra, keep):
+    request = dict(extra)
+    request["input_url"] = url
+    request["profile"] = profile
+    started = time.time()
+    result = handler({"input": request})
+    wall = time.time() - started
+    metadata = result.get("metadata") or {}
+    entry = {
+        "status": result.get("status"),
+        "wall_sec": round(wall, 3),
+        "stages": stage_summary(metadata.get("timings")),
+    }
+    if result.get("status") != "completed":
+        entry["error_code"] = result.get("error_code")
+        entry["error_message"] = result.get("error_message")
+        return entry
+    entry["encoder"] = metadata.get("encoder")
+    entry["plan"] = (metadata.get("plan") or {}).get("stages")
+    duration = metadata.get("duration_sec") or 0
+    # Media seconds processed per wall second; 1.0 is real time
+    entry["speed"] = round(duration / wall, 3) if duration and wall > 0 else None
+    output_url = result.get("output_url") or ""
+    if output_url.startswith("file://"):
+        output_path = output_url[len("file://"):]
+        entry["output_bytes"] = os.path.getsize(output_path) if os.path.exists(output_path) else None
+        if not keep:
+            shutil.rmtree(os.path.dirname(output_path), ignore_errors=True)
+    return entry
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="vhs2k-bench-"))
+    clip_dir = os.path.abspath(args.clip_dir or os.path.join(work_dir, "clips"))
+    configure_env(work_dir)
+    sys.path.insert(0, APP_DIR)
+    from config import Config, PROFILES
+    from handler import handler
+    import clips
+    import scheduler
+
+    kinds = [k.strip() for k in args.clips.split(",") if k.strip()]
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()] or sorted(PROFILES)
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        sys.exit("unknown profile(s): %s" % ", ".join(unknown))
+    extra = json.loads(args.request)
+    if args.target_resolution:
+        extra["target_resolution"] = args.target_resolution
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "cpu_budget": scheduler.available_cores(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "settings": {
+            "seconds": args.seconds,
+            "clips": kinds,
+            "profiles": profiles,
+            "repeat": args.repeat,
+            "request": extra,
+            "upscaler_backend": "stub",
+            "thread_splits": Config.THREAD_SPLITS,
+        },
+        "results": [],
+    }
+
+    os.makedirs(clip_dir, exist_ok=True)
+    server = serve_directory(clip_dir)
+    try:
+        for kind in kinds:
+            path = clips.generate_clip(clip_dir, kind, args.seconds)
+            url = "http://127.0.0.1:%d/%s" % (server.server_port, os.path.basename(path))
+            for profile in profiles:
+                for run in range(args.repeat):
+                    entry = run_one(handler, url, profile, extra, args.keep)
+                    entry.update({"clip": kind, "profile": profile, "run": run})
+                    report["results"].append(entry)
+                    sys.stderr.write("%-10s %-14s run %d: %s in %.1fs\n" % (
+                        kind, profile, run, entry["status"], entry["wall_sec"]))
+    finally:
+        server.shutdown()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    failed = [r for r in report["results"] if r["status"] != "completed"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class InputCache(object):
+    # Content-addressed store of downloaded inputs and their probe results, with LRU eviction.
+    # Layout: <root>/<key>/input, <root>/<key>/probe.json, <root>/<key>/entry.json
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(identity):
+        # Without a validator the URL alone could hide a changed object
+        if not (identity.get("etag") or identity.get("content_length")):
+            return None
+        blob = json.dumps(identity, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def _touch(self, key):
+        path = os.path.join(self._entry_dir(key), "entry.json")
+        with open(path, "w") as f:
+            json.dump({"key": key, "last_used": time.time()}, f)
+
+    def lookup(self, key):
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            input_path = os.path.join(entry_dir, "input")
+            if not os.path.exists(input_path):
+                return None
+            probe = None
+            try:
+                with open(os.path.join(entry_dir, "probe.json"), "r") as f:
+                    probe = json.load(f)
+            except Exception:
+                pass
+            self._touch(key)
+            return {"input": input_path, "probe": probe}
+
+    def store_input(self, key, src_path):
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return None
+        with self._lock:
+            self._evict(size)
+            entry_dir = self._entry_dir(key)
+            os.makedirs(entry_dir, exist_ok=True)
+            dst = os.path.join(entry_dir, "input")
+            tmp = dst + ".tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            try:
+                # Same filesystem as TMP_DIR: no data is copied
+                os.link(src_path, tmp)
+            except OSError:
+                shutil.copyfile(src_path, tmp)
+            os.replace(tmp, dst)
+            self._touch(key)
+            return dst
+
+    def store_probe(self, key, probe):
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                return
+            tmp = os.path.join(entry_dir, "probe.json.tmp")
+            with open(tmp, "w") as f:
+                json.dump(probe, f)
+            os.replace(tmp, os.path.join(entry_dir, "probe.json"))
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = 0
+            for fname in os.listdir(entry_dir):
+                try:
+                    size += os.path.getsize(os.path.join(entry_dir, fname))
+                except OSError:
+                    pass
+            try:
+                last_used = os.path.getmtime(os.path.join(entry_dir, "entry.json"))
+            except OSError:
+                last_used = 0
+            entries.append((last_used, size, entry_dir))
+        return entries
+
+    def _evict(self, incoming):
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        while entries and total + incoming > self.max_bytes:
+            _, size, entry_dir = entries.pop(0)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_input_cache(root, max_gb):
+    global _cache
+    if max_gb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.root != root:
+            _cache = InputCache(root, int(max_gb * (1024 ** 3)))
+        return _cache
@@ -0,0 +1,113 @@
+import re
+import subprocess
+import threading
+import time
+
+import encoders
+import upscaler
+from config import Config
+
+FILTER_LINE_RE = re.compile(r"^\s*[T.][S.][C.]?\s+(\w+)\s+\S*->\S*", re.M)
+
+
+def _ffmpeg_lines(*args):
+    try:
+        out = subprocess.check_output(["ffmpeg", "-hide_banner"] + list(args), stderr=subprocess.DEVNULL, timeout=30)
+    except Exception:
+        return None
+    return out.decode("utf-8", errors="ignore")
+
+
+def list_ffmpeg_filters():
+    text = _ffmpeg_lines("-filters")
+    return set(FILTER_LINE_RE.findall(text)) if text else set()
+
+
+def list_ffmpeg_hwaccels():
+    text = _ffmpeg_lines("-hwaccels")
+    if not text:
+        return []
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    return [l for l in lines if not l.endswith(":")]
+
+
+def ffmpeg_version():
+    text = _ffmpeg_lines("-version")
+    return text.splitlines()[0] if text else None
+
+
+class WorkerCapabilities(object):
+    # What this worker's container can actually run, probed once. Empty filter sets mean
+    # the probe itself failed; lookups then answer "yes" and let the stage surface the error.
+    def __init__(self, ffmpeg=None, encoders=None, filters=None, hwaccels=None, upscaler=None, probe_sec=0.0):
+        self.ffmpeg = ffmpeg
+        self.encoders = encoders or {}
+        self.filters = filters or set()
+        self.hwaccels = hwaccels or []
+        self.upscaler = upscaler or {}
+        self.probe_sec = probe_sec
+
+    def has_filter(self, name):
+        return not self.filters or name in self.filters
+
+    def missing_filters(self, names):
+        return [n for n in names if not self.has_filter(n)]
+
+    def has_codec(self, codec):
+        return any(b.codec == codec for b in self.encoders.values())
+
+    def upscaler_available(self):
+        return bool(self.upscaler.get("available"))
+
+    def has_model(self, model):
+        # None means the backend does not enumerate models (stub, or no models dir found)
+        models = self.upscaler.get("models")
+        return models is None or model in models
+
+    def summary(self):
+        up = self.upscaler
+        return "ffmpeg=%s encoders=%s filters=%d hwaccels=%s upscaler=%s%s models=%s (probed in %.1fs)" % (
+            (self.ffmpeg or "missing").split(" Copyright")[0].strip(),
+            ",".join(sorted(self.encoders)) or "none",
+            len(self.filters),
+            ",".join(self.hwaccels) or "none",
+            up.get("backend"),
+            "" if up.get("available") else " (unavailable: %s)" % up.get("error"),
+            "any" if up.get("models") is None else ",".join(sorted(up["models"])) or "none",
+            self.probe_sec,
+        )
+
+    def as_dict(self):
+        return {
+            "ffmpeg": self.ffmpeg,
+            "encoders": sorted(self.encoders),
+            "filters": len(self.filters),
+            "hwaccels": list(self.hwaccels),
+            "upscaler": dict(self.upscaler, models=sorted(self.upscaler["models"]) if self.upscaler.get("models") is not None else None),
+        }
+
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def probe(refresh=False):
+    # Worker init calls this once; the container's binaries and models do not change afterwards
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None or refresh:
+            started = time.time()
+            _capabilities = WorkerCapabilities(
+                ffmpeg=ffmpeg_version(),
+                encoders=encoders.available_encoders(refresh=refresh),
+                filters=list_ffmpeg_filters(),
+                hwaccels=list_ffmpeg_hwaccels(),
+                upscaler=upscaler.describe_backend(Config.UPSCALER_BACKEND),
+            )
+            _capabilities.probe_sec = time.time() - started
+        return _capabilities
+
+
+def get():
+    # Jobs outside a worker (bench, ad-hoc scripts) probe lazily on first use
+    return _capabilities if _capabilities is not None else probe()
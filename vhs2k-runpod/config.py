@@ -38,35 +38,100 @@ def _get_str(key, default=""):
 class Config(object):
     APP_ENV = _get_str("APP_ENV", "production")
     LOG_LEVEL = _get_str("LOG_LEVEL", "info")
+    LOG_DIR = _get_str("LOG_DIR", "/workspace/logs")
+    LOG_STAGE_EVENTS = _get_int("LOG_STAGE_EVENTS", 100)
+    LOG_DETAIL_CHARS = _get_int("LOG_DETAIL_CHARS", 2000)
+    LOG_RETENTION_HOURS = _get_float("LOG_RETENTION_HOURS", 72.0)
+    LOG_DIR_MAX_MB = _get_int("LOG_DIR_MAX_MB", 512)
     WORK_DIR = _get_str("WORK_DIR", "/workspace/jobs")
     TMP_DIR = _get_str("TMP_DIR", "/workspace/tmp")
+    CACHE_DIR = _get_str("CACHE_DIR", "/workspace/cache")
+    CACHE_MAX_GB = _get_float("CACHE_MAX_GB", 0.0)
 
     MAX_JOB_SECONDS = _get_int("MAX_JOB_SECONDS", 28800)
     STAGE_TIMEOUT_DOWNLOAD = _get_int("STAGE_TIMEOUT_DOWNLOAD", 1800)
     STAGE_TIMEOUT_PROCESS = _get_int("STAGE_TIMEOUT_PROCESS", 25200)
     STAGE_TIMEOUT_UPLOAD = _get_int("STAGE_TIMEOUT_UPLOAD", 1800)
+    PROGRESS_SINK = _get_str("PROGRESS_SINK", "runpod")
+    PROGRESS_INTERVAL_SEC = _get_float("PROGRESS_INTERVAL_SEC", 10.0)
+    STDERR_TAIL_BYTES = _get_int("STDERR_TAIL_BYTES", 16384)
+    METRICS_PORT = _get_int("METRICS_PORT", 0)
+    METRICS_TEXTFILE = _get_str("METRICS_TEXTFILE", "")
     CLEANUP_TEMP = _get_bool("CLEANUP_TEMP", True)
     KEEP_INTERMEDIATES = _get_bool("KEEP_INTERMEDIATES", False)
+    RESUME_JOBS = _get_bool("RESUME_JOBS", True)
+
+    MAX_CONCURRENT_JOBS = _get_int("MAX_CONCURRENT_JOBS", 1)
+    CORES_PER_JOB = _get_int("CORES_PER_JOB", 4)
+    THREAD_SPLITS = _get_str("THREAD_SPLITS", "")
+    DOWNLOAD_SLOTS = _get_int("DOWNLOAD_SLOTS", 2)
+    CPU_SLOTS = _get_int("CPU_SLOTS", 1)
+    GPU_SLOTS = _get_int("GPU_SLOTS", 1)
+    UPLOAD_SLOTS = _get_int("UPLOAD_SLOTS", 2)
+    JOB_DISK_FACTOR = _get_float("JOB_DISK_FACTOR", 3.0)
+    MIN_FREE_DISK_GB = _get_float("MIN_FREE_DISK_GB", 1.0)
+    SCRATCH_STALE_HOURS = _get_float("SCRATCH_STALE_HOURS", 6.0)
+    ADMISSION_TIMEOUT_SEC = _get_int("ADMISSION_TIMEOUT_SEC", 1800)
+    BATCH_MAX_ITEMS = _get_int("BATCH_MAX_ITEMS", 50)
+    ESTIMATE_CHECK = _get_str("ESTIMATE_CHECK", "enforce")
+    ESTIMATE_HISTORY_FILE = _get_str("ESTIMATE_HISTORY_FILE", "/workspace/cache/throughput.json")
+    ESTIMATE_COST_PER_HOUR = _get_float("ESTIMATE_COST_PER_HOUR", 0.0)
+    PREVIEW_WINDOWS = _get_int("PREVIEW_WINDOWS", 4)
+    PREVIEW_MAX_WINDOWS = _get_int("PREVIEW_MAX_WINDOWS", 12)
+    PREVIEW_SECONDS = _get_float("PREVIEW_SECONDS", 5.0)
+    PREVIEW_OUTPUT = _get_str("PREVIEW_OUTPUT", "clips")
+    PREVIEW_SCENE_THRESHOLD = _get_float("PREVIEW_SCENE_THRESHOLD", 0.3)
+    PREVIEW_WORKERS = _get_int("PREVIEW_WORKERS", 0)
 
     MAX_INPUT_GB = _get_int("MAX_INPUT_GB", 20)
     ALLOW_HTTP_INPUT = _get_bool("ALLOW_HTTP_INPUT", False)
+    DOWNLOAD_CONNECTIONS = _get_int("DOWNLOAD_CONNECTIONS", 4)
+    DOWNLOAD_PART_MB = _get_int("DOWNLOAD_PART_MB", 32)
+    STREAM_INPUT = _get_bool("STREAM_INPUT", False)
+    STREAM_INPUT_START_MB = _get_int("STREAM_INPUT_START_MB", 64)
     ALLOWED_EXTENSIONS = [e.strip().lower() for e in _get_str("ALLOWED_EXTENSIONS", "mp4,mov,mkv,avi,mpeg,mpg,m4v").split(",") if e.strip()]
 
     DEFAULT_TARGET_RES = _get_str("DEFAULT_TARGET_RES", "2048x1080")
     DEFAULT_CODEC = _get_str("DEFAULT_CODEC", "h265")
     DEFAULT_CONTAINER = _get_str("DEFAULT_CONTAINER", "mp4")
+    LADDER_RUNGS = _get_str("LADDER_RUNGS", "1080,720,480")
+    LADDER_SEGMENT_SECONDS = _get_int("LADDER_SEGMENT_SECONDS", 4)
+    LADDER_MAX_BPP = _get_float("LADDER_MAX_BPP", 0.12)
     DEFAULT_CRF_H265 = _get_int("DEFAULT_CRF_H265", 20)
     DEFAULT_CRF_H264 = _get_int("DEFAULT_CRF_H264", 18)
     DEFAULT_PRESET = _get_str("DEFAULT_PRESET", "medium")
+    ENCODER = _get_str("ENCODER", "auto")
+    DEFAULT_ENCODER_QUALITY = _get_str("DEFAULT_ENCODER_QUALITY", "archival")
     KEEP_AUDIO = _get_bool("KEEP_AUDIO", True)
     AUDIO_CODEC = _get_str("AUDIO_CODEC", "aac")
     AUDIO_BITRATE = _get_str("AUDIO_BITRATE", "192k")
+    AUDIO_COPY = _get_bool("AUDIO_COPY", True)
 
     DEFAULT_DEINTERLACE = _get_str("DEFAULT_DEINTERLACE", "auto")
+    ANALYSIS_WINDOWS = _get_int("ANALYSIS_WINDOWS", 8)
+    ANALYSIS_WINDOW_FRAMES = _get_int("ANALYSIS_WINDOW_FRAMES", 60)
+    INTERLACE_RATIO_THRESHOLD = _get_float("INTERLACE_RATIO_THRESHOLD", 0.3)
     DEFAULT_DENOISE = _get_int("DEFAULT_DENOISE", 35)
     DEFAULT_SHARPEN = _get_int("DEFAULT_SHARPEN", 20)
     DEFAULT_MODEL = _get_str("DEFAULT_MODEL", "realesrgan-x2plus")
     UPSCALE_FACTOR = _get_int("UPSCALE_FACTOR", 2)
+    PLANNER_RESIZE_SLACK = _get_float("PLANNER_RESIZE_SLACK", 1.5)
+    UPSCALER_BACKEND = _get_str("UPSCALER_BACKEND", "realesrgan-ncnn-py")
+    UPSCALE_QUEUE_BATCHES = _get_int("UPSCALE_QUEUE_BATCHES", 2)
+    UPSCALE_TILE = _get_int("UPSCALE_TILE", 0)
+    UPSCALE_TILE_OVERLAP = _get_int("UPSCALE_TILE_OVERLAP", 16)
+    UPSCALE_MEMORY_FRACTION = _get_float("UPSCALE_MEMORY_FRACTION", 0.5)
+    DEDUP_FRAMES = _get_bool("DEDUP_FRAMES", False)
+    DEDUP_THRESHOLD = _get_float("DEDUP_THRESHOLD", 2.5)
+    DEDUP_PIXEL_TOLERANCE = _get_int("DEDUP_PIXEL_TOLERANCE", 24)
+    PREWARM_UPSCALER = _get_bool("PREWARM_UPSCALER", False)
+    STREAMING_MODE = _get_bool("STREAMING_MODE", False)
+    STREAM_BATCH_FRAMES = _get_int("STREAM_BATCH_FRAMES", 32)
+    SEGMENTED_MODE = _get_bool("SEGMENTED_MODE", False)
+    SEGMENT_SECONDS = _get_int("SEGMENT_SECONDS", 300)
+    SEGMENT_SCENE_THRESHOLD = _get_float("SEGMENT_SCENE_THRESHOLD", 0.0)
+    SEGMENT_WORKERS = _get_int("SEGMENT_WORKERS", 0)
+    SEGMENT_RETRIES = _get_int("SEGMENT_RETRIES", 1)
 
     DEFAULT_BRIGHTNESS = _get_float("DEFAULT_BRIGHTNESS", 0.0)
     DEFAULT_GAMMA = _get_float("DEFAULT_GAMMA", 1.0)
@@ -84,6 +149,9 @@ class Config(object):
     S3_OUTPUT_PREFIX = _get_str("S3_OUTPUT_PREFIX", "vhs2k/")
     S3_USE_SSL = _get_bool("S3_USE_SSL", True)
     S3_SIGNED_URL_TTL_SEC = _get_int("S3_SIGNED_URL_TTL_SEC", 604800)
+    S3_PART_MB = _get_int("S3_PART_MB", 16)
+    S3_MAX_CONCURRENCY = _get_int("S3_MAX_CONCURRENCY", 8)
+    S3_LIVE_UPLOAD = _get_bool("S3_LIVE_UPLOAD", False)
 
     WEBHOOK_URL = _get_str("WEBHOOK_URL", "")
     WEBHOOK_SECRET = _get_str("WEBHOOK_SECRET", "")
@@ -101,6 +169,7 @@ PROFILES = {
         "codec": "h264",
         "crf": 20,
         "preset": "faster",
+        "encoder_quality": "preview",
     },
     "balanced": {
         "deinterlace": "auto",
@@ -113,6 +182,7 @@ PROFILES = {
         "codec": "h265",
         "crf": 20,
         "preset": "medium",
+        "encoder_quality": "standard",
     },
     "max_cleanup": {
         "deinterlace": "on",
@@ -125,6 +195,7 @@ PROFILES = {
         "codec": "h265",
         "crf": 18,
         "preset": "slow",
+        "encoder_quality": "archival",
     },
     "dark_footage": {
         "deinterlace": "auto",
@@ -137,5 +208,6 @@ PROFILES = {
         "codec": "h265",
         "crf": 20,
         "preset": "medium",
+        "encoder_quality": "standard",
     },
 }
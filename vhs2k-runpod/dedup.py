@@ -0,0 +1,115 @@
+import collections
+import operator
+
+BYTES_PER_PIXEL = 3  # frames are packed rgb24
+GRID = (32, 24)
+# Sample every other row and pixel; the green channel stands in for luma
+SAMPLE_STEP = 2
+
+
+def frame_signature(frame, wh):
+    # Mean green level of each GRID tile. Averaging ~100 samples per tile keeps tape noise
+    # well under the threshold while a small moving object still shifts its tile's mean.
+    w, h = wh
+    cols, rows = min(GRID[0], w), min(GRID[1], h)
+    row_bytes = w * BYTES_PER_PIXEL
+    step = SAMPLE_STEP * BYTES_PER_PIXEL
+    sums = [0] * (cols * rows)
+    counts = [0] * (cols * rows)
+    edges = [(c * w // cols, (c + 1) * w // cols) for c in range(cols)]
+    for y in range(0, h, SAMPLE_STEP):
+        base = (y * rows // h) * cols
+        offset = y * row_bytes + 1
+        for c, (x0, x1) in enumerate(edges):
+            x0 += (-x0) % SAMPLE_STEP
+            samples = frame[offset + x0 * BYTES_PER_PIXEL:offset + x1 * BYTES_PER_PIXEL:step]
+            sums[base + c] += sum(samples)
+            counts[base + c] += len(samples)
+    return [s / float(n) if n else 0.0 for s, n in zip(sums, counts)]
+
+
+def signature_distance(a, b):
+    # Largest per-tile change: one changed region is enough to keep a frame
+    return max(map(abs, map(operator.sub, a, b)))
+
+
+def frames_match(a, b, wh, tolerance):
+    # Pixel check behind the tile pre-filter: motion that stays inside one tile leaves its
+    # mean untouched, so every green value must also be within tolerance. Every pixel is
+    # compared because a 1 px move can hide between sampled columns.
+    w, h = wh
+    row_bytes = w * BYTES_PER_PIXEL
+    for start in range(1, h * row_bytes, row_bytes):
+        row_a = a[start:start + row_bytes - 1:BYTES_PER_PIXEL]
+        row_b = b[start:start + row_bytes - 1:BYTES_PER_PIXEL]
+        if row_a != row_b and max(map(abs, map(operator.sub, row_a, row_b))) > tolerance:
+            return False
+    return True
+
+
+class FrameDeduper(object):
+    # Collapses runs of identical or near-identical frames before the upscaler and
+    # replicates each run's upscaled representative afterwards, so the frame count and
+    # timing of the output stay the same. Every frame is compared with the first frame of
+    # its run rather than its neighbour, so a slow fade cannot drift through unnoticed.
+    def __init__(self, wh, threshold, pixel_tolerance):
+        self.wh = wh
+        self.threshold = threshold
+        self.pixel_tolerance = pixel_tolerance
+        self.frames = 0
+        self.unique = 0
+        self._runs = collections.deque()
+        self._rep = None
+        self._rep_sig = None
+
+    @property
+    def skipped(self):
+        return self.frames - self.unique
+
+    def _is_duplicate(self, frame):
+        if self._rep is None:
+            return False
+        if frame == self._rep:
+            return True
+        if self.threshold <= 0:
+            return False
+        if self._rep_sig is None:
+            self._rep_sig = frame_signature(self._rep, self.wh)
+        if signature_distance(self._rep_sig, frame_signature(frame, self.wh)) > self.threshold:
+            return False
+        return frames_match(self._rep, frame, self.wh, self.pixel_tolerance)
+
+    def batches(self, source):
+        # Yields batches holding only run representatives, keeping the source batch size
+        out = []
+        for batch in source:
+            for frame in batch:
+                self.frames += 1
+                if self._is_duplicate(frame):
+                    self._runs[-1] += 1
+                    continue
+                self._rep, self._rep_sig = frame, None
+                self._runs.append(1)
+                self.unique += 1
+                out.append(frame)
+                if len(out) >= len(batch):
+                    yield out
+                    out = []
+        if out:
+            yield out
+
+    def expand(self, upscaled):
+        # A run's length is only final once the next representative has been read, so each
+        # upscaled frame is held back until the following one arrives
+        pending = None
+        for frame in upscaled:
+            if pending is not None:
+                for _ in range(self._runs.popleft()):
+                    yield pending
+            pending = frame
+        if pending is not None:
+            for _ in range(self._runs.popleft()):
+                yield pending
+
+    def stats(self):
+        return {"frames": self.frames, "upscaled": self.unique, "skipped": self.skipped}
@@ -0,0 +1,237 @@
+import re
+import subprocess
+import threading
+
+# x264/x265 preset names, fastest first; requests and profiles use this vocabulary for every backend
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow", "placebo"]
+
+QUALITY_TIERS = {"preview": 1, "standard": 2, "archival": 3}
+
+# What `auto` encodes with when the worker has it. The speed and quality ranks below are
+# not measured yet (bench/ has no encoder comparison), so they only order the fallbacks
+# for workers built without these.
+DEFAULT_ENCODERS = {"h264": "libx264", "h265": "libx265", "av1": "libsvtav1"}
+
+ENCODER_LINE_RE = re.compile(r"^\s*V[\w.]{5}\s+(\S+)", re.M)
+
+
+class EncoderError(Exception):
+    pass
+
+
+def preset_index(preset):
+    try:
+        return X264_PRESETS.index(preset)
+    except ValueError:
+        return X264_PRESETS.index("medium")
+
+
+def _scale_index(preset, fastest, slowest):
+    # Map the x264 preset position linearly onto another encoder's preset range; placebo has
+    # no counterpart and maps like veryslow
+    last = X264_PRESETS.index("veryslow")
+    frac = min(preset_index(preset), last) / float(last)
+    return int(round(fastest + (slowest - fastest) * frac))
+
+
+class EncoderBackend(object):
+    # speed: relative throughput at equal preset (higher is faster)
+    # quality: best QUALITY_TIERS level the encoder holds at typical VHS bitrates
+    name = None
+    codec = None
+    hardware = False
+    speed = 0
+    quality = 0
+
+    def video_args(self, crf, preset):
+        raise NotImplementedError
+
+    def thread_args(self, threads):
+        return ["-threads", str(threads)]
+
+
+class X264Encoder(EncoderBackend):
+    name = "libx264"
+    codec = "h264"
+    speed = 2
+    quality = 3
+
+    def video_args(self, crf, preset):
+        # The preset vocabulary is x264's own, so it goes through unmapped
+        return ["-c:v", self.name, "-crf", str(crf), "-preset", preset]
+
+
+class X265Encoder(X264Encoder):
+    name = "libx265"
+    codec = "h265"
+    speed = 0
+
+    def thread_args(self, threads):
+        # x265 sizes its own thread pool and ignores -threads
+        return ["-x265-params", "pools=%d" % threads]
+
+
+class SvtHevcEncoder(EncoderBackend):
+    name = "libsvt_hevc"
+    codec = "h265"
+    speed = 3
+    quality = 2
+
+    def video_args(self, crf, preset):
+        # SVT-HEVC presets run 0 (slowest) .. 11 (fastest); constant QP stands in for CRF
+        return ["-c:v", self.name, "-rc", "0", "-qp", str(crf), "-preset", str(_scale_index(preset, 11, 2))]
+
+
+class SvtAv1Encoder(EncoderBackend):
+    name = "libsvtav1"
+    codec = "av1"
+    speed = 2
+    quality = 3
+
+    def video_args(self, crf, preset):
+        # AV1 CRF runs 0..63; x26x CRF 18..28 lands around 27..42 for similar quality
+        av1_crf = max(1, min(63, int(round(crf * 1.5))))
+        return ["-c:v", self.name, "-crf", str(av1_crf), "-preset", str(_scale_index(preset, 12, 4))]
+
+    def thread_args(self, threads):
+        return ["-svtav1-params", "lp=%d" % threads]
+
+
+class AomAv1Encoder(SvtAv1Encoder):
+    name = "libaom-av1"
+    speed = -1
+
+    def video_args(self, crf, preset):
+        av1_crf = max(1, min(63, int(round(crf * 1.5))))
+        return ["-c:v", self.name, "-crf", str(av1_crf), "-b:v", "0", "-cpu-used", str(_scale_index(preset, 8, 3)), "-row-mt", "1"]
+
+    def thread_args(self, threads):
+        return ["-threads", str(threads)]
+
+
+class NvencEncoder(EncoderBackend):
+    hardware = True
+    speed = 5
+
+    def video_args(self, crf, preset):
+        # NVENC p1 (fastest) .. p7 (slowest); constant-quality VBR keeps CRF semantics
+        return [
+            "-c:v", self.name, "-preset", "p%d" % _scale_index(preset, 1, 7), "-tune", "hq",
+            "-rc", "vbr", "-cq", str(crf), "-b:v", "0"
+        ]
+
+    def thread_args(self, threads):
+        return []
+
+
+class H264NvencEncoder(NvencEncoder):
+    name = "h264_nvenc"
+    codec = "h264"
+    quality = 1
+
+
+class HevcNvencEncoder(NvencEncoder):
+    name = "hevc_nvenc"
+    codec = "h265"
+    quality = 2
+
+
+class Av1NvencEncoder(NvencEncoder):
+    name = "av1_nvenc"
+    codec = "av1"
+    quality = 2
+
+
+BACKENDS = dict((cls.name, cls) for cls in (
+    X264Encoder, X265Encoder, SvtHevcEncoder, SvtAv1Encoder, AomAv1Encoder,
+    H264NvencEncoder, HevcNvencEncoder, Av1NvencEncoder,
+))
+
+
+def list_ffmpeg_encoders():
+    try:
+        out = subprocess.check_output(["ffmpeg", "-hide_banner", "-encoders"], stderr=subprocess.DEVNULL, timeout=30)
+    except Exception:
+        return set()
+    return set(ENCODER_LINE_RE.findall(out.decode("utf-8", errors="ignore")))
+
+
+def _hardware_usable(name):
+    # ffmpeg lists NVENC whenever it was compiled in; only a real encode proves a GPU is there
+    cmd = [
+        "ffmpeg", "-hide_banner", "-v", "error", "-f", "lavfi", "-i", "color=black:s=256x256:d=0.1",
+        "-frames:v", "1", "-c:v", name, "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30).returncode == 0
+    except Exception:
+        return False
+
+
+_available = None
+_available_lock = threading.Lock()
+
+
+def available_encoders(refresh=False):
+    # Detected once per worker; encoder support does not change while the container runs
+    global _available
+    with _available_lock:
+        if _available is None or refresh:
+            listed = list_ffmpeg_encoders()
+            found = {}
+            for name, cls in BACKENDS.items():
+                if name not in listed:
+                    continue
+                if cls.hardware and not _hardware_usable(name):
+                    continue
+                found[name] = cls()
+            _available = found
+        return _available
+
+
+def select_encoder(codec, quality="archival", requested=None):
+    # The codec's default encoder when the worker has it; otherwise the fastest available one
+    # that holds the quality tier
+    available = available_encoders()
+    if requested and requested != "auto":
+        backend = available.get(requested)
+        if backend is None:
+            raise EncoderError("encoder %s is not available" % requested)
+        if backend.codec != codec:
+            raise EncoderError("encoder %s does not produce %s" % (requested, codec))
+        return backend
+    if DEFAULT_ENCODERS.get(codec) in available:
+        return available[DEFAULT_ENCODERS[codec]]
+    tier = QUALITY_TIERS.get(quality, QUALITY_TIERS["archival"])
+    candidates = [b for b in available.values() if b.codec == codec]
+    if not candidates:
+        raise EncoderError("no %s encoder available" % codec)
+    good = [b for b in candidates if b.quality >= tier]
+    if not good:
+        best = max(b.quality for b in candidates)
+        good = [b for b in candidates if b.quality == best]
+    return max(good, key=lambda b: b.speed)
+
+
+def stream_args(args, index):
+    # Pins option/value pairs to one output video stream ("-crf" -> "-crf:v:1") for outputs
+    # that carry several encodes
+    pinned = list(args)
+    for i in range(0, len(pinned) - 1, 2):
+        option = pinned[i][:-2] if pinned[i].endswith(":v") else pinned[i]
+        pinned[i] = "%s:v:%d" % (option, index)
+    return pinned
+
+
+def thread_args(name, threads):
+    backend = BACKENDS.get(name)
+    return backend().thread_args(threads) if backend is not None else ["-threads", str(threads)]
+
+
+def intermediate_args(threads=None):
+    # Near-lossless H.264 for staged intermediates that are decoded once and thrown away.
+    # 4:2:0 keeps rgb24 upscaler output off the High 4:4:4 profile; the final encode converts
+    # to BT.709.
+    if H264NvencEncoder.name in available_encoders():
+        return ["-c:v", H264NvencEncoder.name, "-preset", "p1", "-rc", "constqp", "-qp", "16", "-pix_fmt", "yuv420p"]
+    return ["-c:v", X264Encoder.name, "-crf", "18", "-preset", "veryfast", "-pix_fmt", "yuv420p"] + (["-threads", str(threads)] if threads else [])
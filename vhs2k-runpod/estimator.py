@@ -0,0 +1,232 @@
+import json
+import os
+import threading
+import time
+
+import scratch
+from config import Config
+
+MB = 1024 * 1024
+# Built-in throughput until this worker has measured its own. Video stages are in megapixels
+# per second (source pixels before the upscaler, output pixels after it), transfers in MB/s,
+# probe and analysis in seconds per job.
+DEFAULT_RATES = {
+    "download": 40.0,
+    "upload": 40.0,
+    "segment_split": 200.0,
+    "concat": 200.0,
+    "probe": 2.0,
+    "analyze": 10.0,
+    "preprocess": 20.0,
+}
+UPSCALE_RATES = {"realesrgan-ncnn-py": 3.0, "realesrgan-ncnn": 3.0, "stub": 200.0}
+ENCODE_RATES = {
+    "libx264": 60.0, "libx265": 12.0, "libsvt_hevc": 30.0, "libsvtav1": 15.0, "libaom-av1": 2.0,
+    "h264_nvenc": 250.0, "hevc_nvenc": 200.0, "av1_nvenc": 200.0,
+}
+FIXED_STAGES = ("probe", "analyze")
+TRANSFER_STAGES = ("download", "upload", "segment_split", "concat")
+# Shorter stage runs are mostly setup and say little about throughput
+MIN_SAMPLE_SEC = 1.0
+HISTORY_WEIGHT = 0.3
+AUDIO_BYTES_PER_SEC = 192000 / 8
+
+
+class ThroughputHistory(object):
+    # Measured rates per stage key, smoothed over jobs and kept in a JSON file so a restarted
+    # worker keeps what it learned. Rates from this pod type are what the estimates trust.
+    def __init__(self, path):
+        self.path = path
+        self.rates = {}
+        self._lock = threading.Lock()
+        if path:
+            try:
+                with open(path, "r") as f:
+                    self.rates = json.load(f).get("rates", {})
+            except (OSError, ValueError):
+                self.rates = {}
+
+    def rate(self, key):
+        with self._lock:
+            entry = self.rates.get(key)
+            return entry["rate"] if entry else None
+
+    def update(self, key, value):
+        with self._lock:
+            entry = self.rates.get(key)
+            if entry is None:
+                entry = self.rates[key] = {"rate": value, "samples": 0}
+            else:
+                entry["rate"] = (1 - HISTORY_WEIGHT) * entry["rate"] + HISTORY_WEIGHT * value
+            entry["samples"] += 1
+            entry["updated"] = int(time.time())
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            blob = json.dumps({"version": 1, "rates": self.rates}, indent=1, sort_keys=True)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(blob)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = ThroughputHistory(Config.ESTIMATE_HISTORY_FILE)
+        return _history
+
+
+def _reset_after_fork():
+    global _history, _history_lock
+    _history = None
+    _history_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _megapixels(wh, shape):
+    return wh[0] * wh[1] * shape["fps"] * shape["duration"] / 1e6
+
+
+def _output_megapixels(shape):
+    # Every rendition of a ladder is encoded and stored
+    return sum(_megapixels(wh, shape) for wh in shape.get("renditions") or [shape["target_wh"]])
+
+
+def output_bytes(shape, history=None):
+    history = history or get_history()
+    bpp = history.rate("bpp:%s" % shape["encoder"]) or scratch.OUTPUT_BPP
+    total = _output_megapixels(shape) * 1e6 * bpp / 8.0
+    if shape.get("keep_audio"):
+        total += AUDIO_BYTES_PER_SEC * shape["duration"]
+    return int(total)
+
+
+def stage_plan(shape):
+    # (timings name, history key, work units) for every stage the job will run
+    src = _megapixels(shape["src_wh"], shape)
+    out = _output_megapixels(shape)
+    # One-pass stages get slower per source pixel with every extra rendition
+    encoder = shape["encoder"]
+    if len(shape.get("renditions") or ()) > 1:
+        encoder = "%s:r%d" % (encoder, len(shape["renditions"]))
+    upscaler = "%s:%s" % (shape["backend"], shape["model"])
+    stages = [
+        ("download", "download", shape["input_bytes"] / float(MB)),
+        ("probe", "probe", 1),
+        ("analyze", "analyze", 1),
+    ]
+    if shape["segmented"]:
+        key = "segments:%s:%s:w%d" % (upscaler if shape["upscale"] else "direct", encoder, shape["workers"])
+        stages += [
+            ("segment_split", "segment_split", shape["input_bytes"] / float(MB)),
+            ("segments", key, src),
+            ("concat", "concat", output_bytes(shape) / float(MB)),
+        ]
+    elif not shape["upscale"]:
+        stages.append(("encode", "direct:%s" % encoder, src))
+    elif shape["streaming"]:
+        stages.append(("stream_process", "stream:%s:%s" % (upscaler, encoder), src))
+    else:
+        stages += [
+            ("preprocess", "preprocess", src),
+            ("upscale", "upscale:%s" % upscaler, src),
+            ("encode", "encode:%s" % encoder, out),
+        ]
+    stages.append(("upload", "upload", output_bytes(shape) / float(MB)))
+    return stages
+
+
+def _default_seconds(name, shape):
+    src = _megapixels(shape["src_wh"], shape)
+    out = _output_megapixels(shape)
+    filters = src / DEFAULT_RATES["preprocess"]
+    upscale = src / UPSCALE_RATES.get(shape["backend"], 3.0) if shape["upscale"] else 0.0
+    encode = out / ENCODE_RATES.get(shape["encoder"], 10.0)
+    if name in FIXED_STAGES:
+        return DEFAULT_RATES[name]
+    if name in TRANSFER_STAGES:
+        return None
+    if name == "segments":
+        # CPU stages spread over the workers; every worker shares the one GPU
+        return (filters + encode) / max(1, shape["workers"]) + upscale
+    if name == "stream_process":
+        # Decoder, engine and encoder run at once; filters and encoder share the CPU
+        return max(filters + encode, upscale)
+    if name == "encode" and not shape["upscale"]:
+        return filters + encode
+    return {"preprocess": filters, "upscale": upscale, "encode": encode}[name]
+
+
+def estimate(shape, skip=(), history=None):
+    # Seconds per stage from measured rates where this worker has them, built-in ones
+    # otherwise; "basis" says which the heavy stages used
+    history = history or get_history()
+    stages = {}
+    total = gpu = 0.0
+    measured = defaulted = 0
+    for name, key, units in stage_plan(shape):
+        if name in skip:
+            continue
+        rate = history.rate(key)
+        if rate:
+            seconds = rate if name in FIXED_STAGES else float(units) / rate
+            source = "history"
+        else:
+            seconds = _default_seconds(name, shape)
+            if seconds is None:
+                seconds = float(units) / DEFAULT_RATES[name]
+            source = "default"
+        if name not in FIXED_STAGES and name not in TRANSFER_STAGES:
+            if source == "history":
+                measured += 1
+            else:
+                defaulted += 1
+        if shape["upscale"] and name in ("upscale", "stream_process", "segments"):
+            gpu += seconds
+        stages[name] = {"seconds": round(seconds, 1), "source": source}
+        total += seconds
+    result = {
+        "seconds": round(total, 1),
+        "gpu_seconds": round(gpu, 1),
+        "output_bytes": output_bytes(shape, history),
+        "basis": "history" if measured and not defaulted else ("default" if not measured else "mixed"),
+        "stages": stages,
+    }
+    if Config.ESTIMATE_COST_PER_HOUR > 0:
+        result["cost"] = round(total / 3600.0 * Config.ESTIMATE_COST_PER_HOUR, 4)
+    return result
+
+
+def record(shape, timings, out_bytes=None, skip=(), history=None):
+    # Learns from a finished job: each stage's work over its wall time, and the encoder's
+    # bits per output pixel
+    history = history or get_history()
+    for name, key, units in stage_plan(shape):
+        data = (timings or {}).get(name)
+        if name in skip or not data or not units:
+            continue
+        wall = data.get("wall_sec", 0.0)
+        if name in FIXED_STAGES:
+            history.update(key, wall)
+        elif wall >= MIN_SAMPLE_SEC:
+            history.update(key, units / wall)
+    pixels = _output_megapixels(shape) * 1e6
+    if out_bytes and pixels > 0:
+        audio = AUDIO_BYTES_PER_SEC * shape["duration"] if shape.get("keep_audio") else 0
+        history.update("bpp:%s" % shape["encoder"], max(0.0, out_bytes - audio) * 8.0 / pixels)
+    history.save()
@@ -1,26 +1,80 @@
+import asyncio
+import concurrent.futures
 import json
+import threading
 import time
 
-from pipeline import pipeline, PipelineError, ERR_INTERNAL
+import batch
+import metrics
+import preview
+import progress
+import scheduler
+from config import Config
+from pipeline import pipeline, run_estimate, PipelineError, ERR_INTERNAL
+
+
+def with_job_log(result, logs):
+    # Swaps the job's event log for its bounded per-stage tail and a link to the full log
+    if isinstance(logs, progress.JobLog):
+        result["logs"] = logs.events()
+        result["logs_dropped"] = logs.dropped
+        result["log_url"] = logs.log_url
+    return result
 
 
 def handler(event, context=None):
-    logs = []
     try:
         request = event.get("input", {}) if isinstance(event, dict) else {}
-        result = pipeline(request)
-        return result
+        sink = progress.runpod_sink(event) if Config.PROGRESS_SINK == "runpod" else None
+        if batch.is_batch_request(request):
+            result = batch.run_batch(request, sink)
+        elif preview.is_preview_request(request):
+            result = preview.run_preview(request, sink)
+        elif request.get("dry_run"):
+            result = run_estimate(request, sink)
+        else:
+            result = pipeline(request, sink)
+        metrics.record_job(result.get("metadata", {}).get("timings"), result.get("status", "completed"))
+        return with_job_log(result, result.get("logs"))
     except PipelineError as pe:
-        return {
+        timings = getattr(pe.logs, "timings", None)
+        metrics.record_job(timings.as_dict() if timings is not None else None, "failed")
+        return with_job_log({
             "status": "failed",
             "error_code": pe.code,
             "error_message": pe.message,
             "logs": pe.logs,
-        }
+        }, pe.logs)
     except Exception as exc:
+        metrics.record_job(None, "failed")
         return {
             "status": "failed",
             "error_code": ERR_INTERNAL,
             "error_message": "Internal error",
-            "logs": ["Unhandled error: %s" % exc],
+            "logs": [{"t": round(time.time(), 3), "level": "error", "stage": "job", "msg": "Unhandled error: %s" % exc}],
         }
+
+
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def job_executor():
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, Config.MAX_CONCURRENT_JOBS), thread_name_prefix="job")
+        return _job_executor
+
+
+async def async_handler(event):
+    # Jobs block on subprocesses, so each runs in a worker thread; the event loop stays free
+    # to take further jobs and send progress while stages of different jobs overlap
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(job_executor(), handler, event)
+
+
+def concurrency_modifier(current_concurrency):
+    # RunPod asks this before pulling more work: limited by cores, MAX_CONCURRENT_JOBS and disk headroom
+    return scheduler.get().target_concurrency()
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+import urllib.request
+
+
+class DownloadError(Exception):
+    pass
+
+
+class InputTooLarge(DownloadError):
+    pass
+
+
+def probe_remote(url, timeout=30):
+    # A one-byte ranged GET answers size, validators and range support in one round trip
+    info = {"accept_ranges": False}
+    req = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        headers = resp.headers
+        if resp.status == 206:
+            info["accept_ranges"] = True
+            total = (headers.get("Content-Range") or "").rpartition("/")[2]
+            if total.isdigit():
+                info["content_length"] = int(total)
+        elif headers.get("Content-Length"):
+            info["content_length"] = int(headers.get("Content-Length"))
+        if headers.get("ETag"):
+            info["etag"] = headers.get("ETag")
+        if headers.get("Last-Modified"):
+            info["last_modified"] = headers.get("Last-Modified")
+    return info
+
+
+class RangedDownload(object):
+    # Downloads into a preallocated file with parallel Range requests and tracks
+    # the contiguous prefix on disk so readers can start before the transfer ends.
+    def __init__(self, url, path, size=None, accept_ranges=False, max_bytes=None,
+                 connections=4, part_bytes=32 * 1024 * 1024, timeout=1800, retries=3):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.accept_ranges = bool(accept_ranges and size)
+        self.max_bytes = max_bytes
+        self.connections = max(1, connections)
+        self.part_bytes = max(1024 * 1024, part_bytes)
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.error = None
+        self.watermark = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._parts = []
+        self._part_done = []
+        self._next_part = 0
+        self._contiguous = 0
+        self._deadline = None
+
+    @property
+    def finished(self):
+        return all(not t.is_alive() for t in self._threads)
+
+    def start(self):
+        if self.size and self.max_bytes and self.size > self.max_bytes:
+            raise InputTooLarge("input is %d bytes" % self.size)
+        self._deadline = time.time() + self.timeout
+        with open(self.path, "wb") as f:
+            if self.size:
+                try:
+                    os.posix_fallocate(f.fileno(), 0, self.size)
+                except (AttributeError, OSError):
+                    f.truncate(self.size)
+        if self.accept_ranges:
+            self._parts = [(start, min(start + self.part_bytes, self.size) - 1)
+                           for start in range(0, self.size, self.part_bytes)]
+            self._part_done = [False] * len(self._parts)
+            workers = min(self.connections, len(self._parts))
+            target = self._run_ranges
+        else:
+            workers = 1
+            target = self._run_stream
+        for _ in range(workers):
+            t = threading.Thread(target=self._guard, args=(target,), daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def wait_for(self, nbytes):
+        with self._cond:
+            while self.watermark < nbytes and self.error is None and not self._complete():
+                self._cond.wait(1.0)
+            return self.watermark
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+        if self.error is not None:
+            raise self.error
+        return self.watermark
+
+    def _complete(self):
+        if self.size is not None and self.watermark >= self.size:
+            return True
+        return self.finished
+
+    def _guard(self, target):
+        try:
+            target()
+        except Exception as exc:
+            with self._cond:
+                if self.error is None:
+                    self.error = exc if isinstance(exc, DownloadError) else DownloadError(str(exc))
+                self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._cond.notify_all()
+
+    def _check_deadline(self):
+        if time.time() > self._deadline:
+            raise DownloadError("download timed out")
+
+    def _run_ranges(self):
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            while True:
+                with self._cond:
+                    if self.error is not None or self._next_part >= len(self._parts):
+                        return
+                    index = self._next_part
+                    self._next_part += 1
+                for attempt in range(1, self.retries + 1):
+                    try:
+                        self._fetch_range(fd, index)
+                        break
+                    except DownloadError:
+                        raise
+                    except Exception:
+                        if attempt == self.retries:
+                            raise
+                        self._check_deadline()
+                        time.sleep(attempt)
+                with self._cond:
+                    self._part_done[index] = True
+                    while self._contiguous < len(self._parts) and self._part_done[self._contiguous]:
+                        self._contiguous += 1
+                    self.watermark = self._parts[self._contiguous - 1][1] + 1 if self._contiguous else 0
+                    self._cond.notify_all()
+        finally:
+            os.close(fd)
+
+    def _fetch_range(self, fd, index):
+        start, end = self._parts[index]
+        req = urllib.request.Request(self.url, headers={"Range": "bytes=%d-%d" % (start, end)})
+        with urllib.request.urlopen(req, timeout=min(300, self.timeout)) as resp:
+            if resp.status != 206:
+                raise DownloadError("server ignored Range request")
+            offset = start
+            while True:
+                chunk = resp.read(1024 * 1024)
+                if not chunk:
+                    break
+                if offset + len(chunk) > end + 1:
+                    raise DownloadError("server sent more than the requested range")
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                self._check_deadline()
+                if self.error is not None:
+                    return
+            if offset != end + 1:
+                raise IOError("short read for bytes %d-%d" % (start, end))
+
+    def _run_stream(self):
+        written = 0
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            with urllib.request.urlopen(self.url, timeout=min(300, self.timeout)) as resp:
+                while True:
+                    chunk = resp.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    if self.max_bytes and written + len(chunk) > self.max_bytes:
+                        raise InputTooLarge("input exceeds %d bytes" % self.max_bytes)
+                    os.pwrite(fd, chunk, written)
+                    written += len(chunk)
+                    with self._cond:
+                        self.watermark = written
+                        self._cond.notify_all()
+                    self._check_deadline()
+        finally:
+            os.close(fd)
+        with self._cond:
+            if self.size is not None and written != self.size:
+                raise DownloadError("expected %d bytes, got %d" % (self.size, written))
+            self.size = written
+            self._cond.notify_all()
+
+
+class GrowingFileReader(object):
+    # File-like reader that blocks until the download has written the bytes it needs
+    def __init__(self, download):
+        self._download = download
+        self._f = open(download.path, "rb")
+        self._pos = 0
+
+    def read(self, n):
+        available = self._download.wait_for(self._pos + 1)
+        if self._download.error is not None:
+            raise self._download.error
+        end = min(available, self._pos + n)
+        if end <= self._pos:
+            return b""
+        self._f.seek(self._pos)
+        data = self._f.read(end - self._pos)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+
+def feed_stdin(stdin, download, chunk_bytes=1024 * 1024):
+    # Copies the growing input into a child's stdin; a child that stops reading is not an error
+    def run():
+        reader = GrowingFileReader(download)
+        try:
+            while True:
+                data = reader.read(chunk_bytes)
+                if not data:
+                    break
+                stdin.write(data)
+        except (OSError, DownloadError):
+            pass
+        finally:
+            reader.close()
+            try:
+                stdin.close()
+            except Exception:
+                pass
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
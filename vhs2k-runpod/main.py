@@ -1,4 +1,32 @@
 import runpod
-from handler import handler
+import capabilities
+import metrics
+import scratch
+import upscaler
+from config import Config
+from handler import async_handler, concurrency_modifier
+from pipeline import MODEL_SCALES
 
-runpod.serverless.start({"handler": handler})
+
+def init_worker():
+    # Probe binaries, ffmpeg build and models once per worker; jobs and request
+    # validation read the cached capabilities instead of spawning probes
+    caps = capabilities.probe()
+    print("Worker capabilities: %s" % caps.summary(), flush=True)
+    removed, freed = scratch.sweep_stale()
+    if removed:
+        print("Removed %d stale job dir(s), %.1f GB freed" % (removed, freed / float(1024 ** 3)), flush=True)
+    if Config.PREWARM_UPSCALER and caps.upscaler_available() and caps.has_model(Config.DEFAULT_MODEL):
+        try:
+            engine = upscaler.get_engine(
+                Config.UPSCALER_BACKEND, Config.DEFAULT_MODEL, Config.TMP_DIR, Config.UPSCALE_QUEUE_BATCHES,
+                Config.UPSCALE_TILE, Config.UPSCALE_TILE_OVERLAP, Config.UPSCALE_MEMORY_FRACTION)
+            engine.warm(MODEL_SCALES.get(Config.DEFAULT_MODEL, Config.UPSCALE_FACTOR))
+            print("Upscaler warmed with %s" % Config.DEFAULT_MODEL, flush=True)
+        except Exception as exc:
+            print("Upscaler warm-up failed: %s" % exc, flush=True)
+    metrics.start_exporter(Config.METRICS_PORT, Config.METRICS_TEXTFILE)
+
+
+init_worker()
+runpod.serverless.start({"handler": async_handler, "concurrency_modifier": concurrency_modifier})
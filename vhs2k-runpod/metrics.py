@@ -0,0 +1,282 @@
+import collections
+import contextlib
+import http.server
+import os
+import resource
+import subprocess
+import threading
+import time
+
+MB = 1024.0 * 1024.0
+
+
+def _read_proc_io(pid):
+    # rchar/wchar count every read/write syscall, pipes included, so a pipe-fed stage still shows its I/O
+    try:
+        with open("/proc/%d/io" % pid, "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except Exception:
+        return None
+
+
+def wait_child(proc, timeout=None):
+    # Reaps the child with wait4 so its rusage is not thrown away by Popen.wait().
+    # Returns a usage dict; raises subprocess.TimeoutExpired like Popen.wait.
+    deadline = None if timeout is None else time.time() + timeout
+    delay = 0.005
+    io = None
+    while True:
+        try:
+            pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            # Already reaped elsewhere; nothing left to measure
+            proc.wait()
+            return None
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            read_bytes, write_bytes = io if io else (ru.ru_inblock * 512, ru.ru_oublock * 512)
+            return {
+                "cpu_sec": ru.ru_utime + ru.ru_stime,
+                "peak_rss_mb": ru.ru_maxrss / 1024.0,
+                "read_bytes": read_bytes,
+                "write_bytes": write_bytes,
+            }
+        io = _read_proc_io(proc.pid) or io
+        if deadline is not None and time.time() > deadline:
+            raise subprocess.TimeoutExpired(proc.args, timeout)
+        time.sleep(delay)
+        delay = min(0.25, delay * 2)
+
+
+class StageRecord(object):
+    def __init__(self, name):
+        self.name = name
+        self.wall_sec = 0.0
+        self.cpu_sec = 0.0
+        self.self_cpu_sec = 0.0
+        self.peak_rss_mb = 0.0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.frames = 0
+        self.processes = 0
+        # ffmpeg thread split the stage ran with (threadbudget.ThreadSplit.as_dict)
+        self.threads = None
+
+    def add_usage(self, usage, frames=0):
+        if usage:
+            self.processes += 1
+            self.cpu_sec += usage.get("cpu_sec", 0.0)
+            self.peak_rss_mb = max(self.peak_rss_mb, usage.get("peak_rss_mb", 0.0))
+            self.read_bytes += usage.get("read_bytes", 0)
+            self.write_bytes += usage.get("write_bytes", 0)
+        self.frames += frames or 0
+
+    def as_dict(self):
+        out = {
+            "wall_sec": round(self.wall_sec, 3),
+            "cpu_sec": round(self.cpu_sec, 3),
+            "self_cpu_sec": round(self.self_cpu_sec, 3),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "read_mb": round(self.read_bytes / MB, 2),
+            "write_mb": round(self.write_bytes / MB, 2),
+            "frames": self.frames,
+            "fps": round(self.frames / self.wall_sec, 2) if self.wall_sec > 0 and self.frames else 0.0,
+            "processes": self.processes,
+        }
+        if self.threads:
+            out["threads"] = self.threads
+        return out
+
+
+def _self_cpu():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+class JobTimings(object):
+    # Per-job stage records. Child usage lands in the innermost stage open on the calling
+    # thread, so stages run side by side (audio extraction next to the video stages) keep
+    # their own. Helper threads that open no stage of their own (pools of ffmpeg readers)
+    # report into the stage open on the job's thread, the one that created the timings.
+    # self_cpu_sec is this process's CPU (upscaler threads, Python I/O) during the stage.
+    def __init__(self):
+        self.started = time.time()
+        self.records = collections.OrderedDict()
+        self._stacks = {}
+        self._owner = threading.get_ident()
+        self._lock = threading.Lock()
+
+    def record(self, name):
+        with self._lock:
+            if name not in self.records:
+                self.records[name] = StageRecord(name)
+            return self.records[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        rec = self.record(name)
+        thread = threading.get_ident()
+        with self._lock:
+            nested = rec in self._stacks.get(thread, ())
+        if nested:
+            # Re-entering an open stage (e.g. download started and finished in one block)
+            yield rec
+            return
+        wall0 = time.time()
+        cpu0 = _self_cpu()
+        with self._lock:
+            self._stacks.setdefault(thread, []).append(rec)
+        try:
+            yield rec
+        finally:
+            with self._lock:
+                stack = self._stacks[thread]
+                stack.remove(rec)
+                if not stack:
+                    del self._stacks[thread]
+            rec.wall_sec += time.time() - wall0
+            rec.self_cpu_sec += _self_cpu() - cpu0
+
+    def current(self):
+        with self._lock:
+            stack = self._stacks.get(threading.get_ident()) or self._stacks.get(self._owner)
+            return stack[-1] if stack else None
+
+    def add_usage(self, usage, frames=0):
+        rec = self.current() or self.record("other")
+        with self._lock:
+            rec.add_usage(usage, frames)
+
+    def add_bytes(self, read_bytes=0, write_bytes=0):
+        rec = self.current() or self.record("other")
+        with self._lock:
+            rec.read_bytes += read_bytes
+            rec.write_bytes += write_bytes
+
+    def merge(self, stages, prefix=""):
+        # Folds stage dicts from another process (segment workers) into this job
+        for name, data in (stages or {}).items():
+            if name == "total":
+                continue
+            rec = self.record(prefix + name)
+            with self._lock:
+                rec.wall_sec += data.get("wall_sec", 0.0)
+                rec.cpu_sec += data.get("cpu_sec", 0.0) + data.get("self_cpu_sec", 0.0)
+                rec.peak_rss_mb = max(rec.peak_rss_mb, data.get("peak_rss_mb", 0.0))
+                rec.read_bytes += int(data.get("read_mb", 0.0) * MB)
+                rec.write_bytes += int(data.get("write_mb", 0.0) * MB)
+                rec.frames += data.get("frames", 0)
+                rec.processes += data.get("processes", 0)
+                rec.threads = data.get("threads") or rec.threads
+
+    def as_dict(self):
+        out = collections.OrderedDict((name, rec.as_dict()) for name, rec in self.records.items())
+        out["total"] = {
+            "wall_sec": round(time.time() - self.started, 3),
+            "cpu_sec": round(sum(r.cpu_sec + r.self_cpu_sec for r in self.records.values()), 3),
+            "peak_rss_mb": round(max([r.peak_rss_mb for r in self.records.values()] or [0.0]), 1),
+        }
+        return out
+
+
+class WorkerMetrics(object):
+    # Aggregates finished jobs on this worker and renders Prometheus text exposition format
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = collections.Counter()
+        self.job_seconds = 0.0
+        self.stage_totals = collections.defaultdict(lambda: collections.Counter())
+        self.stage_peak_rss = {}
+
+    def record_job(self, timings, status):
+        with self._lock:
+            self.jobs[status] += 1
+            for name, data in (timings or {}).items():
+                if name == "total":
+                    self.job_seconds += data.get("wall_sec", 0.0)
+                    continue
+                name = name.split("@")[0]
+                totals = self.stage_totals[name]
+                totals["seconds"] += data.get("wall_sec", 0.0)
+                totals["cpu_seconds"] += data.get("cpu_sec", 0.0) + data.get("self_cpu_sec", 0.0)
+                totals["frames"] += data.get("frames", 0)
+                totals["read_bytes"] += data.get("read_mb", 0.0) * MB
+                totals["write_bytes"] += data.get("write_mb", 0.0) * MB
+                totals["runs"] += 1
+                self.stage_peak_rss[name] = max(self.stage_peak_rss.get(name, 0.0), data.get("peak_rss_mb", 0.0))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append("# TYPE vhs2k_jobs_total counter")
+            for status, count in sorted(self.jobs.items()):
+                lines.append('vhs2k_jobs_total{status="%s"} %d' % (status, count))
+            lines.append("# TYPE vhs2k_job_seconds_total counter")
+            lines.append("vhs2k_job_seconds_total %.3f" % self.job_seconds)
+            for metric, key in (
+                ("vhs2k_stage_seconds_total", "seconds"),
+                ("vhs2k_stage_cpu_seconds_total", "cpu_seconds"),
+                ("vhs2k_stage_frames_total", "frames"),
+                ("vhs2k_stage_read_bytes_total", "read_bytes"),
+                ("vhs2k_stage_write_bytes_total", "write_bytes"),
+                ("vhs2k_stage_runs_total", "runs"),
+            ):
+                lines.append("# TYPE %s counter" % metric)
+                for name in sorted(self.stage_totals):
+                    lines.append('%s{stage="%s"} %.3f' % (metric, name, self.stage_totals[name][key]))
+            lines.append("# TYPE vhs2k_stage_peak_rss_megabytes gauge")
+            for name in sorted(self.stage_peak_rss):
+                lines.append('vhs2k_stage_peak_rss_megabytes{stage="%s"} %.1f' % (name, self.stage_peak_rss[name]))
+        return "\n".join(lines) + "\n"
+
+
+worker_metrics = WorkerMetrics()
+_textfile = None
+_server = None
+
+
+def write_textfile(path):
+    # Atomic replace, as node_exporter's textfile collector expects
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(worker_metrics.render())
+    os.replace(tmp, path)
+
+
+def record_job(timings, status):
+    worker_metrics.record_job(timings, status)
+    if _textfile:
+        try:
+            write_textfile(_textfile)
+        except Exception:
+            pass
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = worker_metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_exporter(port=0, textfile=""):
+    # Called once at worker startup; both exporters are optional
+    global _textfile, _server
+    if textfile:
+        _textfile = textfile
+        os.makedirs(os.path.dirname(textfile) or ".", exist_ok=True)
+        write_textfile(textfile)
+    if port and _server is None:
+        _server = http.server.ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
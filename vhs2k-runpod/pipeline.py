@@ -1,18 +1,32 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import json
+import math
 import os
+import re
 import shutil
 import subprocess
+import threading
 import time
-import urllib.request
-from datetime import datetime
 
+import capabilities
+import dedup
+import encoders
+import estimator
+import ingest
+import metrics
+import progress
+import scheduler
+import scratch
+import storage
+import threadbudget
+import upscaler
+from cache import get_input_cache
 from config import Config, PROFILES
 
-try:
-    import boto3
-except Exception:
-    boto3 = None
-
 
 ERR_VALIDATION = "ERR_VALIDATION"
 ERR_INPUT_DOWNLOAD = "ERR_INPUT_DOWNLOAD"
@@ -24,27 +38,123 @@ ERR_UPSCALE = "ERR_UPSCALE"
 ERR_ENCODE = "ERR_ENCODE"
 ERR_UPLOAD = "ERR_UPLOAD"
 ERR_TIMEOUT = "ERR_TIMEOUT"
+ERR_DISK_SPACE = "ERR_DISK_SPACE"
 ERR_INTERNAL = "ERR_INTERNAL"
 
-
-def _ts():
-    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
-
-
-def log_line(logs, message):
-    logs.append("[%s] %s" % (_ts(), message))
+MODEL_SCALES = {
+    "realesrgan-x2plus": 2,
+    "realesrgan-x4plus": 4,
+    "realesrgan-x4plus-anime": 4,
+}
+PLANNER_MODELS = {2: "realesrgan-x2plus", 4: "realesrgan-x4plus"}
+MP4_AUDIO_COPY_CODECS = ("aac", "mp3", "ac3", "eac3", "alac")
+# Adaptive-bitrate outputs: container -> manifest the job's output_url points at
+LADDER_MANIFESTS = {"hls": "master.m3u8", "dash": "manifest.mpd"}
+LADDER_IGNORED_FLAGS = ("segmented", "stream_input", "live_upload")
+AUTO_EXPOSURE_TARGET_MEAN = 0.45
+AUTO_EXPOSURE_TARGET_SPAN = 0.75
+AUTO_EXPOSURE_BLACK_LEVEL = 0.08
+
+STREAM_PIX_FMT = "rgb24"
+STREAM_BYTES_PER_PIXEL = 3
+# Deliverables are 4:2:0 BT.709 whatever the frames went through: upscaled frames arrive as
+# rgb24, which libx264/libx265 would otherwise keep as 4:4:4 that most decoders cannot play
+OUTPUT_PIX_FMT = "yuv420p"
+OUTPUT_COLOR_ARGS = ["-color_primaries", "bt709", "-color_trc", "bt709", "-colorspace", "bt709", "-color_range", "tv"]
+
+
+def log_line(logs, message, level="info", detail=None):
+    logs.event(level, message, detail=detail)
+
+
+def timed(logs, stage):
+    timings = getattr(logs, "timings", None)
+    return timings.stage(stage) if timings is not None else contextlib.nullcontext()
+
+
+def stage_threads(logs, stage, cpus=None, record=None):
+    # Thread split for one stage's ffmpeg processes, kept on the stage record for bench/
+    split = threadbudget.split(stage, cpus)
+    timings = getattr(logs, "timings", None)
+    if timings is not None:
+        timings.record(record or stage).threads = split.as_dict()
+    return split
+
+
+def record_usage(logs, usage, frames=0):
+    timings = getattr(logs, "timings", None)
+    if timings is not None:
+        timings.add_usage(usage, frames)
+
+
+def _drain(stream, write):
+    for chunk in iter(lambda: stream.read(65536), b""):
+        write(chunk)
+    stream.close()
+
+
+def _run_streaming(cmd, timeout, feed=None, tracker=None, keep_stderr=False):
+    # Reads stdout, stderr and ffmpeg's -progress feed as they are produced. stderr keeps only
+    # a bounded tail unless the caller parses it (analysis, scene detection).
+    progress_r = progress_w = None
+    if tracker is not None and os.path.basename(cmd[0]) == "ffmpeg":
+        progress_r, progress_w = os.pipe()
+        cmd = [cmd[0], "-progress", "pipe:%d" % progress_w, "-nostats"] + list(cmd[1:])
+    try:
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE if feed is not None else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            pass_fds=(progress_w,) if progress_w is not None else ())
+    finally:
+        if progress_w is not None:
+            os.close(progress_w)
+    if feed is not None:
+        # The feeder thread owns stdin and closes it at end of input
+        stdin, proc.stdin = proc.stdin, None
+        ingest.feed_stdin(stdin, feed)
+    stdout = []
+    stderr = bytearray() if keep_stderr else progress.TailBuffer(Config.STDERR_TAIL_BYTES)
+    readers = [
+        threading.Thread(target=_drain, args=(proc.stdout, stdout.append), daemon=True),
+        threading.Thread(target=_drain, args=(proc.stderr, stderr.extend if keep_stderr else stderr.write), daemon=True),
+    ]
+    if progress_r is not None:
+        readers.append(threading.Thread(target=tracker.consume, args=(os.fdopen(progress_r, "rb"),), daemon=True))
+    for t in readers:
+        t.start()
+    try:
+        usage = metrics.wait_child(proc, timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        metrics.wait_child(proc)
+        raise
+    finally:
+        for t in readers:
+            t.join()
+    stderr = bytes(stderr) if keep_stderr else stderr.getvalue()
+    result = subprocess.CompletedProcess(cmd, proc.returncode, b"".join(stdout), stderr)
+    result.usage = usage
+    return result
 
 
-def run_cmd(cmd, timeout, logs, stage, err_code):
-    log_line(logs, "Running %s" % stage)
+def run_cmd(cmd, timeout, logs, stage, err_code, feed=None, keep_stderr=False, track=True):
+    log_line(logs, "Running %s" % stage, "debug")
+    reporter = getattr(logs, "reporter", None)
+    tracker = reporter.stage(stage) if reporter is not None and track else None
     try:
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        result = _run_streaming(cmd, timeout, feed, tracker, keep_stderr)
     except subprocess.TimeoutExpired:
-        log_line(logs, "Timeout in %s" % stage)
+        log_line(logs, "Timeout in %s" % stage, "error")
         raise PipelineError(err_code, "Stage timeout", logs)
+    record_usage(logs, result.usage, tracker.frames if tracker is not None else 0)
     if result.returncode != 0:
-        log_line(logs, "%s failed: %s" % (stage, result.stderr.decode("utf-8", errors="ignore")))
+        tail = result.stderr[-Config.STDERR_TAIL_BYTES:].decode("utf-8", errors="ignore")
+        log_line(logs, "%s failed" % stage, "error", tail)
+        if "No space left on device" in tail:
+            raise PipelineError(ERR_DISK_SPACE, "Out of scratch space", logs)
         raise PipelineError(err_code, "Processing failed", logs)
+    if tracker is not None and tracker.frames:
+        log_line(logs, "%s: %d frames at %.1f fps (%.2fx)" % (stage, tracker.frames, tracker.fps, tracker.speed))
     return result
 
 
@@ -124,14 +234,27 @@ def validate_request(request, logs):
     if request.get("auto_exposure") is not None and not isinstance(request.get("auto_exposure"), bool):
         errors.append("auto_exposure must be boolean")
 
+    for flag in ("streaming", "segmented", "stream_input", "live_upload", "dedup", "dry_run"):
+        if request.get(flag) is not None and not isinstance(request.get(flag), bool):
+            errors.append("%s must be boolean" % flag)
+
     if request.get("deinterlace") and request.get("deinterlace") not in ("auto", "on", "off"):
         errors.append("deinterlace must be auto|on|off")
 
-    if request.get("codec") and request.get("codec") not in ("h264", "h265"):
-        errors.append("codec must be h264|h265")
+    if request.get("codec") and request.get("codec") not in ("h264", "h265", "av1"):
+        errors.append("codec must be h264|h265|av1")
+
+    if request.get("preset") and request.get("preset") not in encoders.X264_PRESETS:
+        errors.append("preset must be one of %s" % "|".join(encoders.X264_PRESETS))
+
+    if request.get("encoder") and request.get("encoder") != "auto" and request.get("encoder") not in encoders.BACKENDS:
+        errors.append("encoder must be auto|%s" % "|".join(sorted(encoders.BACKENDS)))
 
-    if request.get("container") and request.get("container") not in ("mp4", "mkv"):
-        errors.append("container must be mp4|mkv")
+    if request.get("encoder_quality") and request.get("encoder_quality") not in encoders.QUALITY_TIERS:
+        errors.append("encoder_quality must be preview|standard|archival")
+
+    if request.get("container") and request.get("container") not in ("mp4", "mkv", "hls", "dash"):
+        errors.append("container must be mp4|mkv|hls|dash")
 
     if request.get("target_resolution"):
         if parse_target_resolution(request.get("target_resolution")) is None:
@@ -140,76 +263,248 @@ def validate_request(request, logs):
     if request.get("profile") and request.get("profile") not in PROFILES:
         errors.append("profile must be fast_preview|balanced|max_cleanup|dark_footage")
 
+    if not errors:
+        errors.extend(capability_errors(request, capabilities.get()))
+
     if errors:
         for e in errors:
-            log_line(logs, "Validation error: %s" % e)
+            log_line(logs, "Validation error: %s" % e, "warning")
         raise PipelineError(ERR_VALIDATION, "Invalid request", logs)
 
 
-def estimate_input_size_gb(url, logs):
+def capability_errors(request, caps):
+    # Combinations this worker cannot run, rejected before anything is downloaded
+    errors = []
+    codec = request.get("codec", Config.DEFAULT_CODEC)
+    encoder = request.get("encoder", Config.ENCODER)
+    if encoder and encoder != "auto":
+        if encoder not in caps.encoders:
+            errors.append("encoder %s is not available on this worker" % encoder)
+    elif caps.encoders and not caps.has_codec(codec):
+        errors.append("no %s encoder available on this worker" % codec)
+
+    model = request.get("model")
+    if model:
+        if not caps.upscaler_available():
+            errors.append("model requested but the upscaler is unavailable: %s" % caps.upscaler.get("error"))
+        elif not caps.has_model(model):
+            errors.append("model %s is not installed" % model)
+
+    if request.get("deinterlace", Config.DEFAULT_DEINTERLACE) != "off" and not (caps.has_filter("bwdif") or caps.has_filter("yadif")):
+        errors.append("ffmpeg has no deinterlace filter (bwdif/yadif); use deinterlace=off")
+    for name in caps.missing_filters(("scale", "eq", "hqdn3d", "unsharp")):
+        errors.append("ffmpeg filter %s is not available on this worker" % name)
+    return errors
+
+
+def head_input(url, logs):
     try:
-        req = urllib.request.Request(url, method="HEAD")
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            length = resp.headers.get("Content-Length")
-            if length:
-                size_gb = float(length) / (1024 ** 3)
-                log_line(logs, "Estimated input size: %.2f GB" % size_gb)
-                return size_gb
+        return ingest.probe_remote(url)
     except Exception as exc:
-        log_line(logs, "HEAD size check failed: %s" % exc)
+        log_line(logs, "Input size check failed: %s" % exc, "warning")
+    return {}
+
+
+def estimate_input_size_gb(url, logs, head=None):
+    if head is None:
+        head = head_input(url, logs)
+    length = head.get("content_length")
+    if length:
+        size_gb = float(length) / (1024 ** 3)
+        log_line(logs, "Estimated input size: %.2f GB" % size_gb)
+        return size_gb
     return None
 
 
-def download_input(url, out_path, logs):
-    log_line(logs, "Downloading input")
+def start_download(url, out_path, head, logs):
+    download = ingest.RangedDownload(
+        url, out_path,
+        size=head.get("content_length"),
+        accept_ranges=head.get("accept_ranges"),
+        max_bytes=int(Config.MAX_INPUT_GB * (1024 ** 3)),
+        connections=Config.DOWNLOAD_CONNECTIONS,
+        part_bytes=Config.DOWNLOAD_PART_MB * 1024 * 1024,
+        timeout=Config.STAGE_TIMEOUT_DOWNLOAD,
+    )
+    log_line(logs, "Downloading input (%d connections)" % (Config.DOWNLOAD_CONNECTIONS if download.accept_ranges else 1))
     try:
-        with urllib.request.urlopen(url, timeout=Config.STAGE_TIMEOUT_DOWNLOAD) as resp:
-            with open(out_path, "wb") as f:
-                shutil.copyfileobj(resp, f, length=1024 * 1024)
+        download.start()
+    except ingest.InputTooLarge:
+        log_line(logs, "Input too large")
+        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
     except Exception as exc:
-        log_line(logs, "Download error: %s" % exc)
+        log_line(logs, "Download error: %s" % exc, "error")
         raise PipelineError(ERR_INPUT_DOWNLOAD, "Input download failed", logs)
+    return download
 
 
-def ffprobe_metadata(path, logs):
-    cmd = [
-        "ffprobe", "-v", "quiet", "-print_format", "json",
-        "-show_streams", "-show_format", path
-    ]
-    try:
-        result = run_cmd(cmd, 120, logs, "probe", ERR_INPUT_PROBE)
-        data = json.loads(result.stdout.decode("utf-8", errors="ignore"))
-        return data
-    except PipelineError:
-        raise
-    except Exception as exc:
-        log_line(logs, "Probe error: %s" % exc)
-        raise PipelineError(ERR_INPUT_PROBE, "Input probe failed", logs)
-
-
-def detect_interlace(path, logs):
-    log_line(logs, "Detecting interlace")
-    cmd = [
-        "ffmpeg", "-i", path,
-        "-filter:v", "idet",
-        "-frames:v", "300",
-        "-an", "-f", "rawvideo", "-y", os.devnull
+def finish_download(download, logs):
+    with timed(logs, "download"):
+        try:
+            size = download.join()
+        except ingest.InputTooLarge:
+            log_line(logs, "Input too large")
+            raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+        except Exception as exc:
+            log_line(logs, "Download error: %s" % exc, "error")
+            raise PipelineError(ERR_INPUT_DOWNLOAD, "Input download failed", logs)
+        log_line(logs, "Downloaded size: %.2f GB" % (float(size) / (1024 ** 3)))
+        timings = getattr(logs, "timings", None)
+        if timings is not None:
+            timings.add_bytes(write_bytes=size)
+
+
+def download_input(url, out_path, logs, head=None):
+    if head is None:
+        head = head_input(url, logs)
+    finish_download(start_download(url, out_path, head, logs), logs)
+
+
+def ffprobe_metadata(path, logs, feed=None):
+    with timed(logs, "probe"):
+        cmd = [
+            "ffprobe", "-v", "quiet", "-print_format", "json",
+            "-show_streams", "-show_format", "pipe:0" if feed is not None else path
+        ]
+        try:
+            result = run_cmd(cmd, 120, logs, "probe", ERR_INPUT_PROBE, feed)
+            data = json.loads(result.stdout.decode("utf-8", errors="ignore"))
+            return data
+        except PipelineError:
+            raise
+        except Exception as exc:
+            log_line(logs, "Probe error: %s" % exc, "error")
+            raise PipelineError(ERR_INPUT_PROBE, "Input probe failed", logs)
+
+
+IDET_MULTI_RE = re.compile(r"Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)")
+SIGNALSTATS_RE = re.compile(r"lavfi\.signalstats\.(YLOW|YAVG|YHIGH|YBITDEPTH)=([\d.]+)")
+
+
+def analysis_windows(meta):
+    # K evenly spaced start times; each window sits in the middle of its slice of the tape
+    count = max(1, Config.ANALYSIS_WINDOWS)
+    duration = input_duration(meta)
+    if duration <= 0:
+        return [0.0]
+    num, den = parse_frame_rate(video_stream_info(meta).get("avg_frame_rate")) or (30, 1)
+    window = Config.ANALYSIS_WINDOW_FRAMES * den / float(num)
+    if duration <= window * count:
+        return [0.0]
+    return [max(0.0, duration * (i + 0.5) / count - window / 2.0) for i in range(count)]
+
+
+def parse_analysis(stderr):
+    counts = {"tff": 0, "bff": 0, "progressive": 0, "undetermined": 0}
+    # ffmpeg may also print an all-zero summary for a graph it configured and discarded;
+    # the last summary belongs to the graph that saw the frames
+    matches = IDET_MULTI_RE.findall(stderr)
+    if matches:
+        for key, value in zip(("tff", "bff", "progressive", "undetermined"), matches[-1]):
+            counts[key] = int(value)
+    luma = {"YLOW": [], "YAVG": [], "YHIGH": [], "YBITDEPTH": []}
+    for key, value in SIGNALSTATS_RE.findall(stderr):
+        luma[key].append(float(value))
+    return counts, luma
+
+
+def _analyze_window(path, start, logs, feed=None, cpus=None):
+    cmd = ["ffmpeg", "-hide_banner", "-nostats"] + stage_threads(logs, "analyze", cpus).input_args()
+    if feed is None:
+        cmd += ["-ss", "%.3f" % start, "-i", path]
+    else:
+        cmd += ["-i", "pipe:0"]
+    cmd += [
+        "-map", "0:v:0", "-frames:v", str(Config.ANALYSIS_WINDOW_FRAMES),
+        "-vf", "idet,signalstats,metadata=mode=print",
+        "-f", "null", "-"
     ]
-    try:
-        result = run_cmd(cmd, 300, logs, "interlace_detect", ERR_DEINTERLACE)
-        stderr = result.stderr.decode("utf-8", errors="ignore")
-        # Heuristic: consider interlaced if TFF/BFF counts present
-        return ("TFF" in stderr) or ("BFF" in stderr)
-    except PipelineError:
-        raise
-
-
-def build_exposure_filter(brightness, gamma, contrast, auto_exposure, logs):
-    # Conservative auto exposure adjustment using eq
+    result = run_cmd(cmd, 300, logs, "analyze@%.0fs" % start, ERR_DEINTERLACE, feed, keep_stderr=True, track=False)
+    return parse_analysis(result.stderr.decode("utf-8", errors="ignore"))
+
+
+def analyze_input(path, meta, logs, feed=None):
+    # One decode per window collects both idet field counts and signalstats luma, and the
+    # windows run in parallel, so the cost no longer grows with tape length.
+    # A still-downloading input cannot seek; it gets a single window from the start.
+    with timed(logs, "analyze"):
+        starts = [0.0] if feed is not None else analysis_windows(meta)
+        log_line(logs, "Analyzing %d window(s) of %d frames" % (len(starts), Config.ANALYSIS_WINDOW_FRAMES))
+        results = []
+        if len(starts) == 1:
+            results.append(_analyze_window(path, starts[0], logs, feed))
+        else:
+            workers = min(len(starts), available_cpus())
+            cpus = max(1, threadbudget.job_cpus() // workers)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_analyze_window, path, start, logs, None, cpus) for start in starts]
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except PipelineError:
+                        # A window past a damaged stretch of tape should not sink the job
+                        pass
+            if not results:
+                raise PipelineError(ERR_DEINTERLACE, "Interlace detection failed", logs)
+
+        counts = {"tff": 0, "bff": 0, "progressive": 0, "undetermined": 0}
+        samples = {"YLOW": [], "YAVG": [], "YHIGH": [], "YBITDEPTH": []}
+        for window_counts, window_luma in results:
+            for key in counts:
+                counts[key] += window_counts[key]
+            for key in samples:
+                samples[key].extend(window_luma[key])
+
+        decided = counts["tff"] + counts["bff"] + counts["progressive"]
+        ratio = (counts["tff"] + counts["bff"]) / float(decided) if decided else 0.0
+        interlaced = decided > 0 and ratio >= Config.INTERLACE_RATIO_THRESHOLD
+        log_line(logs, "idet: tff=%d bff=%d progressive=%d undetermined=%d ratio=%.2f" % (
+            counts["tff"], counts["bff"], counts["progressive"], counts["undetermined"], ratio))
+
+        luma = None
+        if samples["YAVG"]:
+            depth = int(samples["YBITDEPTH"][0]) if samples["YBITDEPTH"] else 8
+            peak = float((1 << depth) - 1)
+            luma = {
+                "low": sorted(samples["YLOW"])[len(samples["YLOW"]) // 10] / peak if samples["YLOW"] else 0.0,
+                "mean": sum(samples["YAVG"]) / len(samples["YAVG"]) / peak,
+                "high": sorted(samples["YHIGH"])[(len(samples["YHIGH"]) * 9) // 10] / peak if samples["YHIGH"] else 1.0,
+                "frames": len(samples["YAVG"]),
+            }
+
+        return {
+            "windows": len(results),
+            "interlaced": bool(interlaced),
+            "interlace_ratio": round(ratio, 4),
+            "idet": counts,
+            "luma": luma,
+        }
+
+
+def build_exposure_filter(brightness, gamma, contrast, auto_exposure, logs, luma=None):
     b = brightness
     g = gamma
     c = contrast
-    if auto_exposure:
+    if auto_exposure and luma:
+        # Measured: luma low/high are the 10th/90th percentile levels (0..1), mean is the average
+        # frame level. Nudge each toward a broadcast-safe target, scaled by AUTO_EXPOSURE_STRENGTH.
+        strength = Config.AUTO_EXPOSURE_STRENGTH
+        low = min(0.95, max(0.0, luma["low"]))
+        high = min(1.0, max(low + 0.05, luma["high"]))
+        mean = min(0.95, max(0.02, luma["mean"]))
+        # eq gamma maps x -> x^(1/g); pick g that moves the mean to the target level
+        g = min(1.8, max(0.6, g * (1.0 + strength * (math.log(mean) / math.log(AUTO_EXPOSURE_TARGET_MEAN) - 1.0))))
+        # Stretch the occupied range, but never push the 90th percentile past HIGHLIGHT_PROTECT
+        stretch = AUTO_EXPOSURE_TARGET_SPAN / (high - low)
+        stretch = min(stretch, max(1.0, (Config.HIGHLIGHT_PROTECT - 0.5) / max(0.01, high - 0.5)))
+        c = min(1.5, max(0.5, c * (1.0 + strength * (stretch - 1.0))))
+        # Lift crushed blacks, bounded by SHADOW_LIFT_LIMIT
+        lift = max(0.0, AUTO_EXPOSURE_BLACK_LEVEL - low) * strength
+        b = min(1.0, max(-1.0, b + min(Config.SHADOW_LIFT_LIMIT, lift)))
+        log_line(logs, "Auto exposure from luma low=%.3f mean=%.3f high=%.3f: b=%.3f g=%.3f c=%.3f" % (
+            low, mean, high, b, g, c))
+    elif auto_exposure:
+        # No measurement available; fall back to the fixed conservative adjustment
         b = min(1.0, max(-1.0, b + Config.AUTO_EXPOSURE_STRENGTH * Config.SHADOW_LIFT_LIMIT))
         g = min(1.8, max(0.6, g + (Config.AUTO_EXPOSURE_STRENGTH * 0.3)))
         c = min(1.5, max(0.5, c * (1.0 + (1.0 - Config.HIGHLIGHT_PROTECT) * 0.1)))
@@ -232,211 +527,1407 @@ def enforce_max_job_seconds(start_time, logs):
         raise PipelineError(ERR_TIMEOUT, "Job timeout", logs)
 
 
-def log_realesrgan_info(logs):
-    path = shutil.which("realesrgan-ncnn-vulkan")
-    log_line(logs, "which realesrgan-ncnn-vulkan: %s" % (path if path else "NOT FOUND"))
-    if not path:
+def output_scale_filter(target_wh):
+    return "scale=%d:%d:out_color_matrix=bt709:out_range=tv,format=%s" % (target_wh[0], target_wh[1], OUTPUT_PIX_FMT)
+
+
+def build_encode_cmd(video_input_args, audio, target_wh, video_args, output_path, prefilter=None, output_args=()):
+    vf = output_scale_filter(target_wh)
+    if prefilter and prefilter != "null":
+        vf = "%s,%s" % (prefilter, vf)
+    cmd = ["ffmpeg", "-y"] + list(video_input_args)
+    audio_args = []
+    if audio and audio.get("same_input"):
+        audio_args = ["-map", "0:v:0", "-map", "0:a:0"] + audio["args"]
+    elif audio:
+        cmd += ["-i", audio["path"]]
+        audio_args = ["-map", "0:v:0", "-map", "1:a:0"] + audio["args"]
+    cmd += ["-vf", vf] + list(video_args) + OUTPUT_COLOR_ARGS
+    return cmd + audio_args + list(output_args) + [output_path]
+
+
+def build_multi_encode_cmd(video_input_args, audio, outputs):
+    # One decode feeding several encodes. The decoded video is split once per distinct
+    # prefilter chain, each chain runs once and is split again per output that uses it,
+    # and every branch gets its own scale, encoder and container.
+    # outputs: dicts with target_wh, video_args, output_path and optional prefilter,
+    # audio_args, output_args
+    chains = collections.OrderedDict()
+    for i, out in enumerate(outputs):
+        chains.setdefault(out.get("prefilter") or "null", []).append(i)
+    graph = []
+    sources = ["[0:v]"]
+    if len(chains) > 1:
+        sources = ["[c%d]" % k for k in range(len(chains))]
+        graph.append("[0:v]split=%d%s" % (len(chains), "".join(sources)))
+    for source, (chain, members) in zip(sources, chains.items()):
+        filters = [] if chain == "null" else [chain]
+        if len(members) > 1:
+            filters.append("split=%d" % len(members))
+        graph.append("%s%s%s" % (source, ",".join(filters) or "null", "".join("[s%d]" % i for i in members)))
+    for i, out in enumerate(outputs):
+        graph.append("[s%d]%s[v%d]" % (i, output_scale_filter(out["target_wh"]), i))
+    cmd = ["ffmpeg", "-y"] + list(video_input_args)
+    audio_map = None
+    if audio and audio.get("same_input"):
+        audio_map = "0:a:0"
+    elif audio:
+        cmd += ["-i", audio["path"]]
+        audio_map = "1:a:0"
+    cmd += ["-filter_complex", ";".join(graph)]
+    for i, out in enumerate(outputs):
+        cmd += ["-map", "[v%d]" % i] + list(out["video_args"]) + OUTPUT_COLOR_ARGS
+        if audio_map and out.get("audio_args"):
+            cmd += ["-map", audio_map] + list(out["audio_args"])
+        cmd += list(out.get("output_args", ())) + [out["output_path"]]
+    return cmd
+
+
+def ladder_renditions(target_wh):
+    # The requested resolution on top, then every LADDER_RUNGS height below it at the same aspect
+    w, h = target_wh
+    heights = set()
+    for part in Config.LADDER_RUNGS.split(","):
+        try:
+            heights.add(int(part) - int(part) % 2)
+        except ValueError:
+            continue
+    rungs = [(w, h)]
+    for height in sorted(heights, reverse=True):
+        if 0 < height < h:
+            rungs.append((int(round(w * height / float(h) / 2.0)) * 2, height))
+    return rungs
+
+
+def ladder_output_args(container, package_dir, videos, has_audio):
+    seconds = str(max(1, Config.LADDER_SEGMENT_SECONDS))
+    if container == "dash":
+        return [
+            "-f", "dash", "-seg_duration", seconds, "-use_template", "1", "-use_timeline", "1",
+            "-init_seg_name", "init_$RepresentationID$.m4s",
+            "-media_seg_name", "chunk_$RepresentationID$_$Number%05d$.m4s",
+            "-adaptation_sets", "id=0,streams=v" + (" id=1,streams=a" if has_audio else ""),
+            os.path.join(package_dir, LADDER_MANIFESTS["dash"]),
+        ]
+    # One variant playlist per rendition, all sharing a single audio rendition
+    variants = ["v:%d%s" % (i, ",agroup:audio" if has_audio else "") for i in range(videos)]
+    if has_audio:
+        variants.insert(0, "a:0,agroup:audio")
+    return [
+        "-f", "hls", "-hls_time", seconds, "-hls_playlist_type", "vod", "-hls_segment_type", "fmp4",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", os.path.join(package_dir, "stream_%v", "seg_%05d.m4s"),
+        "-master_pl_name", LADDER_MANIFESTS["hls"], "-var_stream_map", " ".join(variants),
+        os.path.join(package_dir, "stream_%v", "index.m3u8"),
+    ]
+
+
+def build_ladder_cmd(video_input_args, audio, ladder, video_args, package_dir, prefilter=None):
+    # The whole ladder in one pass: frames are filtered and split once, scaled per rendition,
+    # and every encoder places keyframes on the segment boundaries so players can switch
+    # renditions between any two segments.
+    # ladder: container, renditions, fps and optional codec tag (see ladder_spec)
+    renditions = ladder["renditions"]
+    n = len(renditions)
+    head = "[0:v]%s" % ("%s," % prefilter if prefilter and prefilter != "null" else "")
+    graph = [head + "split=%d%s" % (n, "".join("[s%d]" % i for i in range(n)))]
+    for i, (w, h) in enumerate(renditions):
+        graph.append("[s%d]%s[v%d]" % (i, output_scale_filter((w, h)), i))
+    cmd = ["ffmpeg", "-y"] + list(video_input_args)
+    audio_args = []
+    if audio and audio.get("same_input"):
+        audio_args = ["-map", "0:a:0"] + audio["args"]
+    elif audio:
+        cmd += ["-i", audio["path"]]
+        audio_args = ["-map", "1:a:0"] + audio["args"]
+    cmd += ["-filter_complex", ";".join(graph)]
+    seconds = max(1, Config.LADDER_SEGMENT_SECONDS)
+    gop = ["-g", str(max(1, int(round(ladder["fps"] * seconds)))), "-force_key_frames", "expr:gte(t,n_forced*%d)" % seconds]
+    for i, (w, h) in enumerate(renditions):
+        args = list(video_args) + gop + OUTPUT_COLOR_ARGS
+        if Config.LADDER_MAX_BPP > 0:
+            # Capped quality: players pick renditions by their peak bitrate
+            rate = int(w * h * ladder["fps"] * Config.LADDER_MAX_BPP)
+            args += ["-maxrate", str(rate), "-bufsize", str(rate * 2)]
+        if ladder.get("tag"):
+            args += ["-tag:v", ladder["tag"]]
+        cmd += ["-map", "[v%d]" % i] + encoders.stream_args(args, i)
+    return cmd + audio_args + ladder_output_args(ladder["container"], package_dir, n, bool(audio))
+
+
+def ladder_summary(ladder):
+    if not ladder:
+        return None
+    return {
+        "container": ladder["container"],
+        "manifest": LADDER_MANIFESTS[ladder["container"]],
+        "segment_seconds": max(1, Config.LADDER_SEGMENT_SECONDS),
+        "renditions": ["%dx%d" % wh for wh in ladder["renditions"]],
+    }
+
+
+def ladder_spec(params, meta, filter_chain, encoder):
+    if params["container"] not in LADDER_MANIFESTS:
+        return None
+    num, den = parse_frame_rate(stream_frame_rate(meta, filter_chain))
+    return {
+        "container": params["container"],
+        "renditions": ladder_renditions(params["target_wh"]),
+        "fps": num / float(den),
+        # Apple players only take HEVC in fMP4 under the hvc1 sample entry
+        "tag": "hvc1" if encoder.codec == "h265" else None,
+    }
+
+
+def audio_stream_info(meta):
+    for stream in meta.get("streams", []):
+        if stream.get("codec_type") == "audio":
+            return stream
+    return {}
+
+
+def audio_codec_args(meta, container):
+    # Stream-copy when the container can carry the source codec, otherwise encode exactly once
+    codec = audio_stream_info(meta).get("codec_name")
+    if Config.AUDIO_COPY and codec and (container == "mkv" or codec in MP4_AUDIO_COPY_CODECS):
+        return ["-c:a", "copy"]
+    return ["-c:a", Config.AUDIO_CODEC, "-b:a", Config.AUDIO_BITRATE]
+
+
+def video_stream_info(meta):
+    for stream in meta.get("streams", []):
+        if stream.get("codec_type") == "video":
+            return stream
+    return {}
+
+
+def parse_frame_rate(value):
+    # ffprobe reports rates as "num/den"; keep them rational for ffmpeg
+    try:
+        text = str(value)
+        if "/" in text:
+            num, den = [int(p) for p in text.split("/")]
+        else:
+            num, den = int(round(float(text) * 1000)), 1000
+        if num <= 0 or den <= 0:
+            return None
+        return num, den
+    except Exception:
+        return None
+
+
+def stream_frame_rate(meta, filter_chain):
+    stream = video_stream_info(meta)
+    rate = parse_frame_rate(stream.get("avg_frame_rate")) or parse_frame_rate(stream.get("r_frame_rate")) or (30000, 1001)
+    # bwdif defaults to send_field and doubles the rate; yadif keeps it
+    if "bwdif" in filter_chain:
+        rate = (rate[0] * 2, rate[1])
+    return "%d/%d" % rate
+
+
+def _stderr_tail(path, limit=4000):
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - limit))
+            return f.read().decode("utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+def get_upscaler(model, logs):
+    try:
+        return upscaler.get_engine(
+            Config.UPSCALER_BACKEND, model, Config.TMP_DIR, Config.UPSCALE_QUEUE_BATCHES,
+            Config.UPSCALE_TILE, Config.UPSCALE_TILE_OVERLAP, Config.UPSCALE_MEMORY_FRACTION)
+    except upscaler.UpscaleError as exc:
+        log_line(logs, "Upscaler unavailable: %s" % exc)
+        raise PipelineError(ERR_UPSCALE, "Processing failed", logs)
+
+
+@contextlib.contextmanager
+def worker_pool(workers, spec, logs):
+    # Process pool for segment and preview workers. The workers decode, filter and encode;
+    # when the job upscales, their frames come back to this process's engine so the model
+    # is loaded once and the GPU is not shared between several processes.
+    if not spec["upscale"]:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            yield pool
         return
+    server = upscaler.EngineServer(get_upscaler(spec["model"], logs))
     try:
-        out = subprocess.check_output([path, "-h"], stderr=subprocess.STDOUT, timeout=5)
-        text = out.decode("utf-8", errors="ignore").strip()
-        if len(text) > 400:
-            text = text[:400] + "..."
-        log_line(logs, "realesrgan-ncnn-vulkan -h: %s" % text)
-    except Exception as exc:
-        log_line(logs, "realesrgan-ncnn-vulkan -h failed: %s" % exc)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=upscaler.attach_remote, initargs=server.client_args()) as pool:
+            yield pool
+    finally:
+        server.close()
+
+
+def _read_batches(stream, frame_size, batch_frames, deadline, logs):
+    while True:
+        batch = []
+        while len(batch) < batch_frames:
+            frame = stream.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            batch.append(frame)
+        if not batch:
+            return
+        if time.time() > deadline:
+            log_line(logs, "Timeout in upscale", "error")
+            raise PipelineError(ERR_UPSCALE, "Stage timeout", logs)
+        yield batch
+        if len(batch) < batch_frames:
+            return
 
 
-def pipeline(request):
-    logs = []
-    start_time = time.time()
-    log_line(logs, "Job started")
-    log_realesrgan_info(logs)
+def _stream_video_pass(decode_cmd, in_wh, rate, spec, encode_cmd_for, tmp_dir, logs, can_retry, feed=None, stage="stream_process", err_code=ERR_EXPOSURE):
+    in_w, in_h = in_wh
+    scale = spec["scale"]
+    frame_size = in_w * in_h * STREAM_BYTES_PER_PIXEL
+    deadline = time.time() + Config.STAGE_TIMEOUT_PROCESS
+    engine = get_upscaler(spec["model"], logs)
+    deduper = dedup.FrameDeduper(in_wh, Config.DEDUP_THRESHOLD, Config.DEDUP_PIXEL_TOLERANCE) if spec.get("dedup") else None
+    oom_retries = engine.backend.oom_retries
+    decode_log = os.path.join(tmp_dir, "%s.log" % stage)
+    encode_log = os.path.join(tmp_dir, "%s_encode.log" % stage)
+    log_line(logs, "Running %s" % stage, "debug")
+    with open(decode_log, "wb") as decode_err:
+        decoder = subprocess.Popen(decode_cmd, stdin=subprocess.PIPE if feed is not None else None, stdout=subprocess.PIPE, stderr=decode_err, bufsize=frame_size)
+    if feed is not None:
+        ingest.feed_stdin(decoder.stdin, feed)
+    encoder = None
+    frames_done = 0
+    reporter = getattr(logs, "reporter", None)
+    tracker = reporter.stage(stage) if reporter is not None else None
+    num, den = parse_frame_rate(rate) or (30, 1)
+    try:
+        batches = _read_batches(decoder.stdout, frame_size, max(1, Config.STREAM_BATCH_FRAMES), deadline, logs)
+        if deduper is not None:
+            batches = deduper.batches(batches)
+        try:
+            upscaled = engine.upscale_stream(batches, in_wh, scale)
+            if deduper is not None:
+                upscaled = deduper.expand(upscaled)
+            for frame in upscaled:
+                if encoder is None:
+                    video_input = [
+                        "-f", "rawvideo", "-pix_fmt", STREAM_PIX_FMT,
+                        "-s", "%dx%d" % (in_w * scale, in_h * scale),
+                        "-framerate", rate,
+                        "-i", "pipe:0"
+                    ]
+                    with open(encode_log, "wb") as encode_err:
+                        encoder = subprocess.Popen(encode_cmd_for(video_input), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=encode_err)
+                try:
+                    encoder.stdin.write(frame)
+                except (BrokenPipeError, OSError):
+                    encoder.wait()
+                    log_line(logs, "encode failed", "error", _stderr_tail(encode_log))
+                    raise PipelineError(ERR_ENCODE, "Processing failed", logs)
+                frames_done += 1
+                if tracker is not None and frames_done % 64 == 0:
+                    tracker.update(frames=frames_done, out_time=frames_done * den / float(num))
+        except upscaler.UpscaleError as exc:
+            log_line(logs, "upscale failed: %s" % exc, "error")
+            raise PipelineError(ERR_UPSCALE, "Processing failed", logs)
+
+        decoder.stdout.close()
+        record_usage(logs, metrics.wait_child(decoder))
+        if decoder.returncode != 0:
+            if frames_done == 0 and can_retry:
+                return False
+            log_line(logs, "%s failed" % stage, "error", _stderr_tail(decode_log))
+            raise PipelineError(err_code, "Processing failed", logs)
+        if encoder is None:
+            log_line(logs, "%s produced no frames" % stage)
+            raise PipelineError(err_code, "Processing failed", logs)
+        encoder.stdin.close()
+        try:
+            record_usage(logs, metrics.wait_child(encoder, max(1, deadline - time.time())), frames_done)
+        except subprocess.TimeoutExpired:
+            log_line(logs, "Timeout in encode", "error")
+            raise PipelineError(ERR_ENCODE, "Stage timeout", logs)
+        if encoder.returncode != 0:
+            log_line(logs, "encode failed", "error", _stderr_tail(encode_log))
+            raise PipelineError(ERR_ENCODE, "Processing failed", logs)
+        if tracker is not None:
+            tracker.update(frames=frames_done, out_time=frames_done * den / float(num), final=True)
+            log_line(logs, "Streamed %d frames at %.1f fps" % (frames_done, tracker.fps))
+        else:
+            log_line(logs, "Streamed %d frames" % frames_done)
+        if engine.backend.last_tile:
+            log_line(logs, "Upscaled in %dpx tiles (%d out-of-memory retries)" % (
+                engine.backend.last_tile, engine.backend.oom_retries - oom_retries))
+        if deduper is not None:
+            log_line(logs, "Dedup: upscaled %d of %d frames, %d repeats skipped" % (deduper.unique, deduper.frames, deduper.skipped))
+            counters = getattr(logs, "counters", None)
+            if counters is not None:
+                counters.update(dedup_frames=deduper.frames, dedup_skipped=deduper.skipped)
+        return True
+    finally:
+        for proc in (decoder, encoder):
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def input_frame_size(meta, logs):
+    stream = video_stream_info(meta)
+    in_wh = (int(stream.get("width") or 0), int(stream.get("height") or 0))
+    if in_wh[0] <= 0 or in_wh[1] <= 0:
+        log_line(logs, "Probe reported no video dimensions")
+        raise PipelineError(ERR_INPUT_PROBE, "Input probe failed", logs)
+    return in_wh
 
-    request = apply_profile(request)
-    validate_request(request, logs)
 
-    input_url = request.get("input_url")
-    size_gb = estimate_input_size_gb(input_url, logs)
-    if size_gb is not None and size_gb > Config.MAX_INPUT_GB:
-        log_line(logs, "Input too large: %.2f GB" % size_gb)
-        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+def run_streaming_video(input_path, filter_chain, meta, spec, encode_cmd_for, tmp_dir, logs, feed=None):
+    with timed(logs, "stream_process"):
+        in_wh = input_frame_size(meta, logs)
+        threads = stage_threads(logs, "stream", spec.get("cpus"), "stream_process")
 
-    os.makedirs(Config.WORK_DIR, exist_ok=True)
-    os.makedirs(Config.TMP_DIR, exist_ok=True)
+        def decode_cmd(chain):
+            return ["ffmpeg", "-v", "error"] + threads.input_args() + [
+                "-i", "pipe:0" if feed is not None else input_path,
+                "-vf", chain,
+                "-an", "-f", "rawvideo", "-pix_fmt", STREAM_PIX_FMT, "pipe:1"
+            ]
 
-    job_id = str(int(time.time()))
-    work_dir = os.path.join(Config.WORK_DIR, job_id)
-    tmp_dir = os.path.join(Config.TMP_DIR, job_id)
-    os.makedirs(work_dir, exist_ok=True)
-    os.makedirs(tmp_dir, exist_ok=True)
+        def encode_with_threads(video_input_args):
+            return encode_cmd_for(video_input_args, threads=threads)
 
-    input_path = os.path.join(tmp_dir, "input")
-    download_input(input_url, input_path, logs)
+        if _stream_video_pass(decode_cmd(filter_chain), in_wh, stream_frame_rate(meta, filter_chain), spec, encode_with_threads, tmp_dir, logs, "bwdif" in filter_chain, feed):
+            return
+        # If bwdif failed, retry with yadif
+        log_line(logs, "bwdif failed; retrying with yadif", "warning")
+        chain = filter_chain.replace("bwdif", "yadif")
+        _stream_video_pass(decode_cmd(chain), in_wh, stream_frame_rate(meta, chain), spec, encode_with_threads, tmp_dir, logs, False, feed, "stream_process_yadif", ERR_DEINTERLACE)
+
+
+def upscale_video_file(src_path, dst_path, filter_chain, meta, spec, tmp_dir, logs):
+    # Staged mode: decode the preprocessed intermediate, upscale through the engine, re-encode
+    with timed(logs, "upscale"):
+        threads = stage_threads(logs, "upscale", spec.get("cpus"))
+        decode_cmd = ["ffmpeg", "-v", "error"] + threads.input_args() + ["-i", src_path, "-f", "rawvideo", "-pix_fmt", STREAM_PIX_FMT, "pipe:1"]
+
+        def encode_cmd_for(video_input_args):
+            return ["ffmpeg", "-y"] + video_input_args + encoders.intermediate_args(threads.encode) + [dst_path]
+
+        _stream_video_pass(decode_cmd, input_frame_size(meta, logs), stream_frame_rate(meta, filter_chain), spec, encode_cmd_for, tmp_dir, logs, False, None, "upscale", ERR_UPSCALE)
+
+
+def process_video(input_path, output_path, spec, meta, audio, tmp_dir, logs, start_time=None, checkpoint=None, feed=None):
+    ladder = spec.get("ladder")
+
+    def encode_cmd_for(video_input_args, prefilter=None, audio_source=audio, threads=None):
+        video_args = list(spec["video_args"])
+        if threads is not None:
+            video_input_args = threads.input_args(bool(ladder)) + list(video_input_args)
+            video_args += threads.encoder_args(spec.get("encoder"), len(ladder["renditions"]) if ladder else 1)
+        if ladder:
+            return build_ladder_cmd(video_input_args, audio_source, ladder, video_args, output_path, prefilter)
+        return build_encode_cmd(video_input_args, audio_source, spec["target_wh"], video_args, output_path, prefilter, spec.get("output_args", ()))
+
+    if ladder:
+        # A package dir from an earlier attempt could leave stale segments behind
+        shutil.rmtree(output_path, ignore_errors=True)
+        os.makedirs(output_path)
+
+    def check_deadline():
+        if start_time is not None:
+            enforce_max_job_seconds(start_time, logs)
+
+    filter_chain = spec["filter_chain"]
+    if not spec["upscale"]:
+        # Planner chose no ML upscale: preprocess filters fold into the final scale + encode
+        if audio and audio["path"] == input_path:
+            direct_audio = dict(audio, same_input=True)
+        else:
+            direct_audio = audio
+        threads = stage_threads(logs, "direct", spec.get("cpus"), "encode")
+        with resource_slot(logs, "cpu"):
+            _run_direct_encode(input_path, filter_chain, lambda args, chain: encode_cmd_for(args, chain, direct_audio, threads), logs, feed)
+        check_deadline()
+        return
+
+    if spec["streaming"]:
+        # Stage 3-8 in one pass: raw frames flow decoder -> upscaler -> encoder
+        with resource_slot(logs, "cpu", "gpu"):
+            run_streaming_video(input_path, filter_chain, meta, spec, encode_cmd_for, tmp_dir, logs, feed)
+        check_deadline()
+        return
+
+    # Stage 6/7: upscale + resize
+    stage4_path = os.path.join(tmp_dir, "stage4_exposed.mp4")
+    stage6_path = os.path.join(tmp_dir, "stage6_upscaled.mp4")
+    if checkpoint is not None and checkpoint.has_file("upscale", stage6_path):
+        log_line(logs, "Resuming from checkpoint: upscale")
+    else:
+        preprocess = checkpoint.done("preprocess") if checkpoint is not None else None
+        if preprocess and checkpoint.has_file("preprocess", stage4_path):
+            log_line(logs, "Resuming from checkpoint: preprocess")
+            used_chain = preprocess.get("filter_chain", filter_chain)
+        else:
+            with resource_slot(logs, "cpu"):
+                used_chain = run_preprocess(input_path, stage4_path, filter_chain, logs, feed, spec.get("cpus"))
+            if checkpoint is not None:
+                checkpoint.mark("preprocess", path=stage4_path, filter_chain=used_chain)
+        check_deadline()
+
+        with resource_slot(logs, "gpu"):
+            upscale_video_file(stage4_path, stage6_path, used_chain, meta, spec, tmp_dir, logs)
+        if checkpoint is not None:
+            checkpoint.mark("upscale", path=stage6_path)
+        check_deadline()
+
+    # Stage 7/8: resize + encode
+    with resource_slot(logs, "cpu"), timed(logs, "encode"):
+        threads = stage_threads(logs, "encode", spec.get("cpus"))
+        run_cmd(encode_cmd_for(["-i", stage6_path], threads=threads), Config.STAGE_TIMEOUT_PROCESS, logs, "encode", ERR_ENCODE)
+    check_deadline()
+
+
+def _run_direct_encode(input_path, filter_chain, encode_cmd_for, logs, feed=None):
+    with timed(logs, "encode"):
+        video_input = ["-i", "pipe:0" if feed is not None else input_path]
+        try:
+            run_cmd(encode_cmd_for(video_input, filter_chain), Config.STAGE_TIMEOUT_PROCESS, logs, "encode", ERR_ENCODE, feed)
+        except PipelineError:
+            # If bwdif failed, retry with yadif
+            if "bwdif" not in filter_chain:
+                raise
+            log_line(logs, "bwdif failed; retrying with yadif", "warning")
+            run_cmd(encode_cmd_for(video_input, filter_chain.replace("bwdif", "yadif")), Config.STAGE_TIMEOUT_PROCESS, logs, "encode_yadif", ERR_DEINTERLACE, feed)
+
+
+def run_preprocess(input_path, stage4_path, filter_chain, logs, feed=None, cpus=None):
+    with timed(logs, "preprocess"):
+        threads = stage_threads(logs, "preprocess", cpus)
+
+        def vf_cmd(chain):
+            return ["ffmpeg", "-y"] + threads.input_args() + [
+                "-i", "pipe:0" if feed is not None else input_path,
+                "-vf", chain
+            ] + encoders.intermediate_args(threads.encode) + ["-an", stage4_path]
+
+        try:
+            run_cmd(vf_cmd(filter_chain), Config.STAGE_TIMEOUT_PROCESS, logs, "preprocess", ERR_EXPOSURE, feed)
+        except PipelineError as pe:
+            # If bwdif failed, retry with yadif
+            if "bwdif" in filter_chain:
+                log_line(logs, "bwdif failed; retrying with yadif", "warning")
+                filter_chain_retry = filter_chain.replace("bwdif", "yadif")
+                run_cmd(vf_cmd(filter_chain_retry), Config.STAGE_TIMEOUT_PROCESS, logs, "preprocess_yadif", ERR_DEINTERLACE, feed)
+                return filter_chain_retry
+            raise pe
+        return filter_chain
+
+
+def available_cpus():
+    # Affinity capped by the container's cgroup CPU quota
+    return scheduler.available_cores()
+
+
+def input_duration(meta):
     try:
-        file_size = os.path.getsize(input_path)
-        size_gb = float(file_size) / (1024 ** 3)
-        log_line(logs, "Downloaded size: %.2f GB" % size_gb)
-        if size_gb > Config.MAX_INPUT_GB:
-            raise PipelineError(ERR_VALIDATION, "Input too large", logs)
-    except PipelineError:
-        raise
+        return float(meta.get("format", {}).get("duration") or 0.0)
     except Exception:
-        pass
+        return 0.0
+
+
+def plan_segment_count(meta):
+    seconds = max(1, Config.SEGMENT_SECONDS)
+    duration = input_duration(meta)
+    # Short inputs are not worth the split/concat overhead
+    if duration <= seconds * 1.5:
+        return 1
+    return int(math.ceil(duration / seconds))
+
+
+def detect_scene_cuts(path, threshold, logs, start=0.0, duration=None):
+    # Whole input by default; start/duration limit the scan to one span (times stay absolute)
+    with timed(logs, "scene_detect"):
+        cmd = ["ffmpeg"] + stage_threads(logs, "scene_detect").input_args() + (["-ss", "%.3f" % start] if start else []) + ["-i", path]
+        if duration:
+            cmd += ["-t", "%.3f" % duration]
+        cmd += [
+            "-an",
+            "-vf", "scale=160:-2,select='gt(scene,%.3f)',showinfo" % threshold,
+            "-f", "null", "-"
+        ]
+        result = run_cmd(cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "scene_detect", ERR_INPUT_PROBE, keep_stderr=True)
+        stderr = result.stderr.decode("utf-8", errors="ignore")
+        cuts = []
+        for match in re.finditer(r"pts_time:([0-9.]+)", stderr):
+            try:
+                cuts.append(start + float(match.group(1)))
+            except ValueError:
+                pass
+        return sorted(cuts)
+
+
+def plan_segment_times(meta, cuts):
+    seconds = float(max(1, Config.SEGMENT_SECONDS))
+    duration = input_duration(meta)
+    times = []
+    t = seconds
+    while t < duration - seconds * 0.5:
+        # Snap each nominal boundary to the nearest scene cut within half a segment
+        near = [c for c in cuts if abs(c - t) <= seconds * 0.5]
+        point = min(near, key=lambda c: abs(c - t)) if near else t
+        if not times or point > times[-1] + 1.0:
+            times.append(point)
+        t += seconds
+    return times
+
+
+def split_segments(input_path, meta, seg_dir, logs):
+    with timed(logs, "segment_split"):
+        os.makedirs(seg_dir, exist_ok=True)
+        cmd = ["ffmpeg", "-y", "-i", input_path, "-map", "0:v:0", "-an", "-c", "copy", "-f", "segment", "-reset_timestamps", "1"]
+        if Config.SEGMENT_SCENE_THRESHOLD > 0:
+            cuts = detect_scene_cuts(input_path, Config.SEGMENT_SCENE_THRESHOLD, logs)
+            times = plan_segment_times(meta, cuts)
+            log_line(logs, "Scene-aligned segment boundaries: %d (from %d cuts)" % (len(times), len(cuts)))
+            cmd += ["-segment_times", ",".join("%.3f" % t for t in times)] if times else ["-segment_time", str(Config.SEGMENT_SECONDS)]
+        else:
+            cmd += ["-segment_time", str(Config.SEGMENT_SECONDS)]
+        # Stream copy splits at the nearest keyframe, so no frames are re-encoded here
+        cmd.append(os.path.join(seg_dir, "seg_%05d.mkv"))
+        run_cmd(cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "segment_split", ERR_INPUT_PROBE)
+        return sorted(os.path.join(seg_dir, f) for f in os.listdir(seg_dir) if f.startswith("seg_"))
+
+
+def _process_segment(args):
+    # Runs in a pool worker; PipelineError does not pickle, so report a plain dict
+    index, seg_path, out_path, spec, meta, seg_tmp = args
+    logs = progress.JobLog(timings=metrics.JobTimings())
+    result = {"index": index, "ok": False, "code": ERR_INTERNAL, "message": "Internal error"}
+    attempts = 1 + max(0, Config.SEGMENT_RETRIES)
+    for attempt in range(1, attempts + 1):
+        shutil.rmtree(seg_tmp, ignore_errors=True)
+        os.makedirs(seg_tmp, exist_ok=True)
+        try:
+            process_video(seg_path, out_path, spec, meta, None, seg_tmp, logs)
+            result.update({"ok": True, "code": None, "message": None})
+            break
+        except PipelineError as pe:
+            result.update({"code": pe.code, "message": pe.message})
+        except Exception as exc:
+            log_line(logs, "Unhandled error: %s" % exc, "error")
+        log_line(logs, "Segment %d attempt %d/%d failed" % (index, attempt, attempts), "warning")
+    if not Config.KEEP_INTERMEDIATES:
+        shutil.rmtree(seg_tmp, ignore_errors=True)
+    result["logs"] = logs.events()
+    result["timings"] = logs.timings.as_dict()
+    result["counters"] = dict(logs.counters)
+    return result
+
+
+def run_segmented_video(input_path, output_path, spec, meta, audio, tmp_dir, logs, start_time, checkpoint=None):
+    split = checkpoint.done("segment_split") if checkpoint is not None else None
+    if split and all(os.path.exists(p) for p in split.get("paths", [])):
+        segments = split["paths"]
+        log_line(logs, "Resuming from checkpoint: segment_split")
+    else:
+        segments = split_segments(input_path, meta, os.path.join(tmp_dir, "segments"), logs)
+        if checkpoint is not None and segments:
+            checkpoint.mark("segment_split", paths=segments)
+    if not segments:
+        log_line(logs, "Segment split produced no output")
+        raise PipelineError(ERR_INPUT_PROBE, "Input probe failed", logs)
     enforce_max_job_seconds(start_time, logs)
 
-    meta = ffprobe_metadata(input_path, logs)
-    interlaced = detect_interlace(input_path, logs)
+    ext = os.path.splitext(output_path)[1]
+    out_dir = os.path.join(tmp_dir, "segments_out")
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    pending = []
+    workers = Config.SEGMENT_WORKERS if Config.SEGMENT_WORKERS > 0 else available_cpus()
+    workers = max(1, min(workers, len(segments)))
+    # Live-upload muxer flags only apply to the concatenated output; each worker gets
+    # its share of the job's cores for the thread budget
+    seg_spec = dict(spec, output_args=[], cpus=max(1, threadbudget.job_cpus() // workers))
+    for i, seg_path in enumerate(segments):
+        out_path = os.path.join(out_dir, "seg_%05d%s" % (i, ext))
+        job = (i, seg_path, out_path, seg_spec, meta, os.path.join(tmp_dir, "seg_tmp_%05d" % i))
+        jobs.append(job)
+        if checkpoint is None or not checkpoint.has_file("segment_%05d" % i, out_path):
+            pending.append(job)
+    if len(pending) < len(jobs):
+        log_line(logs, "Resuming from checkpoint: %d of %d segments done" % (len(jobs) - len(pending), len(jobs)))
+
+    workers = max(1, min(workers, len(pending) or 1))
+    log_line(logs, "Processing %d segments with %d workers" % (len(pending), workers))
+    failed = None
+    reporter = getattr(logs, "reporter", None)
+    tracker = reporter.stage("segments") if reporter is not None else None
+    done = len(jobs) - len(pending)
+    timings = getattr(logs, "timings", None)
+    with timed(logs, "segments"), worker_pool(workers, spec, logs) as pool:
+        futures = [pool.submit(_process_segment, job) for job in pending]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                logs.merge(result["logs"], "segment_")
+                if timings is not None:
+                    # Worker stage times add up across parallel segments (process-seconds)
+                    timings.merge(result["timings"], "segment_")
+                logs.counters.update(result["counters"])
+                if not result["ok"]:
+                    failed = result
+                    break
+                done += 1
+                log_line(logs, "Segment %d done" % result["index"])
+                if tracker is not None:
+                    tracker.update(done=done, total=len(jobs), final=done == len(jobs))
+                if checkpoint is not None:
+                    checkpoint.mark("segment_%05d" % result["index"], path=jobs[result["index"]][2])
+                enforce_max_job_seconds(start_time, logs)
+        finally:
+            for future in futures:
+                future.cancel()
+    if failed is not None:
+        log_line(logs, "Segment %d failed after retries" % failed["index"], "error")
+        raise PipelineError(failed["code"] or ERR_INTERNAL, failed["message"] or "Processing failed", logs)
+
+    list_path = os.path.join(tmp_dir, "segments.txt")
+    with open(list_path, "w") as f:
+        for job in jobs:
+            f.write("file '%s'\n" % job[2].replace("'", "'\\''"))
+    concat_cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio:
+        # Audio comes straight from the original input in the same pass
+        concat_cmd += ["-i", audio["path"], "-map", "0:v:0", "-map", "1:a:0"] + audio["args"]
+    concat_cmd += ["-c:v", "copy"] + list(spec.get("output_args", ())) + [output_path]
+    with timed(logs, "concat"):
+        run_cmd(concat_cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "concat", ERR_ENCODE)
     enforce_max_job_seconds(start_time, logs)
 
-    deinterlace = request.get("deinterlace", Config.DEFAULT_DEINTERLACE)
-    denoise_strength = int(request.get("denoise_strength", Config.DEFAULT_DENOISE))
-    sharpen_strength = int(request.get("sharpen_strength", Config.DEFAULT_SHARPEN))
-    brightness = float(request.get("brightness", Config.DEFAULT_BRIGHTNESS))
-    gamma = float(request.get("gamma", Config.DEFAULT_GAMMA))
-    contrast = float(request.get("contrast", Config.DEFAULT_CONTRAST))
-    auto_exposure = bool(request.get("auto_exposure", Config.DEFAULT_AUTO_EXPOSURE))
-    model = request.get("model", Config.DEFAULT_MODEL)
-    target_res = request.get("target_resolution", Config.DEFAULT_TARGET_RES)
-    codec = request.get("codec", Config.DEFAULT_CODEC)
-    container = request.get("container", Config.DEFAULT_CONTAINER)
-    keep_audio = bool(request.get("keep_audio", Config.KEEP_AUDIO))
-    preset = request.get("preset", Config.DEFAULT_PRESET)
 
+def link_cached_input(cached_path, input_path):
+    # A hard link keeps the data alive even if the cache evicts the entry mid-job
+    try:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+        os.link(cached_path, input_path)
+        return input_path
+    except OSError:
+        return cached_path
+
+
+class AudioExtract(object):
+    # Separate audio pass for inputs the final encoder cannot read (still downloading);
+    # runs alongside the video stages and reads its own pipe from the growing file.
+    def __init__(self, input_path, audio, tmp_dir, logs, feed=None):
+        self.path = os.path.join(tmp_dir, "audio.mka")
+        self.ok = False
+        cmd = ["ffmpeg", "-y", "-i", "pipe:0" if feed is not None else input_path, "-vn", "-map", "0:a:0"] + audio["args"] + [self.path]
+        self._thread = threading.Thread(target=self._run, args=(cmd, logs, feed), daemon=True)
+        self._thread.start()
+
+    def _run(self, cmd, logs, feed):
+        try:
+            run_cmd(cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "extract_audio", ERR_ENCODE, feed)
+            self.ok = True
+        except Exception:
+            log_line(logs, "Audio extraction failed; continuing without audio", "warning")
+
+    def wait(self):
+        self._thread.join()
+        return self.path if self.ok else None
+
+
+def mux_audio(video_path, audio_path, output_path, logs, output_args=()):
+    with timed(logs, "mux_audio"):
+        if not audio_path:
+            os.replace(video_path, output_path)
+            return
+        cmd = [
+            "ffmpeg", "-y", "-i", video_path, "-i", audio_path,
+            "-map", "0:v:0", "-map", "1:a:0",
+            "-c", "copy"
+        ] + list(output_args) + [output_path]
+        run_cmd(cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "mux_audio", ERR_ENCODE)
+
+
+class Checkpoint(object):
+    # Stage manifest for one job key; written atomically after every finished stage
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.data = {"key": key, "stages": {}}
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("key") == key:
+                self.data = data
+        except Exception:
+            pass
+
+    def done(self, stage):
+        return self.data["stages"].get(stage)
+
+    def has_file(self, stage, path):
+        entry = self.done(stage)
+        return bool(entry) and entry.get("path") == path and os.path.exists(path)
+
+    def mark(self, stage, **info):
+        info["finished_at"] = time.time()
+        self.data["stages"][stage] = info
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+_job_locks = {}
+_job_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def job_dir_lock(job_id):
+    # With RESUME_JOBS, identical concurrent requests share a work dir; the later one waits,
+    # then resumes from the earlier one's checkpoints instead of racing it
+    with _job_locks_lock:
+        lock, users = _job_locks.get(job_id, (threading.Lock(), 0))
+        _job_locks[job_id] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _job_locks_lock:
+            lock, users = _job_locks[job_id]
+            if users <= 1:
+                del _job_locks[job_id]
+            else:
+                _job_locks[job_id] = (lock, users - 1)
+
+
+def dedup_summary(logs):
+    # Frames that went through the upscale stage and how many repeats it skipped
+    frames = logs.counters.get("dedup_frames", 0)
+    if not frames:
+        return None
+    skipped = logs.counters.get("dedup_skipped", 0)
+    return {"frames": frames, "upscaled": frames - skipped, "skipped": skipped}
+
+
+def scratch_estimate_bytes(size_gb):
+    # Input plus intermediates and output; unknown sizes reserve as for a 1 GB input
+    return int((size_gb if size_gb else 1.0) * Config.JOB_DISK_FACTOR * scheduler.GB)
+
+
+def estimate_job_bytes(meta, specs, input_bytes=0, segmented=False, seconds=None):
+    # Preflight from the probe: the input, each staged upscale's intermediates (at the
+    # deinterlaced rate, source and upscaled size), and every output; segmented jobs also
+    # hold the split input and the per-segment outputs until the concat
+    stream = video_stream_info(meta)
+    src_wh = (int(stream.get("width") or 720), int(stream.get("height") or 576))
+    if seconds is None:
+        seconds = input_duration(meta) or 3600.0
+    total = input_bytes
+    staged = set()
+    for spec in specs:
+        num, den = parse_frame_rate(stream_frame_rate(meta, spec["filter_chain"]))
+        fps = num / float(den)
+        for wh in (spec.get("ladder") or {}).get("renditions") or [spec["target_wh"]]:
+            total += scratch.video_bytes(wh, fps, seconds, scratch.OUTPUT_BPP) * (2 if segmented else 1)
+        key = (spec["filter_chain"], spec["model"], spec["scale"])
+        if spec["upscale"] and not spec.get("streaming") and key not in staged:
+            staged.add(key)
+            up_wh = (src_wh[0] * spec["scale"], src_wh[1] * spec["scale"])
+            total += scratch.video_bytes(src_wh, fps, seconds, scratch.INTERMEDIATE_BPP)
+            total += scratch.video_bytes(up_wh, fps, seconds, scratch.UPSCALED_BPP)
+    if segmented:
+        total += input_bytes
+    return int(total * scratch.SAFETY_MARGIN)
+
+
+def admission_failed(exc, logs):
+    log_line(logs, "Not admitted: %s" % exc)
+    if isinstance(exc, scheduler.DiskSpaceError):
+        return PipelineError(ERR_DISK_SPACE, "Insufficient scratch space", logs)
+    return PipelineError(ERR_VALIDATION, "Insufficient worker capacity", logs)
+
+
+def job_shape(meta, spec, params, input_bytes=0, segmented=False):
+    # What the estimator needs to know about a planned job
+    stream = video_stream_info(meta)
+    num, den = parse_frame_rate(stream_frame_rate(meta, spec["filter_chain"]))
+    workers = 1
+    if segmented:
+        workers = Config.SEGMENT_WORKERS if Config.SEGMENT_WORKERS > 0 else available_cpus()
+        workers = max(1, min(workers, plan_segment_count(meta)))
+    return {
+        "duration": input_duration(meta) or 3600.0,
+        "src_wh": (int(stream.get("width") or 720), int(stream.get("height") or 576)),
+        "target_wh": spec["target_wh"],
+        "renditions": (spec.get("ladder") or {}).get("renditions") or [spec["target_wh"]],
+        "fps": num / float(den),
+        "upscale": spec["upscale"],
+        "streaming": bool(spec["upscale"] and spec.get("streaming")),
+        "segmented": segmented,
+        "workers": workers,
+        "backend": Config.UPSCALER_BACKEND,
+        "model": spec["model"],
+        "encoder": spec["encoder"],
+        "input_bytes": input_bytes,
+        "keep_audio": bool(params["keep_audio"] and audio_stream_info(meta)),
+    }
+
+
+def check_estimate(meta, spec, params, shape, skip, done, can_segment, start_time, logs, enforce=True):
+    # Before the heavy stages: predict the job and, when what is left of it would overrun
+    # MAX_JOB_SECONDS, switch to a faster plan. Returns (shape, estimate); the estimate
+    # covers the whole job, minus stages a cache hit or checkpoint skips.
+    def remaining(estimate):
+        return estimate["seconds"] - sum(estimate["stages"][n]["seconds"] for n in done if n in estimate["stages"])
+
+    estimate = estimator.estimate(shape, skip)
+    budget = Config.MAX_JOB_SECONDS - (time.time() - start_time)
+    log_line(logs, "Estimated %.0fs to go (%s rates), %.0fs left of MAX_JOB_SECONDS" % (remaining(estimate), estimate["basis"], budget))
+    replanned = []
+    if Config.ESTIMATE_CHECK in ("replan", "enforce") and remaining(estimate) > budget:
+        if shape["upscale"] and not shape["streaming"] and not shape["segmented"]:
+            replanned.append("streaming")
+            shape = dict(shape, streaming=True)
+            estimate = estimator.estimate(shape, skip)
+        if remaining(estimate) > budget and can_segment and not shape["segmented"] and available_cpus() > 1:
+            replanned.append("segmented")
+            shape = job_shape(meta, spec, params, shape["input_bytes"], True)
+            estimate = estimator.estimate(shape, skip)
+        if replanned:
+            log_line(logs, "Re-planned as %s: estimated %.0fs to go" % ("+".join(replanned), remaining(estimate)))
+    estimate["replanned"] = replanned
+    estimate["within_limit"] = remaining(estimate) <= budget
+    # Built-in rates are guesses; only measured ones are trusted to refuse a job
+    estimate["rejected"] = bool(not estimate["within_limit"] and Config.ESTIMATE_CHECK == "enforce" and estimate["basis"] == "history")
+    if estimate["rejected"] and enforce:
+        raise PipelineError(ERR_TIMEOUT, "Estimated runtime exceeds limit", logs)
+    if not estimate["within_limit"] and Config.ESTIMATE_CHECK != "off":
+        log_line(logs, "Estimate exceeds MAX_JOB_SECONDS", "warning")
+    return shape, estimate
+
+
+@contextlib.contextmanager
+def resource_slot(logs, *pools):
+    # Holds scheduler pool slots for one stage; time spent queued is recorded as queue_<pool>
+    with scheduler.get().slot(*pools) as waited:
+        if waited >= 0.05 and logs.timings is not None:
+            logs.timings.record("queue_%s" % "_".join(pools)).wall_sec += waited
+        if waited >= 1.0:
+            log_line(logs, "Waited %.0fs for %s slot" % (waited, "+".join(pools)))
+        yield
+
+
+def input_identity(url, head):
+    identity = {}
+    for key in ("etag", "last_modified", "content_length"):
+        if head.get(key):
+            identity[key] = head[key]
+    # Presigned query strings change between submissions; validators identify the object
+    identity["url"] = url.split("?")[0] if (head.get("etag") or head.get("last_modified")) else url
+    return identity
+
+
+def compute_job_key(identity, params):
+    blob = json.dumps({"input": identity, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def resolve_params(request, logs):
+    codec = request.get("codec", Config.DEFAULT_CODEC)
     crf = request.get("crf")
     if crf is None:
-        crf = Config.DEFAULT_CRF_H265 if codec == "h265" else Config.DEFAULT_CRF_H264
-
+        crf = Config.DEFAULT_CRF_H264 if codec == "h264" else Config.DEFAULT_CRF_H265
+    target_res = request.get("target_resolution", Config.DEFAULT_TARGET_RES)
     target_wh = parse_target_resolution(target_res)
     if target_wh is None:
         raise PipelineError(ERR_VALIDATION, "Invalid target resolution", logs)
+    params = {
+        "deinterlace": request.get("deinterlace", Config.DEFAULT_DEINTERLACE),
+        "denoise_strength": int(request.get("denoise_strength", Config.DEFAULT_DENOISE)),
+        "sharpen_strength": int(request.get("sharpen_strength", Config.DEFAULT_SHARPEN)),
+        "brightness": float(request.get("brightness", Config.DEFAULT_BRIGHTNESS)),
+        "gamma": float(request.get("gamma", Config.DEFAULT_GAMMA)),
+        "contrast": float(request.get("contrast", Config.DEFAULT_CONTRAST)),
+        "auto_exposure": bool(request.get("auto_exposure", Config.DEFAULT_AUTO_EXPOSURE)),
+        "profile": request.get("profile"),
+        # None lets the planner pick the model from the required scale
+        "model": request.get("model"),
+        "target_wh": target_wh,
+        "codec": codec,
+        "crf": crf,
+        "preset": request.get("preset", Config.DEFAULT_PRESET),
+        "encoder": request.get("encoder", Config.ENCODER),
+        "encoder_quality": request.get("encoder_quality", Config.DEFAULT_ENCODER_QUALITY),
+        "container": request.get("container", Config.DEFAULT_CONTAINER),
+        "keep_audio": bool(request.get("keep_audio", Config.KEEP_AUDIO)),
+        "streaming": bool(request.get("streaming", Config.STREAMING_MODE)),
+        "segmented": bool(request.get("segmented", Config.SEGMENTED_MODE)),
+        "stream_input": bool(request.get("stream_input", Config.STREAM_INPUT)),
+        "live_upload": bool(request.get("live_upload", Config.S3_LIVE_UPLOAD)),
+        "dedup": bool(request.get("dedup", Config.DEDUP_FRAMES)),
+    }
+    if params["container"] in LADDER_MANIFESTS:
+        # A ladder is encoded in one pass from local frames and uploaded as a whole
+        ignored = [f for f in LADDER_IGNORED_FLAGS if params[f]]
+        if ignored:
+            log_line(logs, "%s output ignores %s" % (params["container"].upper(), ", ".join(ignored)))
+            params.update((f, False) for f in ignored)
+    return params
+
+
+def plan_stages(meta, params, logs):
+    # Cheapest stage graph that still reaches the target resolution
+    src_w, src_h = input_frame_size(meta, logs)
+    target_w, target_h = params["target_wh"]
+    required = max(float(target_w) / src_w, float(target_h) / src_h)
+    plan = {
+        "source_resolution": "%dx%d" % (src_w, src_h),
+        "required_scale": round(required, 3),
+        "upscale": False,
+        "model": None,
+        "scale": 1,
+    }
+    if params["model"]:
+        plan.update(upscale=True, model=params["model"], scale=MODEL_SCALES.get(params["model"], Config.UPSCALE_FACTOR), reason="model requested")
+    elif params["profile"] == "fast_preview":
+        plan["reason"] = "fast_preview skips ML upscale"
+    elif required <= 1.0:
+        plan["reason"] = "target is not larger than source"
+    else:
+        # Let the final scale cover up to PLANNER_RESIZE_SLACK of the remaining gap
+        scale = 2 if required <= 2 * max(1.0, Config.PLANNER_RESIZE_SLACK) else 4
+        model = Config.DEFAULT_MODEL if MODEL_SCALES.get(Config.DEFAULT_MODEL) == scale else PLANNER_MODELS[scale]
+        plan.update(upscale=True, model=model, scale=scale, reason="x%d model for x%.2f target" % (scale, required))
+    if plan["upscale"]:
+        caps = capabilities.get()
+        if not caps.upscaler_available():
+            log_line(logs, "Upscaler unavailable: %s" % caps.upscaler.get("error"), "error")
+            raise PipelineError(ERR_UPSCALE, "Upscaler not available", logs)
+        if not caps.has_model(plan["model"]):
+            log_line(logs, "Model %s is not installed (have: %s)" % (plan["model"], ", ".join(sorted(caps.upscaler["models"])) or "none"))
+            raise PipelineError(ERR_UPSCALE, "Model not available", logs)
+    plan["stages"] = ["preprocess", "upscale", "encode"] if plan["upscale"] else ["encode"]
+    plan["fold_filters"] = not plan["upscale"]
+    log_line(logs, "Plan: %s (%s)" % ("+".join(plan["stages"]), plan["reason"]))
+    return plan
+
+
+def choose_encoder(params, logs):
+    try:
+        encoder = encoders.select_encoder(params["codec"], params["encoder_quality"], params["encoder"])
+    except encoders.EncoderError as exc:
+        log_line(logs, "Encoder selection failed: %s" % exc, "error")
+        raise PipelineError(ERR_VALIDATION, "Encoder not available", logs)
+    log_line(logs, "Encoder: %s (%s, %s quality)" % (
+        encoder.name, "hardware" if encoder.hardware else "software", params["encoder_quality"]))
+    return encoder
 
+
+def build_preprocess_filters(params, analysis, logs):
     # Stage 3-5: preprocess (deinterlace + exposure + denoise + sharpen)
     filters = []
-    if deinterlace == "on" or (deinterlace == "auto" and interlaced):
-        filters.append("bwdif")
-    elif deinterlace == "off":
-        pass
+    deinterlace = params["deinterlace"]
+    if deinterlace == "on" or (deinterlace == "auto" and analysis["interlaced"]):
+        # Builds without bwdif go straight to yadif instead of failing a pass first
+        filters.append("bwdif" if capabilities.get().has_filter("bwdif") else "yadif")
 
     # Stage 4: exposure
-    exposure_filter, applied_b, applied_g, applied_c = build_exposure_filter(brightness, gamma, contrast, auto_exposure, logs)
+    exposure_filter, applied_b, applied_g, applied_c = build_exposure_filter(
+        params["brightness"], params["gamma"], params["contrast"], params["auto_exposure"], logs,
+        analysis.get("luma"))
     filters.append(exposure_filter)
 
     # Stage 5: denoise
     # Map 0..100 to hqdn3d luma/chroma values
+    denoise_strength = params["denoise_strength"]
     luma = max(0.0, min(4.0, denoise_strength / 25.0))
     chroma = max(0.0, min(3.0, denoise_strength / 35.0))
     filters.append("hqdn3d=%.2f:%.2f:%.2f:%.2f" % (luma, chroma, luma, chroma))
 
-    sharpen_filter = build_sharpen_filter(sharpen_strength)
+    sharpen_filter = build_sharpen_filter(params["sharpen_strength"])
     if sharpen_filter:
         filters.append(sharpen_filter)
 
-    # Stage 6/7: upscale + resize
-    # Real-ESRGAN expected to output upscaled frames; here we call a wrapper command
-    stage4_path = os.path.join(tmp_dir, "stage4_exposed.mp4")
     filter_chain = ",".join(filters) if filters else "null"
+    return filter_chain, (applied_b, applied_g, applied_c)
 
-    vf_cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-vf", filter_chain,
-        "-c:v", "libx264", "-crf", "18", "-preset", "veryfast",
-        "-an", stage4_path
-    ]
-    try:
-        run_cmd(vf_cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "preprocess", ERR_EXPOSURE)
-    except PipelineError as pe:
-        # If bwdif failed, retry with yadif
-        if "bwdif" in filter_chain:
-            log_line(logs, "bwdif failed; retrying with yadif")
-            filter_chain_retry = filter_chain.replace("bwdif", "yadif")
-            vf_cmd[5] = filter_chain_retry
-            run_cmd(vf_cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "preprocess_yadif", ERR_DEINTERLACE)
-        else:
-            raise pe
-    enforce_max_job_seconds(start_time, logs)
 
-    stage6_path = os.path.join(tmp_dir, "stage6_upscaled.mp4")
-    re_cmd = [
-        "realesrgan-ncnn-vulkan", "-i", stage4_path,
-        "-o", stage6_path,
-        "-n", model,
-        "-s", str(Config.UPSCALE_FACTOR)
-    ]
+def start_live_upload(job_id, output_path, logs):
     try:
-        run_cmd(re_cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "upscale", ERR_UPSCALE)
-    except PipelineError:
-        raise
-    enforce_max_job_seconds(start_time, logs)
+        upload = storage.GrowingUpload(output_path, storage.object_key(job_id, output_path), Config.STAGE_TIMEOUT_UPLOAD)
+        log_line(logs, "Uploading output to S3 while encoding")
+        return upload.start()
+    except storage.UploadError as exc:
+        log_line(logs, "Live upload unavailable: %s" % exc, "warning")
+        return None
 
-    # Stage 7/8: resize + encode
-    output_path = os.path.join(work_dir, "final.%s" % container)
-    w, h = target_wh
-    audio_args = []
-    audio_input = None
-    if keep_audio:
-        audio_input = os.path.join(tmp_dir, "audio.m4a")
-        audio_cmd = ["ffmpeg", "-y", "-i", input_path, "-vn", "-c:a", Config.AUDIO_CODEC, "-b:a", Config.AUDIO_BITRATE, audio_input]
+
+def upload_output(job_id, output_path, logs, already_uploaded=False, live_upload=None, manifest=None):
+    # Stage 9/10: upload (S3 via the worker's pooled client). With a manifest, output_path is
+    # a ladder package dir: every file goes up in parallel and the URL points at the manifest.
+    with timed(logs, "upload"):
+        if not storage.s3_enabled():
+            return "file://" + (os.path.join(output_path, manifest) if manifest else output_path)
+        uploads = storage.tree_keys(job_id, output_path) if manifest else [(output_path, storage.object_key(job_id, output_path))]
+        key = storage.object_key(job_id, manifest) if manifest else uploads[0][1]
+        if live_upload is not None and not already_uploaded:
+            try:
+                live_upload.finish()
+                log_line(logs, "Live upload complete")
+                already_uploaded = True
+            except storage.UploadError as exc:
+                log_line(logs, "Live upload failed (%s); uploading the finished file" % exc, "warning")
         try:
-            run_cmd(audio_cmd, 300, logs, "extract_audio", ERR_ENCODE)
+            if already_uploaded:
+                if live_upload is None:
+                    log_line(logs, "Resuming from checkpoint: upload")
+            else:
+                log_line(logs, "Uploading output to S3" + (" (%d files)" % len(uploads) if manifest else ""))
+                storage.upload_files(uploads, Config.STAGE_TIMEOUT_UPLOAD)
+                timings = getattr(logs, "timings", None)
+                if timings is not None:
+                    timings.add_bytes(read_bytes=sum(os.path.getsize(path) for path, _ in uploads))
+            return storage.presigned_url(key)
+        except Exception as exc:
+            log_line(logs, "S3 upload error: %s" % exc, "error")
+            raise PipelineError(ERR_UPLOAD, "Upload failed", logs)
+
+
+def job_entry(run):
+    # Request entry points take (request, logs) and are called as (request, progress_sink).
+    # The wrapper builds the job's log and reporter, turns an unexpected error into
+    # ERR_INTERNAL that still carries the log, and always closes and publishes the log.
+    @functools.wraps(run)
+    def entry(request, progress_sink=None):
+        reporter = progress.ProgressReporter(progress_sink, Config.PROGRESS_INTERVAL_SEC)
+        logs = progress.JobLog(reporter, metrics.JobTimings(), Config.LOG_DIR)
+        if progress_sink is None and Config.PROGRESS_SINK == "log":
+            reporter.sink = lambda payload: log_line(logs, progress.format_progress(payload))
+        try:
+            return run(request, logs)
         except PipelineError:
-            log_line(logs, "Audio extraction failed; continuing without audio")
-            audio_input = None
-    if audio_input:
-        audio_args = ["-i", audio_input, "-map", "0:v:0", "-map", "1:a:0", "-c:a", Config.AUDIO_CODEC, "-b:a", Config.AUDIO_BITRATE]
-
-    vcodec = "libx265" if codec == "h265" else "libx264"
-    encode_cmd = [
-        "ffmpeg", "-y", "-i", stage6_path,
-        "-vf", "scale=%d:%d" % (w, h),
-        "-c:v", vcodec, "-crf", str(crf), "-preset", preset
-    ] + audio_args + [output_path]
+            raise
+        except Exception as exc:
+            log_line(logs, "Unhandled error: %s" % exc, "error")
+            raise PipelineError(ERR_INTERNAL, "Internal error", logs)
+        finally:
+            logs.log_url = publish_log(logs)
+    return entry
+
+
+def publish_log(logs):
+    # The job's full event log: uploaded next to the outputs when they go to S3, otherwise
+    # left in LOG_DIR. Best effort; a job never fails over its log.
+    path = logs.close()
+    if not path or not os.path.exists(path):
+        return None
+    if storage.s3_enabled():
+        key = "%slogs/%s" % (Config.S3_OUTPUT_PREFIX, os.path.basename(path))
+        try:
+            storage.upload_file(path, key, Config.STAGE_TIMEOUT_UPLOAD)
+            url = storage.presigned_url(key)
+            os.remove(path)
+            return url
+        except Exception:
+            pass
+    scratch.prune_logs()
+    return "file://" + path if os.path.exists(path) else None
+
+
+@job_entry
+def pipeline(request, logs):
+    start_time = time.time()
+    log_line(logs, "Job started")
+    log_line(logs, "Worker: %s" % capabilities.get().summary())
+
+    request = apply_profile(request)
+    validate_request(request, logs)
+    params = resolve_params(request, logs)
+    # Fail before downloading anything if the requested encoder cannot run here
+    encoder = choose_encoder(params, logs)
+
+    input_url = request.get("input_url")
+    head = head_input(input_url, logs)
+    size_gb = estimate_input_size_gb(input_url, logs, head)
+    if size_gb is not None and size_gb > Config.MAX_INPUT_GB:
+        log_line(logs, "Input too large: %.2f GB" % size_gb)
+        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+
+    identity = input_identity(input_url, head)
+    job_key = compute_job_key(identity, params)
+    job_id = job_key[:24] if Config.RESUME_JOBS else scratch.new_job_id()
 
     try:
-        run_cmd(encode_cmd, Config.STAGE_TIMEOUT_PROCESS, logs, "encode", ERR_ENCODE)
-    except PipelineError:
-        raise
+        with job_dir_lock(job_id), scratch.job_space(job_id, Config.RESUME_JOBS) as space:
+            with space.admit(scratch_estimate_bytes(size_gb)) as waited:
+                if waited >= 1.0:
+                    log_line(logs, "Admitted after waiting %.0fs for capacity" % waited)
+                return run_job(request, params, encoder, head, identity, job_key, space, logs, start_time)
+    except scheduler.AdmissionError as exc:
+        raise admission_failed(exc, logs)
+
+
+def _estimate_probe(input_url, head, logs):
+    # Probe data for a dry run without downloading: the probe cache, else ffprobe and the
+    # windowed analysis over HTTP ranges, else the container header alone
+    cache = get_input_cache(Config.CACHE_DIR, Config.CACHE_MAX_GB)
+    cached = cache.lookup(cache.key_for(input_identity(input_url, head))) if cache is not None else None
+    if cached and cached.get("probe") and cached["probe"].get("analysis"):
+        log_line(logs, "Probe cache hit")
+        return cached["probe"]["meta"], cached["probe"]["analysis"]
+    meta = ffprobe_metadata(input_url, logs)
+    if head.get("accept_ranges"):
+        try:
+            return meta, analyze_input(input_url, meta, logs)
+        except PipelineError:
+            log_line(logs, "Remote analysis failed; using the stream header", "warning")
+    field_order = video_stream_info(meta).get("field_order", "progressive")
+    return meta, {"interlaced": field_order in ("tt", "bb", "tb", "bt"), "luma": None}
+
+
+@job_entry
+def run_estimate(request, logs):
+    # Dry run: what pipeline() would plan, how long it would take and what it would write,
+    # without admitting, downloading or processing anything
+    start_time = time.time()
+    log_line(logs, "Estimate started")
+
+    request = apply_profile(request)
+    validate_request(request, logs)
+    params = resolve_params(request, logs)
+    encoder = choose_encoder(params, logs)
+
+    input_url = request.get("input_url")
+    head = head_input(input_url, logs)
+    size_gb = estimate_input_size_gb(input_url, logs, head)
+    if size_gb is not None and size_gb > Config.MAX_INPUT_GB:
+        log_line(logs, "Input too large: %.2f GB" % size_gb)
+        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+
+    meta, analysis = _estimate_probe(input_url, head, logs)
+    filter_chain, applied = build_preprocess_filters(params, analysis, logs)
+    plan = plan_stages(meta, params, logs)
+    spec = {
+        "filter_chain": filter_chain,
+        "upscale": plan["upscale"],
+        "model": plan["model"],
+        "scale": plan["scale"],
+        "target_wh": params["target_wh"],
+        "encoder": encoder.name,
+        "streaming": params["streaming"],
+        "ladder": ladder_spec(params, meta, filter_chain, encoder),
+    }
+    input_bytes = int(head.get("content_length") or 0)
+    can_segment = (not params["stream_input"] or params["segmented"]) and not spec["ladder"]
+    segmented = can_segment and params["segmented"] and plan_segment_count(meta) > 1
+    shape = job_shape(meta, spec, params, input_bytes, segmented)
+    can_segment = can_segment and plan_segment_count(meta) > 1
+    # The dry run's own probe does not count against the job it describes
+    shape, estimate = check_estimate(meta, spec, params, shape, (), (), can_segment, time.time(), logs, enforce=False)
+    if "streaming" in estimate["replanned"]:
+        spec["streaming"] = True
+    estimate["scratch_bytes"] = estimate_job_bytes(meta, [spec], input_bytes, shape["segmented"])
+
+    stream = video_stream_info(meta)
+    log_line(logs, "Estimate finished in %.1fs" % (time.time() - start_time))
+    return {
+        "status": "estimated",
+        "metadata": {
+            "duration_sec": input_duration(meta),
+            "input_resolution": "%sx%s" % (stream.get("width"), stream.get("height")),
+            "output_resolution": "%dx%d" % tuple(params["target_wh"]),
+            "interlace_detected": bool(analysis["interlaced"]),
+            "plan": plan,
+            "encoder": encoder.name,
+            "estimate": estimate,
+            "ladder": ladder_summary(spec["ladder"]),
+            "timings": logs.timings.as_dict(),
+        },
+        "logs": logs,
+    }
+
+
+def run_job(request, params, encoder, head, identity, job_key, space, logs, start_time):
+    # Everything after admission: the job holds its disk reservation until this returns,
+    # and job_space() removes its scratch when it does
+    input_url = request.get("input_url")
+    reporter = logs.reporter
+    job_id = space.job_id
+    work_dir = space.work_dir
+    tmp_dir = space.tmp_dir
+    checkpoint = None
+    if Config.RESUME_JOBS:
+        checkpoint = Checkpoint(os.path.join(work_dir, scratch.RESUME_MANIFEST), job_key)
+        log_line(logs, "Job key %s" % job_id)
+    # Stages a previous attempt finished; they are left out of the estimate and its history
+    resumed = set(checkpoint.data["stages"]) if checkpoint is not None else set()
+
+    # Ladders are a directory of playlists and segments named after the job
+    manifest = LADDER_MANIFESTS.get(params["container"])
+    output_path = os.path.join(work_dir, job_id if manifest else "final.%s" % params["container"])
+    # An uploaded output may be gone from the volume (JobScratch drops it); the upload stands for it
+    encoded = checkpoint is not None and (checkpoint.has_file("encode", output_path) or bool(checkpoint.done("upload")))
+
+    input_path = os.path.join(tmp_dir, "input")
+    # While set, the input is still arriving and ffmpeg reads it through a pipe
+    download = None
+
+    cache = get_input_cache(Config.CACHE_DIR, Config.CACHE_MAX_GB)
+    cache_key = cache.key_for(identity) if cache is not None else None
+    cached = None
+
+    def complete_download():
+        finish_download(download, logs)
+        if checkpoint is not None:
+            checkpoint.mark("download", path=input_path)
+        if cache_key:
+            try:
+                cache.store_input(cache_key, input_path)
+            except Exception as exc:
+                log_line(logs, "Input cache store failed: %s" % exc, "warning")
+
+    if encoded:
+        log_line(logs, "Resuming from checkpoint: encode")
+    elif checkpoint is not None and checkpoint.has_file("download", input_path):
+        log_line(logs, "Resuming from checkpoint: download")
+    else:
+        # One lookup: each one stats the entry and refreshes its mtime
+        cached = cache.lookup(cache_key) if cache_key else None
+        if cached:
+            log_line(logs, "Input cache hit")
+            input_path = link_cached_input(cached["input"], input_path)
+        else:
+            with resource_slot(logs, "download"), timed(logs, "download"):
+                download = start_download(input_url, input_path, head, logs)
+                if not params["stream_input"] or params["segmented"]:
+                    complete_download()
+                    download = None
     enforce_max_job_seconds(start_time, logs)
 
-    # Stage 9/10: upload (S3 via aws-cli if available)
-    output_url = None
-    if Config.S3_ENDPOINT and Config.S3_BUCKET:
-        if boto3 is None:
-            log_line(logs, "boto3 not available for S3 upload")
-            raise PipelineError(ERR_UPLOAD, "Upload failed", logs)
-        key = "%s%s" % (Config.S3_OUTPUT_PREFIX, os.path.basename(output_path))
-        try:
-            session = boto3.session.Session(
-                aws_access_key_id=Config.S3_ACCESS_KEY_ID,
-                aws_secret_access_key=Config.S3_SECRET_ACCESS_KEY,
-                region_name=Config.S3_REGION or None,
-            )
-            s3 = session.client(
-                "s3",
-                endpoint_url=Config.S3_ENDPOINT,
-                use_ssl=bool(Config.S3_USE_SSL),
-            )
-            log_line(logs, "Uploading output to S3")
-            s3.upload_file(output_path, Config.S3_BUCKET, key)
-            output_url = s3.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": Config.S3_BUCKET, "Key": key},
-                ExpiresIn=Config.S3_SIGNED_URL_TTL_SEC,
-            )
-        except Exception as exc:
-            log_line(logs, "S3 upload error: %s" % exc)
-            raise PipelineError(ERR_UPLOAD, "Upload failed", logs)
+    probed = checkpoint.done("probe") if checkpoint is not None else None
+    if probed and probed.get("analysis"):
+        meta = probed["meta"]
+        analysis = probed["analysis"]
+        log_line(logs, "Resuming from checkpoint: probe")
+    elif cached and cached.get("probe") and cached["probe"].get("analysis"):
+        meta = cached["probe"]["meta"]
+        analysis = cached["probe"]["analysis"]
+        log_line(logs, "Probe cache hit")
+        if checkpoint is not None:
+            checkpoint.mark("probe", meta=meta, analysis=analysis)
     else:
-        output_url = "file://" + output_path
+        meta = None
+        if download is not None:
+            download.wait_for(Config.STREAM_INPUT_START_MB * 1024 * 1024)
+            try:
+                meta = ffprobe_metadata(input_path, logs, download)
+                analysis = analyze_input(input_path, meta, logs, download)
+            except PipelineError:
+                # e.g. MP4 with the index at the end; fall back to the complete file
+                log_line(logs, "Probe on partial input failed; waiting for full download", "warning")
+                complete_download()
+                download = None
+                meta = None
+        if meta is None:
+            meta = ffprobe_metadata(input_path, logs)
+            analysis = analyze_input(input_path, meta, logs)
+        if checkpoint is not None:
+            checkpoint.mark("probe", meta=meta, analysis=analysis)
+        if cache_key and download is None:
+            cache.store_probe(cache_key, {"meta": meta, "analysis": analysis})
+    interlaced = analysis["interlaced"]
+    reporter.duration = input_duration(meta) or None
+    enforce_max_job_seconds(start_time, logs)
 
-    elapsed = int(time.time() - start_time)
-    log_line(logs, "Job finished in %ss" % elapsed)
+    filter_chain, applied = build_preprocess_filters(params, analysis, logs)
+    applied_b, applied_g, applied_c = applied
+    plan = plan_stages(meta, params, logs)
+    spec = {
+        "filter_chain": filter_chain,
+        "upscale": plan["upscale"],
+        "model": plan["model"],
+        "scale": plan["scale"],
+        "target_wh": params["target_wh"],
+        "video_args": encoder.video_args(params["crf"], params["preset"]),
+        "encoder": encoder.name,
+        "output_args": [],
+        "streaming": params["streaming"],
+        "dedup": params["dedup"],
+        "ladder": ladder_spec(params, meta, filter_chain, encoder),
+    }
 
-    if Config.CLEANUP_TEMP and not Config.KEEP_INTERMEDIATES:
-        try:
-            shutil.rmtree(tmp_dir, ignore_errors=True)
-        except Exception:
+    uploaded = checkpoint is not None and bool(checkpoint.done("upload"))
+    live_upload = None
+    if params["live_upload"] and storage.s3_enabled() and not encoded and not uploaded:
+        spec["output_args"] = storage.live_output_args(params["container"])
+        live_upload = start_live_upload(job_id, output_path, logs)
+        if live_upload is None:
+            spec["output_args"] = []
+
+    segmented = download is None and params["segmented"] and plan_segment_count(meta) > 1
+    estimate = None
+    shape = None
+    if not encoded:
+        in_job = os.path.dirname(os.path.abspath(input_path)) == os.path.abspath(tmp_dir)
+        input_bytes = int(head.get("content_length") or 0) if in_job else 0
+        shape = job_shape(meta, spec, params, input_bytes, segmented)
+        skip = resumed | (set() if "download" in logs.timings.as_dict() else {"download"})
+        done = [n for n in ("download", "probe", "analyze") if n in logs.timings.as_dict()]
+        can_segment = download is None and not manifest and plan_segment_count(meta) > 1
+        shape, estimate = check_estimate(meta, spec, params, shape, skip, done, can_segment, start_time, logs)
+        if "streaming" in estimate["replanned"]:
+            spec["streaming"] = True
+        segmented = shape["segmented"]
+        need = estimate_job_bytes(meta, [spec], input_bytes, segmented)
+        used = space.used_bytes()
+        log_line(logs, "Scratch estimate %.2f GB (%.2f GB already written)" % (need / float(scheduler.GB), used / float(scheduler.GB)))
+        space.reserve(need, used)
+
+    w, h = params["target_wh"]
+    audio = None
+    if params["keep_audio"] and audio_stream_info(meta):
+        audio = {"path": input_path, "args": audio_codec_args(meta, "mp4" if manifest else params["container"])}
+
+    try:
+        if encoded:
             pass
+        elif download is not None and spec["upscale"]:
+            video_path = os.path.join(tmp_dir, "video_only.%s" % params["container"])
+            extract = AudioExtract(input_path, audio, tmp_dir, logs, download) if audio else None
+            process_video(input_path, video_path, dict(spec, output_args=[]), meta, None, tmp_dir, logs, start_time, None, download)
+            complete_download()
+            mux_audio(video_path, extract.wait() if extract else None, output_path, logs, spec["output_args"])
+        elif download is not None:
+            # Direct encode reads video and audio from the same pipe
+            process_video(input_path, output_path, spec, meta, audio, tmp_dir, logs, start_time, None, download)
+            complete_download()
+        elif segmented:
+            # Segment workers spread over every core (and the GPU when upscaling)
+            with resource_slot(logs, *(("cpu", "gpu") if spec["upscale"] else ("cpu",))):
+                run_segmented_video(input_path, output_path, spec, meta, audio, tmp_dir, logs, start_time, checkpoint)
+        else:
+            process_video(input_path, output_path, spec, meta, audio, tmp_dir, logs, start_time, checkpoint)
+    except Exception:
+        if live_upload is not None:
+            live_upload.abort()
+        raise
+    if checkpoint is not None and not encoded:
+        checkpoint.mark("encode", path=output_path)
+
+    with resource_slot(logs, "upload"):
+        output_url = upload_output(job_id, output_path, logs, uploaded, live_upload, manifest)
+    if checkpoint is not None and not uploaded and not output_url.startswith("file://"):
+        checkpoint.mark("upload")
+    space.uploaded = not output_url.startswith("file://")
+
+    elapsed = int(time.time() - start_time)
+    log_line(logs, "Job finished in %ss" % elapsed)
+    if shape is not None and not resumed:
+        out_bytes = scratch.dir_bytes(output_path) if manifest else os.path.getsize(output_path)
+        estimator.record(shape, logs.timings.as_dict(), out_bytes)
 
     duration_sec = 0
     input_resolution = ""
@@ -459,11 +1950,18 @@ def pipeline(request):
         "input_resolution": input_resolution,
         "output_resolution": "%dx%d" % (w, h),
         "interlace_detected": bool(interlaced),
+        "analysis": analysis,
+        "plan": plan,
+        "encoder": encoder.name,
+        "estimate": estimate,
+        "ladder": ladder_summary(spec["ladder"]),
+        "timings": logs.timings.as_dict(),
+        "dedup": dedup_summary(logs),
         "applied_exposure": {
             "brightness": applied_b,
             "gamma": applied_g,
             "contrast": applied_c,
-            "auto_exposure": bool(auto_exposure),
+            "auto_exposure": bool(params["auto_exposure"]),
         },
     }
 
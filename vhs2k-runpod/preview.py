@@ -0,0 +1,345 @@
+import os
+import time
+
+import capabilities
+import metrics
+import progress
+import scheduler
+import scratch
+import storage
+import threadbudget
+from cache import get_input_cache
+from config import Config
+from pipeline import (
+    ERR_ENCODE, ERR_INPUT_DOWNLOAD, ERR_INTERNAL, ERR_VALIDATION, LADDER_MANIFESTS, PipelineError,
+    admission_failed, analyze_input, apply_profile, audio_codec_args, audio_stream_info,
+    available_cpus, build_preprocess_filters, choose_encoder, dedup_summary, detect_scene_cuts,
+    download_input, enforce_max_job_seconds, estimate_input_size_gb, estimate_job_bytes,
+    ffprobe_metadata, head_input, input_duration, input_identity, job_entry, link_cached_input, log_line,
+    plan_stages, process_video, resolve_params, resource_slot, run_cmd, scratch_estimate_bytes,
+    timed, upload_output, validate_request, video_stream_info, worker_pool,
+)
+
+PREVIEW_SELECT = ("even", "scenes")
+PREVIEW_OUTPUTS = ("clips", "stills", "both")
+# Full-job modes that make no sense for a few seconds of video; previews always run staged
+PREVIEW_IGNORED_FLAGS = ("streaming", "segmented", "stream_input", "live_upload")
+MAX_PREVIEW_SECONDS = 60.0
+# How far from its nominal start a window may move to begin on a scene cut
+SCENE_SEARCH_SEC = 30.0
+
+
+def is_preview_request(request):
+    return bool(request.get("preview"))
+
+
+def preview_options(request, logs):
+    errors = []
+    windows = request.get("preview_windows", Config.PREVIEW_WINDOWS)
+    seconds = request.get("preview_seconds", Config.PREVIEW_SECONDS)
+    offsets = request.get("preview_offsets")
+    select = request.get("preview_select", "even")
+    output = request.get("preview_output", Config.PREVIEW_OUTPUT)
+    if not isinstance(windows, int) or isinstance(windows, bool) or not 1 <= windows <= Config.PREVIEW_MAX_WINDOWS:
+        errors.append("preview_windows must be 1..%d" % Config.PREVIEW_MAX_WINDOWS)
+    try:
+        seconds = float(seconds)
+        if not 0.5 <= seconds <= MAX_PREVIEW_SECONDS:
+            errors.append("preview_seconds must be 0.5..%d" % MAX_PREVIEW_SECONDS)
+    except Exception:
+        errors.append("preview_seconds must be number")
+    if offsets is not None:
+        if (not isinstance(offsets, list) or not offsets or len(offsets) > Config.PREVIEW_MAX_WINDOWS
+                or not all(isinstance(o, (int, float)) and not isinstance(o, bool) and o >= 0 for o in offsets)):
+            errors.append("preview_offsets must be a list of up to %d start times in seconds" % Config.PREVIEW_MAX_WINDOWS)
+    if select not in PREVIEW_SELECT:
+        errors.append("preview_select must be even|scenes")
+    if output not in PREVIEW_OUTPUTS:
+        errors.append("preview_output must be clips|stills|both")
+    if errors:
+        for e in errors:
+            log_line(logs, "Validation error: %s" % e, "warning")
+        raise PipelineError(ERR_VALIDATION, "Invalid request", logs)
+    return {"windows": windows, "seconds": seconds, "offsets": offsets, "select": select, "output": output}
+
+
+def plan_windows(duration, options):
+    # Explicit offsets win; otherwise N windows centred in equal slices of the tape
+    seconds = options["seconds"]
+    latest = max(0.0, duration - seconds) if duration > 0 else None
+    if options["offsets"] is not None:
+        starts = [float(o) if latest is None else min(float(o), latest) for o in options["offsets"]]
+    elif latest is None or duration <= seconds:
+        starts = [0.0]
+    else:
+        count = options["windows"]
+        starts = [min(latest, max(0.0, duration * (i + 0.5) / count - seconds / 2.0)) for i in range(count)]
+    unique = []
+    for start in starts:
+        if round(start, 3) not in [round(s, 3) for s in unique]:
+            unique.append(start)
+    return unique
+
+
+def _snap_to_scene(source, start, seconds, duration, logs):
+    # Nearest cut within SCENE_SEARCH_SEC that still leaves a full window before the end
+    lo = max(0.0, start - SCENE_SEARCH_SEC)
+    try:
+        cuts = detect_scene_cuts(source, Config.PREVIEW_SCENE_THRESHOLD, logs, lo, 2 * SCENE_SEARCH_SEC)
+    except PipelineError:
+        log_line(logs, "Scene detection failed near %.0fs; keeping the fixed offset" % start, "warning")
+        return start
+    if duration > 0:
+        cuts = [c for c in cuts if c + seconds <= duration]
+    if not cuts:
+        return start
+    return min(cuts, key=lambda c: abs(c - start))
+
+
+def _grab_still(src_path, at, target_wh, out_path, logs, stage):
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-ss", "%.3f" % at, "-i", src_path,
+        "-frames:v", "1", "-vf", "scale=%d:%d" % tuple(target_wh), "-q:v", "2", out_path
+    ]
+    run_cmd(cmd, 120, logs, stage, ERR_ENCODE, track=False)
+
+
+def _render_window(args):
+    # Runs in a pool worker: cut the window out of the source, then run the job's own
+    # process_video chain on it. PipelineError does not pickle, so report a plain dict.
+    index, source, start, seconds, duration, spec, meta, audio_args, options, names, window_dir = args
+    logs = progress.JobLog(timings=metrics.JobTimings())
+    result = {"index": index, "ok": False, "code": ERR_INTERNAL, "message": "Internal error", "start": start}
+    try:
+        os.makedirs(window_dir, exist_ok=True)
+        if options["select"] == "scenes" and options["offsets"] is None:
+            start = _snap_to_scene(source, start, seconds, duration, logs)
+            result["start"] = start
+        window_path = os.path.join(window_dir, "window.mkv")
+        cmd = ["ffmpeg", "-y", "-v", "error", "-ss", "%.3f" % start, "-i", source, "-t", "%.3f" % seconds, "-map", "0:v:0"]
+        if audio_args:
+            cmd += ["-map", "0:a:0"]
+        # Stream copy starts at the keyframe before `start` and reads only this window's bytes
+        cmd += ["-c", "copy", window_path]
+        with timed(logs, "extract"):
+            run_cmd(cmd, Config.STAGE_TIMEOUT_DOWNLOAD, logs, "extract", ERR_INPUT_DOWNLOAD)
+        audio = {"path": window_path, "args": audio_args} if audio_args else None
+        window_tmp = os.path.join(window_dir, "tmp")
+        os.makedirs(window_tmp, exist_ok=True)
+        process_video(window_path, names["clip"], spec, meta, audio, window_tmp, logs)
+        if options["output"] != "clips":
+            with timed(logs, "stills"):
+                at = seconds / 2.0
+                _grab_still(window_path, at, spec["target_wh"], names["before"], logs, "still_before")
+                _grab_still(names["clip"], at, spec["target_wh"], names["after"], logs, "still_after")
+        result.update({"ok": True, "code": None, "message": None})
+    except PipelineError as pe:
+        result.update({"code": pe.code, "message": pe.message})
+    except Exception as exc:
+        log_line(logs, "Unhandled error: %s" % exc, "error")
+    result["logs"] = logs.events()
+    result["timings"] = logs.timings.as_dict()
+    result["counters"] = dict(logs.counters)
+    return result
+
+
+def _probe_source(source, cached, cache, cache_key, logs):
+    if cached and cached.get("probe") and cached["probe"].get("analysis"):
+        log_line(logs, "Probe cache hit")
+        return cached["probe"]["meta"], cached["probe"]["analysis"]
+    # The full-tape analysis, so deinterlace and auto exposure match the full render
+    meta = ffprobe_metadata(source, logs)
+    analysis = analyze_input(source, meta, logs)
+    if cache_key:
+        cache.store_probe(cache_key, {"meta": meta, "analysis": analysis})
+    return meta, analysis
+
+
+@job_entry
+def run_preview(request, logs):
+    start_time = time.time()
+    log_line(logs, "Preview started")
+    log_line(logs, "Worker: %s" % capabilities.get().summary())
+
+    request = apply_profile(request)
+    validate_request(request, logs)
+    options = preview_options(request, logs)
+    params = resolve_params(request, logs)
+    ignored = [f for f in PREVIEW_IGNORED_FLAGS if params[f]]
+    if ignored:
+        log_line(logs, "Preview ignores %s" % ", ".join(ignored))
+        params.update((f, False) for f in ignored)
+    if params["container"] in LADDER_MANIFESTS:
+        # Windows are single files to look at; the ladder's renditions would all look alike
+        log_line(logs, "Preview renders mp4 clips instead of %s" % params["container"])
+        params["container"] = "mp4"
+    encoder = choose_encoder(params, logs)
+
+    input_url = request.get("input_url")
+    head = head_input(input_url, logs)
+    size_gb = estimate_input_size_gb(input_url, logs, head)
+    if size_gb is not None and size_gb > Config.MAX_INPUT_GB:
+        log_line(logs, "Input too large: %.2f GB" % size_gb)
+        raise PipelineError(ERR_VALIDATION, "Input too large", logs)
+
+    preview_id = scratch.new_job_id("preview-")
+    try:
+        with scratch.job_space(preview_id) as space:
+            return _run_preview(request, params, options, encoder, head, size_gb, preview_id, space, logs, start_time)
+    except scheduler.AdmissionError as exc:
+        raise admission_failed(exc, logs)
+
+
+def _run_preview(request, params, options, encoder, head, size_gb, preview_id, space, logs, start_time):
+    input_url = request.get("input_url")
+    tmp_dir = space.tmp_dir
+    cache = get_input_cache(Config.CACHE_DIR, Config.CACHE_MAX_GB)
+    cache_key = cache.key_for(input_identity(input_url, head)) if cache is not None else None
+    cached = cache.lookup(cache_key) if cache_key else None
+    source = meta = analysis = None
+    if cached:
+        log_line(logs, "Input cache hit")
+        source = link_cached_input(cached["input"], os.path.join(tmp_dir, "input"))
+    elif head.get("accept_ranges"):
+        # ffmpeg seeks over HTTP ranges, so only the windows and analysis samples are fetched
+        try:
+            meta, analysis = _probe_source(input_url, None, cache, cache_key, logs)
+            source = input_url
+            log_line(logs, "Reading preview windows from the input URL")
+        except PipelineError:
+            log_line(logs, "Remote probe failed; downloading the input", "warning")
+    coverage = 1.0
+    if meta is not None and input_duration(meta) > 0:
+        spans = len(options["offsets"] or []) or options["windows"]
+        coverage = min(1.0, spans * options["seconds"] / input_duration(meta))
+    with space.admit(scratch_estimate_bytes(size_gb * coverage if size_gb else None)):
+        if source is None:
+            source = os.path.join(tmp_dir, "input")
+            with resource_slot(logs, "download"):
+                download_input(input_url, source, logs, head)
+            if cache_key:
+                try:
+                    cache.store_input(cache_key, source)
+                except Exception as exc:
+                    log_line(logs, "Input cache store failed: %s" % exc, "warning")
+        if meta is None:
+            meta, analysis = _probe_source(source, cached, cache, cache_key, logs)
+        enforce_max_job_seconds(start_time, logs)
+        return _render_preview(request, params, options, encoder, source, meta, analysis, preview_id, space, logs, start_time)
+
+
+def _render_preview(request, params, options, encoder, source, meta, analysis, preview_id, space, logs, start_time):
+    work_dir, tmp_dir = space.work_dir, space.tmp_dir
+    filter_chain, applied = build_preprocess_filters(params, analysis, logs)
+    plan = plan_stages(meta, params, logs)
+    spec = {
+        "filter_chain": filter_chain,
+        "upscale": plan["upscale"],
+        "model": plan["model"],
+        "scale": plan["scale"],
+        "target_wh": params["target_wh"],
+        "video_args": encoder.video_args(params["crf"], params["preset"]),
+        "encoder": encoder.name,
+        "output_args": [],
+        "streaming": False,
+        "dedup": params["dedup"],
+    }
+    duration = input_duration(meta)
+    audio_args = None
+    if params["keep_audio"] and options["output"] != "stills" and audio_stream_info(meta):
+        audio_args = audio_codec_args(meta, params["container"])
+
+    starts = plan_windows(duration, options)
+    # Each window is copied out of the source before it is rendered
+    seconds = len(starts) * options["seconds"]
+    source_bytes = os.path.getsize(source) if os.path.isfile(source) else 0
+    window_bytes = int(source_bytes * seconds / duration) if duration > 0 else 0
+    space.reserve(estimate_job_bytes(meta, [spec], source_bytes + window_bytes, seconds=seconds))
+    workers = Config.PREVIEW_WORKERS if Config.PREVIEW_WORKERS > 0 else available_cpus()
+    workers = max(1, min(workers, len(starts)))
+    spec["cpus"] = max(1, threadbudget.job_cpus() // workers)
+    jobs = []
+    for i, start in enumerate(starts):
+        base = os.path.join(work_dir, "%s-w%d" % (preview_id, i))
+        names = {"clip": "%s.%s" % (base, params["container"]), "before": base + "-before.jpg", "after": base + "-after.jpg"}
+        window_dir = os.path.join(tmp_dir, "window_%02d" % i)
+        jobs.append((i, source, start, options["seconds"], duration, spec, meta, audio_args, options, names, window_dir))
+
+    log_line(logs, "Rendering %d preview window(s) of %.1fs with %d workers" % (len(jobs), options["seconds"], workers))
+    tracker = logs.reporter.stage("preview_windows")
+    results = [None] * len(jobs)
+    done = 0
+    # Like segmented mode: the windows share this job's cpu (and gpu) slot between them
+    with resource_slot(logs, *(("cpu", "gpu") if spec["upscale"] else ("cpu",))), timed(logs, "windows"), \
+            worker_pool(workers, spec, logs) as pool:
+        for result in pool.map(_render_window, jobs):
+            results[result["index"]] = result
+            logs.merge(result["logs"], "window_")
+            # Worker stage times add up across parallel windows (process-seconds)
+            logs.timings.merge(result["timings"], "window_")
+            logs.counters.update(result["counters"])
+            done += 1
+            tracker.update(done=done, total=len(jobs), final=done == len(jobs))
+    enforce_max_job_seconds(start_time, logs)
+
+    previews = []
+    for job, result in zip(jobs, results):
+        names = job[9]
+        entry = {"index": result["index"], "start_sec": round(result["start"], 3), "duration_sec": options["seconds"]}
+        if result["ok"]:
+            try:
+                with resource_slot(logs, "upload"):
+                    if options["output"] != "stills":
+                        entry["clip_url"] = upload_output(preview_id, names["clip"], logs)
+                    if options["output"] != "clips":
+                        entry["before_url"] = upload_output(preview_id, names["before"], logs)
+                        entry["after_url"] = upload_output(preview_id, names["after"], logs)
+                entry["status"] = "completed"
+            except PipelineError as pe:
+                result.update({"ok": False, "code": pe.code, "message": pe.message})
+        if not result["ok"]:
+            log_line(logs, "Preview window %d failed: %s" % (result["index"], result["message"]), "warning")
+            entry.update(status="failed", error_code=result["code"], error_message=result["message"])
+        previews.append(entry)
+    space.uploaded = storage.s3_enabled()
+
+    completed = sum(1 for p in previews if p["status"] == "completed")
+    if not completed:
+        failed = results[0]
+        raise PipelineError(failed["code"] or ERR_INTERNAL, failed["message"] or "Preview failed", logs)
+    log_line(logs, "Preview finished in %ss: %d/%d windows" % (int(time.time() - start_time), completed, len(previews)))
+
+    video = video_stream_info(meta)
+    w, h = params["target_wh"]
+    applied_b, applied_g, applied_c = applied
+    return {
+        "status": "completed" if completed == len(previews) else "partial",
+        "previews": previews,
+        "metadata": {
+            "duration_sec": duration,
+            "input_resolution": "%dx%d" % (video["width"], video["height"]) if video.get("width") else "",
+            "output_resolution": "%dx%d" % (w, h),
+            "interlace_detected": bool(analysis["interlaced"]),
+            "analysis": analysis,
+            "plan": plan,
+            "encoder": encoder.name,
+            "preview": {
+                "preview_id": preview_id,
+                "windows": len(previews),
+                "completed": completed,
+                "seconds": options["seconds"],
+                "select": "offsets" if options["offsets"] is not None else options["select"],
+                "output": options["output"],
+                "source": "url" if source == request.get("input_url") else "local",
+            },
+            "timings": logs.timings.as_dict(),
+            "dedup": dedup_summary(logs),
+            "applied_exposure": {
+                "brightness": applied_b,
+                "gamma": applied_g,
+                "contrast": applied_c,
+                "auto_exposure": bool(params["auto_exposure"]),
+            },
+        },
+        "logs": logs,
+    }
@@ -0,0 +1,241 @@
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import runpod
+except Exception:
+    runpod = None
+
+from config import Config
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+class TailBuffer(object):
+    # Keeps the last `limit` bytes written; long ffmpeg runs no longer hold all of stderr
+    def __init__(self, limit):
+        self.limit = max(1024, limit)
+        self._chunks = collections.deque()
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size - len(self._chunks[0]) >= self.limit:
+            self._size -= len(self._chunks.popleft())
+
+    def getvalue(self):
+        return b"".join(self._chunks)[-self.limit:]
+
+
+def level_number(name):
+    return LEVELS.get((name or "").lower(), LEVELS["info"])
+
+
+class JobLog(object):
+    # The per-job event log, carrying the job's progress reporter, stage timings and event
+    # counters (e.g. frames skipped by dedup) to every stage that logs. Events at or above
+    # LOG_LEVEL are kept in a ring buffer per stage, so the response stays small however
+    # long the job runs; with a spill dir, every one of them also goes to a JSON-lines file.
+    def __init__(self, reporter=None, timings=None, spill_dir=None):
+        self.reporter = reporter
+        self.timings = timings
+        self.counters = collections.Counter()
+        self.level = level_number(Config.LOG_LEVEL)
+        self.dropped = 0
+        self.spill_path = None
+        # Set once the spill has been published (pipeline.job_entry)
+        self.log_url = None
+        self._stages = collections.OrderedDict()
+        self._spill = None
+        self._lock = threading.Lock()
+        if spill_dir:
+            try:
+                os.makedirs(spill_dir, exist_ok=True)
+                path = os.path.join(spill_dir, "%d-%s.jsonl" % (int(time.time()), uuid.uuid4().hex[:8]))
+                # Line-buffered, so the file is complete up to a crash
+                self._spill = open(path, "a", buffering=1)
+                self.spill_path = path
+            except OSError:
+                self._spill = None
+
+    def current_stage(self):
+        # Events are tagged with the innermost timings stage open on the logging thread
+        rec = self.timings.current() if self.timings is not None else None
+        return rec.name if rec is not None else "job"
+
+    def event(self, level, message, stage=None, detail=None, t=None):
+        if level_number(level) < self.level:
+            return
+        event = {
+            "t": round(time.time() if t is None else t, 3),
+            "level": level,
+            "stage": stage or self.current_stage(),
+            "msg": message,
+        }
+        with self._lock:
+            if self._spill is not None:
+                try:
+                    self._spill.write(json.dumps(dict(event, detail=detail) if detail else event) + "\n")
+                except (OSError, ValueError):
+                    pass
+            if detail:
+                # The spill keeps all of e.g. an ffmpeg stderr tail; the buffer only its end
+                event["detail"] = detail[-max(0, Config.LOG_DETAIL_CHARS):]
+            ring = self._stages.get(event["stage"])
+            if ring is None:
+                ring = self._stages[event["stage"]] = collections.deque(maxlen=max(1, Config.LOG_STAGE_EVENTS))
+            if len(ring) == ring.maxlen:
+                self.dropped += 1
+            ring.append(event)
+
+    def events(self):
+        with self._lock:
+            kept = [event for ring in self._stages.values() for event in ring]
+        return sorted(kept, key=lambda event: event["t"])
+
+    def merge(self, events, prefix=""):
+        # Folds events from another process (segment workers, preview windows) into this job
+        for event in events or ():
+            self.event(event["level"], event["msg"], prefix + event["stage"], event.get("detail"), event["t"])
+
+    def close(self):
+        # Ends the spill; returns its path, if any
+        with self._lock:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+        return self.spill_path
+
+
+class ProgressReporter(object):
+    # Collects per-stage progress and pushes throttled snapshots to a sink callable
+    def __init__(self, sink=None, interval=10.0):
+        self.sink = sink
+        self.interval = interval
+        self.duration = None
+        self.stages = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._last_publish = 0.0
+
+    def stage(self, name, duration=None):
+        tracker = StageProgress(self, name, duration)
+        with self._lock:
+            self.stages[name] = tracker
+        return tracker
+
+    def publish(self, payload, force=False):
+        if self.sink is None:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_publish < self.interval:
+                return
+            self._last_publish = now
+        try:
+            self.sink(payload)
+        except Exception:
+            # Progress is best effort; never fail a job over it
+            pass
+
+
+class StageProgress(object):
+    # Tracks one stage from ffmpeg `-progress` key=value blocks or from explicit frame counts
+    def __init__(self, reporter, stage, duration=None):
+        self.reporter = reporter
+        self.stage = stage
+        self.duration = duration
+        self.started = time.time()
+        self.frames = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.out_time = 0.0
+        self.done = 0
+        self.total = None
+
+    def consume(self, stream):
+        block = {}
+        for raw in iter(stream.readline, b""):
+            key, sep, value = raw.decode("utf-8", errors="ignore").strip().partition("=")
+            if not sep:
+                continue
+            block[key] = value
+            if key == "progress":
+                self._apply(block)
+                block = {}
+        stream.close()
+
+    def _apply(self, block):
+        frames = _to_float(block.get("frame"))
+        # out_time_ms is microseconds despite its name; prefer out_time_us where present
+        out_us = _to_float(block.get("out_time_us")) or _to_float(block.get("out_time_ms"))
+        self.update(
+            frames=int(frames) if frames is not None else None,
+            out_time=out_us / 1e6 if out_us is not None else None,
+            fps=_to_float(block.get("fps")),
+            speed=_to_float((block.get("speed") or "").rstrip("x")),
+            final=block.get("progress") == "end",
+        )
+
+    def update(self, frames=None, out_time=None, fps=None, speed=None, final=False, done=None, total=None):
+        elapsed = max(1e-6, time.time() - self.started)
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if frames is not None:
+            self.frames = frames
+            self.fps = fps if fps else frames / elapsed
+        if out_time is not None and out_time >= 0:
+            self.out_time = out_time
+            self.speed = speed if speed else out_time / elapsed
+        self.reporter.publish(self.snapshot(), force=final)
+
+    def snapshot(self):
+        duration = self.duration or self.reporter.duration
+        payload = {
+            "stage": self.stage,
+            "frames": self.frames,
+            "fps": round(self.fps, 2),
+            "speed": round(self.speed, 3),
+            "elapsed_sec": round(time.time() - self.started, 1),
+        }
+        if self.total:
+            # Unit-counted stages (e.g. segments) report completed units instead of media time
+            elapsed = time.time() - self.started
+            payload["done"] = self.done
+            payload["total"] = self.total
+            payload["percent"] = round(100.0 * self.done / self.total, 1)
+            if self.done:
+                payload["eta_sec"] = int(elapsed * (self.total - self.done) / self.done)
+        elif duration and self.out_time:
+            payload["percent"] = round(min(100.0, 100.0 * self.out_time / duration), 1)
+            if self.speed > 0:
+                payload["eta_sec"] = int(max(0.0, duration - self.out_time) / self.speed)
+        return payload
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def runpod_sink(job):
+    # RunPod shows the latest progress_update payload on the job status endpoint
+    if runpod is None or not isinstance(job, dict) or not job.get("id"):
+        return None
+
+    def sink(payload):
+        runpod.serverless.progress_update(job, payload)
+    return sink
+
+
+def format_progress(payload):
+    parts = ["%s=%s" % (k, payload[k]) for k in ("frames", "fps", "speed", "done", "total", "percent", "eta_sec") if k in payload]
+    return "Progress %s: %s" % (payload["stage"], " ".join(parts))
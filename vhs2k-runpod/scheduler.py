@@ -0,0 +1,259 @@
+import collections
+import contextlib
+import math
+import os
+import shutil
+import threading
+import time
+
+from config import Config
+
+GB = 1024 ** 3
+
+# Slots are always taken in this order, so two jobs holding different pools cannot deadlock
+POOL_ORDER = ("download", "cpu", "gpu", "upload")
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class DiskSpaceError(AdmissionError):
+    # The job's scratch estimate does not fit on this worker's volume
+    pass
+
+
+def cgroup_cpu_quota():
+    # CPUs the container may use per period (cgroup v2, then v1); None when unlimited
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / float(period)
+    except Exception:
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read().strip())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read().strip())
+        return None if quota <= 0 else quota / float(period)
+    except Exception:
+        return None
+
+
+def available_cores():
+    # Affinity shows every host core on many pods; the cgroup quota is what we are actually granted
+    try:
+        cores = max(1, len(os.sched_getaffinity(0)))
+    except Exception:
+        cores = max(1, os.cpu_count() or 1)
+    quota = cgroup_cpu_quota()
+    if quota:
+        cores = min(cores, max(1, int(math.ceil(quota))))
+    return cores
+
+
+class ResourcePool(object):
+    # Counting semaphore that hands out slots in arrival order; a waiting encode is not
+    # overtaken by later jobs just because it lost a wake-up race
+    def __init__(self, name, size):
+        self.name = name
+        self.size = max(1, size)
+        self.in_use = 0
+        self._waiters = collections.deque()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            while self._waiters[0] is not ticket or self.in_use >= self.size:
+                self._cond.wait()
+            self._waiters.popleft()
+            self.in_use += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {"size": self.size, "in_use": self.in_use, "waiting": len(self._waiters)}
+
+
+class Admission(object):
+    # Handle on one admitted job: seconds it waited and its resizable disk reservation
+    def __init__(self, scheduler, ticket, waited):
+        self.scheduler = scheduler
+        self.ticket = ticket
+        self.waited = waited
+
+    def resize(self, need_bytes):
+        self.scheduler.resize(self.ticket, need_bytes)
+
+
+class Scheduler(object):
+    # Per-worker scheduler for concurrent jobs. Each job holds an admission (cores and a
+    # disk reservation) for its lifetime, and a pool slot only while a stage runs, so one
+    # job's CPU encode can overlap another's GPU upscale and a third's download or upload.
+    def __init__(self, pool_sizes, roots, max_jobs, cores_per_job, min_free_bytes, admission_timeout):
+        self.pools = dict((name, ResourcePool(name, pool_sizes.get(name, 1))) for name in POOL_ORDER)
+        self.roots = list(roots)
+        self.max_jobs = max(1, max_jobs)
+        self.cores_per_job = max(1, cores_per_job)
+        self.min_free_bytes = max(0, min_free_bytes)
+        self.admission_timeout = admission_timeout
+        self.active = {}
+        self._cond = threading.Condition()
+
+    def job_limit(self):
+        return max(1, min(self.max_jobs, available_cores() // self.cores_per_job))
+
+    def free_bytes(self):
+        # Smallest free space across the job roots; they usually share one volume
+        free = None
+        for root in self.roots:
+            probe = root
+            while probe and not os.path.exists(probe):
+                probe = os.path.dirname(probe)
+            try:
+                value = shutil.disk_usage(probe or "/").free
+            except OSError:
+                continue
+            free = value if free is None else min(free, value)
+        return free
+
+    def headroom_bytes(self):
+        # Free space not yet promised to running jobs. Reservations are not reduced as jobs
+        # write, so this errs towards refusing work rather than filling the disk.
+        free = self.free_bytes()
+        if free is None:
+            return None
+        with self._cond:
+            reserved = sum(self.active.values())
+        return free - reserved - self.min_free_bytes
+
+    def target_concurrency(self):
+        # RunPod concurrency_modifier: how many jobs this worker should hold right now
+        with self._cond:
+            active = len(self.active)
+        headroom = self.headroom_bytes()
+        if headroom is not None and headroom <= 0:
+            return max(1, active)
+        return self.job_limit()
+
+    def _fits(self, need_bytes):
+        if len(self.active) >= self.job_limit():
+            return False
+        free = self.free_bytes()
+        if free is None:
+            return True
+        return free - sum(self.active.values()) - self.min_free_bytes >= need_bytes
+
+    @contextlib.contextmanager
+    def admit(self, need_bytes):
+        # Waits until the job fits by job count and disk headroom, and holds the reservation
+        # until the job ends. A job that cannot fit even on an idle worker is refused at once.
+        started = time.time()
+        with self._cond:
+            while not self._fits(need_bytes):
+                free = self.free_bytes()
+                if not self.active and free is not None and free - self.min_free_bytes < need_bytes:
+                    raise DiskSpaceError("job needs %.2f GB scratch, %.2f GB free" % (
+                        need_bytes / float(GB), max(0, free - self.min_free_bytes) / float(GB)))
+                remaining = self.admission_timeout - (time.time() - started)
+                if remaining <= 0:
+                    raise AdmissionError("no capacity after %ds (%d jobs running)" % (self.admission_timeout, len(self.active)))
+                # Disk space frees up without a notify (other processes, cache eviction), so poll
+                self._cond.wait(min(remaining, 5.0))
+            ticket = object()
+            self.active[ticket] = need_bytes
+        try:
+            yield Admission(self, ticket, time.time() - started)
+        finally:
+            with self._cond:
+                self.active.pop(ticket, None)
+                self._cond.notify_all()
+
+    def resize(self, ticket, need_bytes):
+        # Trues up a running job's reservation once its real needs are known. Growing waits
+        # (up to the admission timeout) only while other jobs' reservations are in the way;
+        # a job the volume cannot hold even then fails at once.
+        started = time.time()
+        with self._cond:
+            while need_bytes > self.active.get(ticket, 0):
+                free = self.free_bytes()
+                if free is None:
+                    break
+                others = sum(v for t, v in self.active.items() if t is not ticket)
+                if free - others - self.min_free_bytes >= need_bytes:
+                    break
+                if not others or free - self.min_free_bytes < need_bytes:
+                    raise DiskSpaceError("job needs %.2f GB more scratch, %.2f GB free" % (
+                        need_bytes / float(GB), max(0, free - self.min_free_bytes) / float(GB)))
+                remaining = self.admission_timeout - (time.time() - started)
+                if remaining <= 0:
+                    raise DiskSpaceError("no room for %.2f GB scratch after %ds" % (need_bytes / float(GB), self.admission_timeout))
+                self._cond.wait(min(remaining, 5.0))
+            self.active[ticket] = need_bytes
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, *names):
+        # Holds one slot in each named pool for the duration of a stage; yields seconds waited
+        started = time.time()
+        acquired = []
+        try:
+            for name in sorted(set(names), key=POOL_ORDER.index):
+                self.pools[name].acquire()
+                acquired.append(self.pools[name])
+            yield time.time() - started
+        finally:
+            for pool in reversed(acquired):
+                pool.release()
+
+    def snapshot(self):
+        with self._cond:
+            jobs = len(self.active)
+        return {
+            "jobs": jobs,
+            "job_limit": self.job_limit(),
+            "pools": dict((name, pool.snapshot()) for name, pool in self.pools.items()),
+        }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                pool_sizes={
+                    "download": Config.DOWNLOAD_SLOTS,
+                    "cpu": Config.CPU_SLOTS,
+                    "gpu": Config.GPU_SLOTS,
+                    "upload": Config.UPLOAD_SLOTS,
+                },
+                roots=[Config.WORK_DIR, Config.TMP_DIR],
+                max_jobs=Config.MAX_CONCURRENT_JOBS,
+                cores_per_job=Config.CORES_PER_JOB,
+                min_free_bytes=int(Config.MIN_FREE_DISK_GB * GB),
+                admission_timeout=Config.ADMISSION_TIMEOUT_SEC,
+            )
+        return _scheduler
+
+
+def _reset_after_fork():
+    # Segment workers never schedule; drop any lock state inherited mid-acquire
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,250 @@
+import contextlib
+import fcntl
+import os
+import shutil
+import socket
+import time
+import uuid
+
+import scheduler
+import storage
+from config import Config
+
+LOCK_NAME = ".scratch.lock"
+# A resumable job's stage record in its work dir (pipeline.Checkpoint)
+RESUME_MANIFEST = "manifest.json"
+# Bits per pixel assumed when sizing files that do not exist yet. The staged intermediate is
+# near-lossless x264 of noisy tape; the upscaled one is smoother, deliveries are CRF encodes.
+INTERMEDIATE_BPP = 0.5
+UPSCALED_BPP = 0.25
+OUTPUT_BPP = 0.15
+# Estimates are rough; reserve a quarter more than they say
+SAFETY_MARGIN = 1.25
+
+
+def new_job_id(prefix=""):
+    # Concurrent jobs can start in the same second
+    return "%s%d-%s" % (prefix, int(time.time()), uuid.uuid4().hex[:8])
+
+
+def video_bytes(wh, fps, seconds, bpp):
+    return int(wh[0] * wh[1] * fps * seconds * bpp / 8.0)
+
+
+def dir_bytes(path):
+    # Allocated size, so a preallocated or sparse download counts only what it holds
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def _newest_mtime(path):
+    newest = 0.0
+    for root, dirs, files in os.walk(path):
+        for name in [root] + [os.path.join(root, f) for f in files]:
+            try:
+                newest = max(newest, os.lstat(name).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+def _is_empty(path):
+    try:
+        return set(os.listdir(path)) <= {LOCK_NAME}
+    except OSError:
+        return True
+
+
+def _lock_dir(path, resumable):
+    # Held for the job's lifetime; the owner line lets a sweep on this host tell a dead
+    # job's leftovers from a resumable job kept for its retry
+    lock = open(os.path.join(path, LOCK_NAME), "a+")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    lock.seek(0)
+    lock.truncate()
+    lock.write("%s %d %s\n" % (socket.gethostname(), os.getpid(), "resumable" if resumable else "scratch"))
+    lock.flush()
+    return lock
+
+
+class JobScratch(object):
+    # A job's work dir (outputs, resume manifest) and tmp dir (input, intermediates), its
+    # disk reservation, and the cleanup when it ends. Failed jobs lose both dirs unless they
+    # can resume; a resumable job keeps them for the retry until the sweep finds them stale.
+    # Once the job has set `uploaded` (its outputs are in S3), a successful job drops its
+    # work dir too, down to the resume manifest when it can resume.
+    def __init__(self, job_id, resumable=False):
+        self.job_id = job_id
+        self.resumable = resumable
+        self.work_dir = os.path.join(Config.WORK_DIR, job_id)
+        self.tmp_dir = os.path.join(Config.TMP_DIR, job_id)
+        self.admission = None
+        self.uploaded = False
+        self._locks = []
+
+    def open(self):
+        for path in (self.work_dir, self.tmp_dir):
+            os.makedirs(path, exist_ok=True)
+            self._locks.append(_lock_dir(path, self.resumable))
+
+    def close(self, ok):
+        if Config.CLEANUP_TEMP and not Config.KEEP_INTERMEDIATES:
+            # A resumable job that failed before writing anything has nothing to resume
+            keep = self.resumable and not ok and not all(_is_empty(p) for p in (self.work_dir, self.tmp_dir))
+            if not keep:
+                shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            if not ok and not keep or ok and self.uploaded and not self.resumable:
+                shutil.rmtree(self.work_dir, ignore_errors=True)
+            elif ok and self.uploaded:
+                _remove_entries(self.work_dir, keep=(RESUME_MANIFEST, LOCK_NAME))
+        for lock in self._locks:
+            lock.close()
+        self._locks = []
+
+    @contextlib.contextmanager
+    def admit(self, need_bytes):
+        # Scheduler admission with a first, size-based reservation; yields seconds waited
+        with scheduler.get().admit(need_bytes) as admission:
+            self.admission = admission
+            try:
+                yield admission.waited
+            finally:
+                self.admission = None
+
+    def used_bytes(self):
+        return dir_bytes(self.work_dir) + dir_bytes(self.tmp_dir)
+
+    def reserve(self, need_bytes, used_bytes=None):
+        # Preflight: resize the reservation to what the job will still write. Raises
+        # scheduler.DiskSpaceError before any stage starts when it cannot fit.
+        used = self.used_bytes() if used_bytes is None else used_bytes
+        remaining = max(0, int(need_bytes) - used)
+        if self.admission is not None:
+            self.admission.resize(remaining)
+        return remaining
+
+
+def _remove_entries(path, keep=()):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    for name in names:
+        if name in keep:
+            continue
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+
+
+@contextlib.contextmanager
+def job_space(job_id, resumable=False):
+    space = JobScratch(job_id, resumable)
+    space.open()
+    ok = False
+    try:
+        yield space
+        ok = True
+    finally:
+        space.close(ok)
+
+
+def _is_stale(path, host, now):
+    # Locked dirs belong to a running job. Unlocked ones left by a non-resumable job on this
+    # host are dead at once; anything else (resumable, other hosts on a shared volume,
+    # upscaler batch dirs) only once untouched for SCRATCH_STALE_HOURS.
+    lock_path = os.path.join(path, LOCK_NAME)
+    lock = None
+    try:
+        if os.path.exists(lock_path):
+            lock = open(lock_path, "r")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False, None
+            owner = (lock.read().split() + ["", "", ""])[:3]
+            if owner[0] == host and owner[2] == "scratch":
+                return True, lock
+        if Config.SCRATCH_STALE_HOURS > 0 and now - _newest_mtime(path) > Config.SCRATCH_STALE_HOURS * 3600:
+            return True, lock
+    except OSError:
+        pass
+    if lock is not None:
+        lock.close()
+    return False, None
+
+
+def prune_logs():
+    # Full job logs that were not uploaded stay in LOG_DIR; drop the expired ones, then the
+    # oldest until the directory fits LOG_DIR_MAX_MB. Returns (files removed, bytes freed).
+    if not Config.LOG_DIR:
+        return 0, 0
+    entries = []
+    try:
+        for name in os.listdir(Config.LOG_DIR):
+            path = os.path.join(Config.LOG_DIR, name)
+            if name.endswith(".jsonl") and os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+    except OSError:
+        return 0, 0
+    entries.sort()
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    limit = Config.LOG_DIR_MAX_MB * 1024 * 1024
+    removed = freed = 0
+    for mtime, size, path in entries:
+        expired = Config.LOG_RETENTION_HOURS > 0 and now - mtime > Config.LOG_RETENTION_HOURS * 3600
+        if not expired and not (limit > 0 and total > limit):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+def sweep_stale():
+    # Worker startup: remove job dirs that crashed or killed workers left behind, and prune
+    # LOG_DIR. Work dirs hold file:// outputs without S3, so they are only swept when
+    # outputs go to S3.
+    roots = [Config.TMP_DIR] + ([Config.WORK_DIR] if storage.s3_enabled() else [])
+    keep = set(os.path.abspath(p) for p in (Config.CACHE_DIR, Config.WORK_DIR, Config.TMP_DIR, Config.LOG_DIR) if p)
+    host = socket.gethostname()
+    now = time.time()
+    removed = freed = 0
+    for root in roots:
+        try:
+            names = os.listdir(root)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            if not os.path.isdir(path) or os.path.islink(path) or os.path.abspath(path) in keep:
+                continue
+            stale, lock = _is_stale(path, host, now)
+            if not stale:
+                continue
+            size = dir_bytes(path)
+            shutil.rmtree(path, ignore_errors=True)
+            if lock is not None:
+                lock.close()
+            if not os.path.exists(path):
+                removed += 1
+                freed += size
+    prune_logs()
+    return removed, freed
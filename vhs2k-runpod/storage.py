@@ -0,0 +1,250 @@
+import concurrent.futures
+import os
+import threading
+import time
+
+from config import Config
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager
+    from botocore.config import Config as BotoConfig
+except Exception:
+    boto3 = None
+
+MIN_PART_BYTES = 5 * 1024 * 1024  # S3 floor for every multipart part except the last
+POLL_SECONDS = 0.5
+
+
+class UploadError(Exception):
+    pass
+
+
+def s3_enabled():
+    return bool(Config.S3_ENDPOINT and Config.S3_BUCKET)
+
+
+def part_bytes():
+    return max(MIN_PART_BYTES, Config.S3_PART_MB * 1024 * 1024)
+
+
+def object_key(job_id, path):
+    # Outputs share file names across jobs (final.mp4), so each job gets its own key prefix
+    return "%s%s/%s" % (Config.S3_OUTPUT_PREFIX, job_id, os.path.basename(path))
+
+
+def tree_keys(job_id, root):
+    # (path, key) for every file under an output directory, keyed by its path below the job's
+    # prefix so relative references between the files (playlists to segments) still resolve
+    uploads = []
+    for dirpath, dirs, files in os.walk(root):
+        for name in sorted(files):
+            path = os.path.join(dirpath, name)
+            uploads.append((path, "%s%s/%s" % (Config.S3_OUTPUT_PREFIX, job_id, os.path.relpath(path, root).replace(os.sep, "/"))))
+    return uploads
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    # One client per worker process: botocore clients are thread-safe and keep their
+    # connection pool, so jobs stop paying session setup and TLS handshakes each time
+    global _client
+    if boto3 is None:
+        raise UploadError("boto3 not available")
+    with _client_lock:
+        if _client is None:
+            session = boto3.session.Session(
+                aws_access_key_id=Config.S3_ACCESS_KEY_ID,
+                aws_secret_access_key=Config.S3_SECRET_ACCESS_KEY,
+                region_name=Config.S3_REGION or None,
+            )
+            _client = session.client(
+                "s3",
+                endpoint_url=Config.S3_ENDPOINT,
+                use_ssl=bool(Config.S3_USE_SSL),
+                config=BotoConfig(
+                    max_pool_connections=max(10, Config.S3_MAX_CONCURRENCY * 2),
+                    connect_timeout=30,
+                    read_timeout=max(60, min(300, Config.STAGE_TIMEOUT_UPLOAD)),
+                    retries={"max_attempts": 5, "mode": "standard"},
+                ),
+            )
+        return _client
+
+
+def _reset_after_fork():
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def transfer_config():
+    return TransferConfig(
+        multipart_threshold=part_bytes(),
+        multipart_chunksize=part_bytes(),
+        max_concurrency=max(1, Config.S3_MAX_CONCURRENCY),
+        use_threads=True,
+    )
+
+
+def upload_file(path, key, timeout):
+    upload_files([(path, key)], timeout)
+
+
+def upload_files(uploads, timeout):
+    # Multipart uploads through one transfer manager, so many small files (a segment ladder)
+    # share S3_MAX_CONCURRENCY requests; the whole set is bounded by the timeout and a
+    # timed-out transfer is cancelled
+    manager = create_transfer_manager(get_s3_client(), transfer_config())
+    cancelled = False
+    try:
+        futures = [manager.upload(path, Config.S3_BUCKET, key) for path, key in uploads]
+        deadline = time.time() + timeout
+        while not all(future.done() for future in futures):
+            if time.time() > deadline:
+                for future in futures:
+                    future.cancel()
+                cancelled = True
+                raise UploadError("upload timed out after %ds" % timeout)
+            time.sleep(POLL_SECONDS)
+        for future in futures:
+            future.result()
+    finally:
+        manager.shutdown(cancel=cancelled)
+
+
+def presigned_url(key):
+    return get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={"Bucket": Config.S3_BUCKET, "Key": key},
+        ExpiresIn=Config.S3_SIGNED_URL_TTL_SEC,
+    )
+
+
+def live_output_args(container):
+    # Make the muxer write strictly sequentially so bytes already uploaded never change:
+    # fragmented MP4 needs no moov rewrite, and a non-seekable file stops MKV seeking back for cues
+    args = ["-seekable", "0"]
+    if container == "mp4":
+        args = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"] + args
+    return args
+
+
+class GrowingUpload(object):
+    # Multipart upload of an output that is still being written. Full parts go up as soon
+    # as they exist on disk; the tail is sent once the writer calls finish(). If the file
+    # shrinks or is replaced (a stage retry rewrites it), the upload starts over.
+    def __init__(self, path, key, timeout):
+        self.path = path
+        self.key = key
+        self.timeout = timeout
+        self.part_bytes = part_bytes()
+        self.uploaded_bytes = 0
+        self._writer_done = threading.Event()
+        self._aborted = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def finish(self):
+        # Only the tail after the writer stops counts against the upload timeout
+        self._writer_done.set()
+        self._thread.join(self.timeout)
+        if self._thread.is_alive():
+            self._aborted.set()
+            raise UploadError("upload timed out after %ds" % self.timeout)
+        if self._error is not None:
+            raise self._error if isinstance(self._error, UploadError) else UploadError(str(self._error))
+
+    def abort(self):
+        self._aborted.set()
+        self._writer_done.set()
+        self._thread.join(30)
+
+    def _run(self):
+        client = get_s3_client()
+        workers = max(1, Config.S3_MAX_CONCURRENCY)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            while True:
+                upload_id = client.create_multipart_upload(Bucket=Config.S3_BUCKET, Key=self.key)["UploadId"]
+                try:
+                    completed = self._upload_parts(client, executor, upload_id, workers)
+                except Exception:
+                    client.abort_multipart_upload(Bucket=Config.S3_BUCKET, Key=self.key, UploadId=upload_id)
+                    raise
+                if completed:
+                    return
+                client.abort_multipart_upload(Bucket=Config.S3_BUCKET, Key=self.key, UploadId=upload_id)
+        except Exception as exc:
+            self._error = exc
+        finally:
+            executor.shutdown(wait=True)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_ino, st.st_size
+        except OSError:
+            return None, 0
+
+    def _upload_parts(self, client, executor, upload_id, workers):
+        inode = None
+        offset = 0
+        number = 1
+        pending = []
+        parts = []
+        self.uploaded_bytes = 0
+        while True:
+            if self._aborted.is_set():
+                raise UploadError("upload aborted")
+            # Read the flag before the size so a finished writer's size is final
+            writer_done = self._writer_done.is_set()
+            current_inode, size = self._stat()
+            if inode is None:
+                inode = current_inode
+            if size < offset or (current_inode is not None and current_inode != inode):
+                for future in pending:
+                    future.cancel()
+                return False
+            while size - offset >= self.part_bytes or (writer_done and size > offset):
+                length = min(self.part_bytes, size - offset)
+                pending.append(executor.submit(self._put_part, client, upload_id, number, offset, length))
+                offset += length
+                number += 1
+                while len(pending) >= workers * 2:
+                    parts.append(pending.pop(0).result())
+            if writer_done and size == offset:
+                break
+            time.sleep(POLL_SECONDS)
+        parts.extend(future.result() for future in pending)
+        if not parts:
+            parts.append(self._put_part(client, upload_id, 1, 0, 0))
+        client.complete_multipart_upload(
+            Bucket=Config.S3_BUCKET, Key=self.key, UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+        return True
+
+    def _put_part(self, client, upload_id, number, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            body = f.read(length)
+        if len(body) != length:
+            raise UploadError("short read for part %d" % number)
+        resp = client.upload_part(
+            Bucket=Config.S3_BUCKET, Key=self.key, UploadId=upload_id,
+            PartNumber=number, Body=body,
+        )
+        self.uploaded_bytes += length
+        return {"PartNumber": number, "ETag": resp["ETag"]}
@@ -0,0 +1,86 @@
+import pytest
+
+import pipeline
+import progress
+from config import Config
+
+STDERR = """
+[Parsed_idet_0 @ 0x1] Multi frame detection: TFF:     0 BFF:     0 Progressive:     0 Undetermined:     0
+[Parsed_metadata_2 @ 0x2] lavfi.signalstats.YLOW=20
+[Parsed_metadata_2 @ 0x2] lavfi.signalstats.YAVG=100.5
+[Parsed_metadata_2 @ 0x2] lavfi.signalstats.YHIGH=200
+[Parsed_metadata_2 @ 0x2] lavfi.signalstats.YBITDEPTH=8
+[Parsed_metadata_2 @ 0x2] lavfi.signalstats.YAVG=110.5
+[Parsed_idet_0 @ 0x1] Multi frame detection: TFF:    40 BFF:     2 Progressive:    10 Undetermined:     8
+"""
+
+
+def meta(duration, rate="30000/1001"):
+    return {"format": {"duration": str(duration)}, "streams": [{"codec_type": "video", "avg_frame_rate": rate}]}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    for name, value in (("ANALYSIS_WINDOWS", 8), ("ANALYSIS_WINDOW_FRAMES", 60), ("INTERLACE_RATIO_THRESHOLD", 0.5),
+                        ("AUTO_EXPOSURE_STRENGTH", 0.35), ("HIGHLIGHT_PROTECT", 0.85), ("SHADOW_LIFT_LIMIT", 0.25)):
+        monkeypatch.setattr(Config, name, value)
+
+
+def test_parse_uses_the_last_idet_summary_and_every_luma_sample():
+    counts, luma = pipeline.parse_analysis(STDERR)
+    assert counts == {"tff": 40, "bff": 2, "progressive": 10, "undetermined": 8}
+    assert luma["YAVG"] == [100.5, 110.5] and luma["YBITDEPTH"] == [8.0]
+
+
+def test_windows_are_spread_across_the_tape():
+    starts = pipeline.analysis_windows(meta(800))
+    assert len(starts) == 8
+    # Each 60-frame window (~2 s) is centred in its 100 s slice
+    assert starts[0] == pytest.approx(50 - 1.001) and starts[-1] == pytest.approx(750 - 1.001)
+    assert pipeline.analysis_windows(meta(10)) == [0.0]
+    assert pipeline.analysis_windows(meta(0)) == [0.0]
+
+
+def test_windows_are_merged_and_a_failed_window_is_skipped(monkeypatch):
+    monkeypatch.setattr(Config, "ANALYSIS_WINDOWS", 3)
+    logs = progress.JobLog()
+
+    def window(path, start, logs, feed=None, cpus=None):
+        if start > 500:
+            raise pipeline.PipelineError(pipeline.ERR_DEINTERLACE, "bad tape", logs)
+        return pipeline.parse_analysis(STDERR)
+
+    monkeypatch.setattr(pipeline, "_analyze_window", window)
+    result = pipeline.analyze_input("/in/tape.mkv", meta(900), logs)
+    assert result["windows"] == 2 and result["interlaced"]
+    assert result["idet"] == {"tff": 80, "bff": 4, "progressive": 20, "undetermined": 16}
+    assert result["interlace_ratio"] == pytest.approx(84 / 104.0, abs=1e-4)
+    luma = result["luma"]
+    assert luma["frames"] == 4 and luma["mean"] == pytest.approx(105.5 / 255)
+    assert luma["low"] == pytest.approx(20 / 255.0) and luma["high"] == pytest.approx(200 / 255.0)
+
+
+def exposure(luma, auto=True):
+    return pipeline.build_exposure_filter(0.0, 1.0, 1.0, auto, progress.JobLog(), luma)
+
+
+def test_well_exposed_tape_is_left_alone():
+    chain, b, g, c = exposure({"low": 0.08, "mean": 0.45, "high": 0.83})
+    assert chain == "eq=brightness=0.000:gamma=1.000:contrast=1.000"
+
+
+def test_dark_tape_is_lifted_and_stretched():
+    _, b, g, c = exposure({"low": 0.02, "mean": 0.2, "high": 0.5})
+    assert b == pytest.approx(0.06 * 0.35)
+    assert 1.3 < g < 1.4 and 1.15 < c < 1.25
+
+
+def test_clipped_highlights_are_not_stretched():
+    _, b, g, c = exposure({"low": 0.1, "mean": 0.6, "high": 0.98})
+    assert b == 0.0 and g < 1.0 and c < 1.0
+
+
+def test_exposure_without_a_measurement():
+    assert exposure(None, auto=False)[0] == "eq=brightness=0.000:gamma=1.000:contrast=1.000"
+    _, b, g, c = exposure(None)
+    assert b == pytest.approx(0.35 * 0.25) and g == pytest.approx(1.105)
@@ -0,0 +1,105 @@
+import time
+import types
+
+import pytest
+
+import batch
+import pipeline
+import progress
+from config import Config
+
+META = {
+    "format": {"duration": "60.0"},
+    "streams": [{"codec_type": "video", "width": 720, "height": 480}, {"codec_type": "audio", "codec_name": "aac"}],
+}
+X264 = ["-c:v", "libx264", "-crf", "20"]
+
+
+def test_items_are_inputs_times_variants():
+    request = {"inputs": ["https://h/a.mkv", {"input_url": "https://h/b.mkv", "crf": 18}],
+               "variants": [{"codec": "h264"}, {"codec": "h265", "crf": 22}], "crf": 20}
+    items = batch.expand_items(request, progress.JobLog())
+    assert [(i["input_index"], i["request"]["input_url"], i["request"]["codec"], i["request"]["crf"]) for i in items] == [
+        (0, "https://h/a.mkv", "h264", 20), (0, "https://h/a.mkv", "h265", 22),
+        (1, "https://h/b.mkv", "h264", 18), (1, "https://h/b.mkv", "h265", 22)]
+    assert [i["index"] for i in items] == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize("request_fields", [
+    {"inputs": []},
+    {"inputs": ["https://h/a.mkv"], "profiles": ["archival"], "variants": [{}]},
+    {"inputs": ["https://h/a.mkv"], "profiles": ["nope"]},
+    {"inputs": [{"crf": 20}]},
+    {"inputs": ["https://h/%d.mkv" % i for i in range(3)], "variants": [{}, {}]},
+])
+def test_invalid_batches(request_fields, monkeypatch):
+    monkeypatch.setattr(Config, "BATCH_MAX_ITEMS", 5)
+    with pytest.raises(pipeline.PipelineError) as exc:
+        batch.expand_items(request_fields, progress.JobLog())
+    assert exc.value.code == pipeline.ERR_VALIDATION
+
+
+def item(index, chain, model=None, target=(1440, 1080)):
+    return {
+        "index": index,
+        "params": {"profile": "p%d" % index, "container": "mp4", "target_wh": target, "keep_audio": True, "auto_exposure": False},
+        "spec": {"upscale": bool(model), "filter_chain": chain, "model": model, "scale": 4 if model and "x4" in model else 2,
+                 "dedup": False, "video_args": X264},
+        "encoder": types.SimpleNamespace(name="libx264"),
+        "applied": (0.0, 1.0, 1.0),
+        "plan": {"stages": ["encode"]},
+    }
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    calls = {"preprocess": [], "upscale": [], "encode": []}
+
+    def preprocess(input_path, out_path, chain, logs):
+        calls["preprocess"].append(chain)
+        return chain
+
+    def upscale(src, dst, chain, meta, spec, tmp_dir, logs):
+        calls["upscale"].append(spec["model"])
+        if spec["model"] == "broken":
+            raise pipeline.PipelineError(pipeline.ERR_UPSCALE, "Upscale failed", logs)
+
+    def run_cmd(cmd, timeout, logs, stage, err_code):
+        calls["encode"].append(cmd)
+
+    monkeypatch.setattr(batch, "run_preprocess", preprocess)
+    monkeypatch.setattr(batch, "upscale_video_file", upscale)
+    monkeypatch.setattr(batch, "run_cmd", run_cmd)
+    monkeypatch.setattr(batch, "upload_output", lambda job_id, path, logs: "s3://b/%s/%s" % (job_id, path.rsplit("/", 1)[1]))
+    return calls
+
+
+def render(members, tmp_path):
+    batch._render_input(members, "/in/input", META, {"interlaced": False}, "batch-1", str(tmp_path), str(tmp_path),
+                        progress.JobLog(), time.time())
+    return members
+
+
+def test_items_share_a_decode_per_group(stages, tmp_path):
+    members = render([
+        item(0, "eq=1"), item(1, "eq=2", target=(1280, 720)),
+        item(2, "eq=1", "realesrgan-x2plus"), item(3, "eq=1", "realesrgan-x2plus", target=(1280, 720)),
+        item(4, "eq=1", "realesrgan-x4plus"),
+    ], tmp_path)
+    assert [m["group"] for m in members] == ["direct", "direct", "upscale-1", "upscale-1", "upscale-2"]
+    # Three ffmpeg encodes for five outputs, one preprocess + upscale per (chain, model)
+    assert len(stages["encode"]) == 3
+    assert stages["preprocess"] == ["eq=1", "eq=1"] and stages["upscale"] == ["realesrgan-x2plus", "realesrgan-x4plus"]
+    direct = stages["encode"][0]
+    assert direct.count("-i") == 1 and direct.count("0:a:0") == 2
+    # Direct items fold their own chains into the shared decode
+    graph = direct[direct.index("-filter_complex") + 1]
+    assert "eq=1" in graph and "eq=2" in graph
+    assert [m["result"]["output_url"] for m in members[:2]] == ["s3://b/batch-1/batch-1-0-p0.mp4", "s3://b/batch-1/batch-1-1-p1.mp4"]
+    assert members[4]["result"]["metadata"]["shared_group"] == "upscale-2"
+
+
+def test_a_failed_group_fails_only_its_items(stages, tmp_path):
+    members = render([item(0, "eq=1"), item(1, "eq=1", "broken"), item(2, "eq=1", "realesrgan-x2plus")], tmp_path)
+    assert [m["result"]["status"] for m in members] == ["completed", "failed", "completed"]
+    assert members[1]["result"]["error_code"] == pipeline.ERR_UPSCALE
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from bench import clips, compare, run
+
+
+def test_clips_are_woven_into_tff_480i():
+    chain = clips.clip_filter("dark")
+    assert chain.startswith("testsrc2=size=720x480:rate=60000/1001,eq=")
+    assert chain.endswith("interlace=scan=tff:lowpass=complex,setfield=tff,setdar=4/3")
+    with pytest.raises(ValueError):
+        clips.clip_filter("pal")
+
+
+def test_generated_clip_is_reused(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_run(cmd, check, timeout):
+        calls.append(cmd)
+        with open(cmd[-1], "wb") as f:
+            f.write(b"clip")
+
+    monkeypatch.setattr(clips.subprocess, "run", fake_run)
+    path = clips.generate_clip(str(tmp_path), "noisy", 5)
+    assert path == str(tmp_path / "noisy_5s.mkv") and open(path, "rb").read() == b"clip"
+    assert clips.generate_clip(str(tmp_path), "noisy", 5) == path and len(calls) == 1
+    # Interlaced MPEG-2 with a tone track, written under a temp name and renamed
+    assert "+ilme+ildct" in calls[0] and "sine=frequency=440:sample_rate=48000" in calls[0]
+    assert calls[0][-1] == path + ".part.mkv"
+    clips.generate_clip(str(tmp_path), "dark", 5, audio=False)
+    assert "-c:a" not in calls[1]
+
+
+def entry(clip, profile, wall, status="completed", **stages):
+    return {"clip": clip, "profile": profile, "status": status, "wall_sec": wall,
+            "stages": {name: {"wall_sec": sec} for name, sec in stages.items()}}
+
+
+def test_compare_takes_medians_of_completed_runs():
+    report = {"results": [
+        entry("dark", "archival", 10.0, encode=4.0),
+        entry("dark", "archival", 30.0, encode=6.0),
+        entry("dark", "archival", 12.0),
+        entry("dark", "archival", 1.0, status="failed"),
+    ]}
+    runs = compare.group(report)
+    assert list(runs) == [("dark", "archival")] and len(runs[("dark", "archival")]) == 3
+    assert compare.median_wall(runs[("dark", "archival")]) == 12.0
+    assert compare.median_wall(runs[("dark", "archival")], "encode") == 5.0
+    assert compare.median_wall(runs[("dark", "archival")], "upscale") is None
+
+
+def test_compare_deltas():
+    assert compare.fmt_delta(10.0, 8.0) == "-20.0%"
+    assert compare.fmt_delta(None, 8.0) == "n/a"
+    assert compare.fmt_delta(0.0, 0.0) == "+0.0%" and compare.fmt_delta(0.0, 1.0) == "new"
+
+
+def test_compare_report(tmp_path, capsys):
+    base, new = tmp_path / "base.json", tmp_path / "new.json"
+    base.write_text(json.dumps({"revision": "a", "settings": {"seconds": 10},
+                                "results": [entry("dark", "archival", 10.0, encode=4.0)]}))
+    new.write_text(json.dumps({"revision": "b", "settings": {"seconds": 20},
+                               "results": [entry("dark", "archival", 9.0, encode=5.0)]}))
+    assert compare.main([str(base), str(new), "--stages"]) == 0
+    out = capsys.readouterr().out
+    assert "settings differ" in out
+    assert any(line.split()[2:] == ["total", "10.00", "9.00", "-10.0%"] for line in out.splitlines())
+    assert any(line.split()[2:] == ["encode", "4.00", "5.00", "+25.0%"] for line in out.splitlines())
+
+
+def test_stage_summary_folds_self_cpu():
+    timings = {"encode": {"wall_sec": 2.0, "cpu_sec": 3.5, "self_cpu_sec": 0.25, "frames": 60, "fps": 30.0,
+                          "threads": {"filter": 2}}}
+    assert run.stage_summary(timings) == {
+        "encode": {"wall_sec": 2.0, "cpu_sec": 3.75, "frames": 60, "fps": 30.0, "threads": {"filter": 2}}}
+    assert run.stage_summary(None) == {}
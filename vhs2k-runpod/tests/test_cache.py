@@ -0,0 +1,67 @@
+import os
+
+import cache
+import pipeline
+
+
+def make_input(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def age(store, key, seconds_ago):
+    path = os.path.join(store.root, key, "entry.json")
+    stamp = os.path.getmtime(path) - seconds_ago
+    os.utime(path, (stamp, stamp))
+
+
+def test_key_needs_a_validator():
+    assert cache.InputCache.key_for({"url": "https://host/tape.mkv"}) is None
+    a = cache.InputCache.key_for({"url": "https://host/tape.mkv", "etag": "\"1\""})
+    b = cache.InputCache.key_for({"url": "https://host/tape.mkv", "etag": "\"2\""})
+    assert a and b and a != b
+
+
+def test_stored_input_is_a_hard_link_with_its_probe(tmp_path):
+    store = cache.InputCache(str(tmp_path / "cache"), 10000)
+    src = make_input(tmp_path, "input", 1000)
+    cached = store.store_input("k", src)
+    assert os.path.samefile(cached, src)
+    store.store_probe("k", {"format": {"duration": "3.0"}})
+    assert store.lookup("k") == {"input": cached, "probe": {"format": {"duration": "3.0"}}}
+    assert store.lookup("missing") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    store = cache.InputCache(str(tmp_path / "cache"), 2500)
+    for key in ("a", "b"):
+        store.store_input(key, make_input(tmp_path, key, 1000))
+    age(store, "a", 20)
+    age(store, "b", 10)
+    # A lookup refreshes "a", so "b" is now the oldest and goes first
+    assert store.lookup("a")
+    store.store_input("c", make_input(tmp_path, "c", 1000))
+    assert store.lookup("b") is None
+    assert store.lookup("a") and store.lookup("c")
+
+
+def test_input_larger_than_the_cache_is_not_stored(tmp_path):
+    store = cache.InputCache(str(tmp_path / "cache"), 500)
+    assert store.store_input("big", make_input(tmp_path, "big", 1000)) is None
+    assert store.lookup("big") is None
+
+
+def test_job_keeps_its_input_when_the_entry_is_evicted(tmp_path):
+    store = cache.InputCache(str(tmp_path / "cache"), 1500)
+    store.store_input("a", make_input(tmp_path, "a", 1000))
+    job_input = str(tmp_path / "job-input")
+    assert pipeline.link_cached_input(store.lookup("a")["input"], job_input) == job_input
+    store.store_input("b", make_input(tmp_path, "b", 1000))
+    assert store.lookup("a") is None
+    assert os.path.getsize(job_input) == 1000
+
+
+def test_cache_is_off_without_a_budget(tmp_path):
+    assert cache.get_input_cache(str(tmp_path / "cache"), 0) is None
+    assert cache.get_input_cache(str(tmp_path / "cache"), 1) is cache.get_input_cache(str(tmp_path / "cache"), 1)
@@ -0,0 +1,87 @@
+import types
+
+import pytest
+
+import capabilities
+import pipeline
+from config import Config
+
+FILTERS = """Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+  ..C = Command support
+ TS. bwdif             V->V       Deinterlace the input image.
+ ... buffer            |->V       Buffer video frames, and make them accessible to the filterchain.
+ TSC eq                V->V       Adjust brightness, contrast, gamma, and saturation.
+ TS. scale             V->V       Scale the input video size and/or convert the image format.
+"""
+HWACCELS = """Hardware acceleration methods:
+cuda
+vaapi
+
+"""
+
+
+def worker(filters=("scale", "eq", "hqdn3d", "unsharp", "bwdif"), codecs=("h264", "h265"), upscaler=None):
+    found = {"enc_%s" % codec: types.SimpleNamespace(codec=codec) for codec in codecs}
+    return capabilities.WorkerCapabilities(
+        ffmpeg="ffmpeg version 7.0.2 Copyright (c) 2000-2024", encoders=found, filters=set(filters),
+        upscaler=upscaler if upscaler is not None else {"backend": "stub", "available": True, "models": None})
+
+
+def test_ffmpeg_listings_are_parsed(monkeypatch):
+    monkeypatch.setattr(capabilities, "_ffmpeg_lines", lambda *args: FILTERS if args == ("-filters",) else HWACCELS)
+    assert capabilities.list_ffmpeg_filters() == {"bwdif", "buffer", "eq", "scale"}
+    assert capabilities.list_ffmpeg_hwaccels() == ["cuda", "vaapi"]
+    monkeypatch.setattr(capabilities, "_ffmpeg_lines", lambda *args: None)
+    assert capabilities.list_ffmpeg_filters() == set() and capabilities.list_ffmpeg_hwaccels() == []
+
+
+def test_a_failed_filter_probe_does_not_block_jobs():
+    caps = worker(filters=())
+    assert caps.has_filter("bwdif") and caps.missing_filters(["eq"]) == []
+    assert worker(filters=("eq",)).missing_filters(["eq", "hqdn3d"]) == ["hqdn3d"]
+
+
+def test_models_are_checked_only_when_listed():
+    assert worker().has_model("anything")
+    caps = worker(upscaler={"backend": "realesrgan-ncnn-vulkan", "available": True, "models": {"realesrgan-x2plus"}})
+    assert caps.has_model("realesrgan-x2plus") and not caps.has_model("realesrgan-x4plus")
+    assert caps.as_dict()["upscaler"]["models"] == ["realesrgan-x2plus"]
+    assert "ffmpeg=ffmpeg version 7.0.2 " in caps.summary() and "models=realesrgan-x2plus" in caps.summary()
+
+
+def test_probe_runs_once_per_worker(monkeypatch):
+    calls = []
+    monkeypatch.setattr(capabilities, "_capabilities", None)
+    monkeypatch.setattr(capabilities, "ffmpeg_version", lambda: calls.append("version") or "ffmpeg version 7")
+    monkeypatch.setattr(capabilities, "list_ffmpeg_filters", lambda: {"eq"})
+    monkeypatch.setattr(capabilities, "list_ffmpeg_hwaccels", lambda: [])
+    monkeypatch.setattr(capabilities.encoders, "available_encoders", lambda refresh=False: {})
+    monkeypatch.setattr(capabilities.upscaler, "describe_backend", lambda name: {"backend": name, "available": False})
+    first = capabilities.get()
+    assert capabilities.get() is first and capabilities.probe() is first and calls == ["version"]
+    assert capabilities.probe(refresh=True) is not first and len(calls) == 2
+
+
+@pytest.mark.parametrize("request_fields,caps,message", [
+    ({"encoder": "hevc_nvenc"}, worker(), "encoder hevc_nvenc is not available on this worker"),
+    ({"codec": "av1"}, worker(), "no av1 encoder available on this worker"),
+    ({"model": "realesrgan-x4plus"}, worker(upscaler={"available": False, "error": "no vulkan"}),
+     "model requested but the upscaler is unavailable: no vulkan"),
+    ({"model": "realesrgan-x4plus"}, worker(upscaler={"available": True, "models": set()}),
+     "model realesrgan-x4plus is not installed"),
+    ({"deinterlace": "auto"}, worker(filters=("scale", "eq", "hqdn3d", "unsharp")),
+     "ffmpeg has no deinterlace filter (bwdif/yadif); use deinterlace=off"),
+    ({"deinterlace": "off"}, worker(filters=("scale", "eq", "unsharp")),
+     "ffmpeg filter hqdn3d is not available on this worker"),
+])
+def test_requests_the_worker_cannot_run(request_fields, caps, message):
+    assert pipeline.capability_errors(request_fields, caps) == [message]
+
+
+def test_supported_request_passes(monkeypatch):
+    monkeypatch.setattr(Config, "DEFAULT_CODEC", "h265")
+    assert pipeline.capability_errors({"deinterlace": "on", "model": "realesrgan-x2plus"}, worker()) == []
+    # No encoder list (probe failed) leaves codec errors to the encode stage
+    assert pipeline.capability_errors({"codec": "av1"}, worker(codecs=())) == []
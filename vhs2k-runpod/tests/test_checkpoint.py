@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+
+import pipeline
+
+
+def test_finished_stages_survive_a_restart(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    output = tmp_path / "final.mp4"
+    output.write_bytes(b"x")
+    first = pipeline.Checkpoint(path, "key-1")
+    first.mark("probe", meta={"format": {"duration": "12.5"}})
+    first.mark("encode", path=str(output))
+    resumed = pipeline.Checkpoint(path, "key-1")
+    assert resumed.done("probe")["meta"] == {"format": {"duration": "12.5"}}
+    assert resumed.has_file("encode", str(output))
+    assert not resumed.done("upload")
+    # Written through a temp file and renamed, so a crash never leaves half a manifest
+    assert not (tmp_path / "manifest.json.tmp").exists()
+
+
+def test_has_file_needs_the_same_existing_path(tmp_path):
+    checkpoint = pipeline.Checkpoint(str(tmp_path / "manifest.json"), "k")
+    checkpoint.mark("download", path=str(tmp_path / "input"))
+    assert not checkpoint.has_file("download", str(tmp_path / "input"))
+    (tmp_path / "input").write_bytes(b"x")
+    assert checkpoint.has_file("download", str(tmp_path / "input"))
+    assert not checkpoint.has_file("download", str(tmp_path / "other"))
+
+
+def test_other_key_or_broken_manifest_starts_over(tmp_path):
+    path = tmp_path / "manifest.json"
+    pipeline.Checkpoint(str(path), "old-key").mark("probe")
+    assert pipeline.Checkpoint(str(path), "new-key").data == {"key": "new-key", "stages": {}}
+    path.write_text("{not json")
+    assert pipeline.Checkpoint(str(path), "new-key").data["stages"] == {}
+
+
+def test_job_key_follows_the_input_identity_and_parameters():
+    head = {"etag": "\"abc\"", "content_length": 100}
+    a = pipeline.input_identity("https://bucket/tape.mkv?X-Amz-Signature=1", head)
+    b = pipeline.input_identity("https://bucket/tape.mkv?X-Amz-Signature=2", head)
+    # Presigned query strings change per submission; the validators identify the object
+    assert a == b and a["url"] == "https://bucket/tape.mkv"
+    assert pipeline.input_identity("https://host/tape.mkv?v=1", {})["url"] == "https://host/tape.mkv?v=1"
+    params = {"crf": 20, "codec": "h265"}
+    assert pipeline.compute_job_key(a, params) == pipeline.compute_job_key(b, dict(params))
+    assert pipeline.compute_job_key(a, params) != pipeline.compute_job_key(a, dict(params, crf=21))
+
+
+def test_same_job_key_runs_one_at_a_time():
+    inside, overlaps = [], []
+
+    def run():
+        with pipeline.job_dir_lock("same"):
+            overlaps.append(len(inside))
+            inside.append(1)
+            time.sleep(0.05)
+            inside.pop()
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert overlaps == [0, 0, 0] and "same" not in pipeline._job_locks
+
+
+def test_manifest_is_plain_json(tmp_path):
+    path = tmp_path / "manifest.json"
+    pipeline.Checkpoint(str(path), "k").mark("upload")
+    data = json.loads(path.read_text())
+    assert data["key"] == "k" and "finished_at" in data["stages"]["upload"]
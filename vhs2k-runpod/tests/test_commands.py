@@ -0,0 +1,76 @@
+import pipeline
+
+X264 = ["-c:v", "libx264", "-crf", "20", "-preset", "medium"]
+RAW_INPUT = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "1440x960", "-r", "30000/1001", "-i", "pipe:0"]
+
+
+def option(cmd, name):
+    return cmd[cmd.index(name) + 1]
+
+
+def assert_tagged_bt709(args):
+    for name, value in zip(pipeline.OUTPUT_COLOR_ARGS[::2], pipeline.OUTPUT_COLOR_ARGS[1::2]):
+        assert option(args, name) == value
+
+
+def test_streamed_frames_are_encoded_as_tagged_420():
+    audio = {"same_input": False, "path": "/in/tape.mkv", "args": ["-c:a", "copy"]}
+    cmd = pipeline.build_encode_cmd(RAW_INPUT, audio, (1920, 1080), X264, "/out/final.mp4", prefilter="hqdn3d=1:1:1:1")
+    # rgb24 from the upscaler is converted with the BT.709 matrix after the prefilter
+    assert option(cmd, "-vf") == "hqdn3d=1:1:1:1,scale=1920:1080:out_color_matrix=bt709:out_range=tv,format=yuv420p"
+    assert_tagged_bt709(cmd)
+    assert cmd[cmd.index("-i", cmd.index("pipe:0")) + 1] == "/in/tape.mkv"
+    assert cmd[-1] == "/out/final.mp4" and "-map" in cmd and "1:a:0" in cmd
+
+
+def test_null_prefilter_is_left_out():
+    cmd = pipeline.build_encode_cmd(RAW_INPUT, None, (1920, 1080), X264, "/out/final.mkv", prefilter="null")
+    assert option(cmd, "-vf").startswith("scale=1920:1080:")
+    assert "-map" not in cmd
+
+
+def test_every_output_of_a_multi_encode_is_tagged():
+    outputs = [
+        {"target_wh": (1920, 1080), "video_args": X264, "output_path": "/out/a.mp4"},
+        {"target_wh": (1280, 720), "video_args": X264, "output_path": "/out/b.mp4"},
+    ]
+    cmd = pipeline.build_multi_encode_cmd(RAW_INPUT, None, outputs)
+    for i, path in enumerate(("/out/a.mp4", "/out/b.mp4")):
+        end = cmd.index(path)
+        start = cmd.index("[v%d]" % i)
+        assert_tagged_bt709(cmd[start:end])
+    assert "format=yuv420p[v1]" in option(cmd, "-filter_complex")
+
+
+def audio_meta(codec):
+    return {"streams": [{"codec_type": "video"}, {"codec_type": "audio", "codec_name": codec}]}
+
+
+def test_audio_is_copied_when_the_container_can_carry_it(monkeypatch):
+    monkeypatch.setattr(pipeline.Config, "AUDIO_COPY", True)
+    assert pipeline.audio_codec_args(audio_meta("aac"), "mp4") == ["-c:a", "copy"]
+    assert pipeline.audio_codec_args(audio_meta("pcm_s16le"), "mkv") == ["-c:a", "copy"]
+    # PCM does not go into MP4, so it is encoded once, in the final mux
+    assert pipeline.audio_codec_args(audio_meta("pcm_s16le"), "mp4")[:2] == ["-c:a", pipeline.Config.AUDIO_CODEC]
+    monkeypatch.setattr(pipeline.Config, "AUDIO_COPY", False)
+    assert pipeline.audio_codec_args(audio_meta("aac"), "mkv")[:2] == ["-c:a", pipeline.Config.AUDIO_CODEC]
+
+
+def test_direct_encode_maps_audio_from_its_own_input():
+    audio = {"same_input": True, "path": "/in/tape.mkv", "args": ["-c:a", "copy"]}
+    cmd = pipeline.build_encode_cmd(["-i", "/in/tape.mkv"], audio, (1920, 1080), X264, "/out/final.mp4")
+    # No second input and no extracted audio file: the encode reads the tape once
+    assert cmd.count("-i") == 1
+    assert cmd[cmd.index("-map"):cmd.index("-map") + 4] == ["-map", "0:v:0", "-map", "0:a:0"]
+    assert option(cmd, "-c:a") == "copy"
+
+
+def test_multi_encode_maps_audio_only_where_asked():
+    outputs = [
+        {"target_wh": (1920, 1080), "video_args": X264, "audio_args": ["-c:a", "copy"], "output_path": "/out/a.mp4"},
+        {"target_wh": (1280, 720), "video_args": X264, "output_path": "/out/b.mp4"},
+    ]
+    cmd = pipeline.build_multi_encode_cmd(RAW_INPUT, {"path": "/in/tape.mkv"}, outputs)
+    first = cmd[cmd.index("[v0]"):cmd.index("/out/a.mp4")]
+    second = cmd[cmd.index("[v1]"):cmd.index("/out/b.mp4")]
+    assert "1:a:0" in first and "1:a:0" not in second
@@ -0,0 +1,46 @@
+import dedup
+
+W, H = 720, 480
+
+
+def frame_with_square(x, y, side=8):
+    frame = bytearray(W * H * dedup.BYTES_PER_PIXEL)
+    for row in range(y, y + side):
+        start = (row * W + x) * dedup.BYTES_PER_PIXEL
+        frame[start:start + side * dedup.BYTES_PER_PIXEL] = b"\xff" * (side * dedup.BYTES_PER_PIXEL)
+    return bytes(frame)
+
+
+def run(frames, batch=4):
+    deduper = dedup.FrameDeduper((W, H), 2.5, 24)
+    batches = [frames[i:i + batch] for i in range(0, len(frames), batch)]
+    kept = [frame for out in deduper.batches(batches) for frame in out]
+    return deduper, list(deduper.expand(kept))
+
+
+def test_motion_inside_one_tile_is_kept():
+    # Each grid tile is 22x20 px, so an 8x8 square moving 1 px a frame never leaves tile (0, 0)
+    frames = [frame_with_square(2 + i, 4) for i in range(12)]
+    first, last = dedup.frame_signature(frames[0], (W, H)), dedup.frame_signature(frames[-1], (W, H))
+    assert dedup.signature_distance(first, last) <= 2.5
+    deduper, out = run(frames)
+    assert deduper.skipped == 0
+    assert out == frames
+
+
+def test_still_frames_collapse_and_expand():
+    still = frame_with_square(100, 100)
+    frames = [still] * 5 + [frame_with_square(300, 200)] * 3
+    deduper, out = run(frames)
+    assert deduper.stats() == {"frames": 8, "upscaled": 2, "skipped": 6}
+    assert out == frames
+
+
+def test_noise_within_tolerance_is_a_repeat():
+    base = frame_with_square(100, 100)
+    noisy = bytearray(base)
+    for i in range(1, len(noisy), 97):
+        noisy[i] = min(255, noisy[i] + 3)
+    deduper, out = run([base, bytes(noisy)])
+    assert deduper.skipped == 1
+    assert out == [base, base]
@@ -0,0 +1,84 @@
+import pytest
+
+import capabilities
+import encoders
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    # Installs a fake probe result: `worker(names)` makes exactly those encoders available
+    def install(names, usable_hardware=True):
+        monkeypatch.setattr(encoders, "list_ffmpeg_encoders", lambda: set(names))
+        monkeypatch.setattr(encoders, "_hardware_usable", lambda name: usable_hardware)
+        found = encoders.available_encoders(refresh=True)
+        return capabilities.WorkerCapabilities(encoders=found)
+    yield install
+    monkeypatch.setattr(encoders, "_available", None)
+
+
+def test_cpu_only_falls_back_to_software(worker):
+    caps = worker(["libx264", "libx265"])
+    assert not caps.has_codec("av1")
+    for quality in ("preview", "standard", "archival"):
+        assert encoders.select_encoder("h264", quality).name == "libx264"
+        assert encoders.select_encoder("h265", quality).name == "libx265"
+    with pytest.raises(encoders.EncoderError):
+        encoders.select_encoder("av1")
+    assert encoders.intermediate_args(4)[:2] == ["-c:v", "libx264"]
+    assert "yuv420p" in encoders.intermediate_args()
+
+
+def test_auto_keeps_the_software_defaults(worker):
+    worker(["libx264", "libx265", "libsvt_hevc", "hevc_nvenc", "h264_nvenc", "libsvtav1", "libaom-av1"])
+    for quality in ("preview", "standard", "archival"):
+        assert encoders.select_encoder("h265", quality).name == "libx265"
+        assert encoders.select_encoder("h264", quality).name == "libx264"
+        assert encoders.select_encoder("av1", quality).name == "libsvtav1"
+    assert encoders.select_encoder("h265", "standard", "hevc_nvenc").name == "hevc_nvenc"
+    assert encoders.intermediate_args()[:2] == ["-c:v", "h264_nvenc"]
+
+
+def test_fastest_fallback_meeting_the_quality_tier(worker):
+    worker(["libsvt_hevc", "hevc_nvenc", "libaom-av1", "av1_nvenc"])
+    assert encoders.select_encoder("h265", "standard").name == "hevc_nvenc"
+    assert encoders.select_encoder("av1", "standard").name == "av1_nvenc"
+    assert encoders.select_encoder("av1", "archival").name == "libaom-av1"
+
+
+def test_listed_nvenc_without_a_gpu_is_skipped(worker):
+    caps = worker(["libx264", "h264_nvenc", "hevc_nvenc"], usable_hardware=False)
+    assert sorted(caps.encoders) == ["libx264"]
+    assert encoders.select_encoder("h264", "preview").name == "libx264"
+    with pytest.raises(encoders.EncoderError):
+        encoders.select_encoder("h265")
+
+
+def test_best_available_tier_when_none_meets_the_target(worker):
+    worker(["libx264", "hevc_nvenc", "libsvt_hevc"])
+    # Both HEVC encoders are "standard"; archival falls back to the faster of them
+    assert encoders.select_encoder("h265", "archival").name == "hevc_nvenc"
+
+
+def test_requested_encoder(worker):
+    worker(["libx264", "libx265"])
+    assert encoders.select_encoder("h265", "preview", "libx265").name == "libx265"
+    assert encoders.select_encoder("h265", "preview", "auto").name == "libx265"
+    with pytest.raises(encoders.EncoderError, match="not available"):
+        encoders.select_encoder("h265", requested="hevc_nvenc")
+    with pytest.raises(encoders.EncoderError, match="does not produce"):
+        encoders.select_encoder("h265", requested="libx264")
+
+
+def test_presets_map_onto_each_encoders_scale():
+    assert encoders.X264Encoder().video_args(20, "veryslow")[-1] == "veryslow"
+    assert encoders.X264Encoder().video_args(20, "placebo")[-1] == "placebo"
+    assert encoders.X265Encoder().video_args(20, "placebo")[-1] == "placebo"
+    assert encoders.SvtHevcEncoder().video_args(20, "ultrafast")[-1] == "11"
+    assert encoders.SvtAv1Encoder().video_args(20, "veryslow")[-1] == "4"
+    assert "p1" in encoders.HevcNvencEncoder().video_args(20, "ultrafast")
+    assert encoders.HevcNvencEncoder().thread_args(8) == []
+    assert encoders.X265Encoder().thread_args(8) == ["-x265-params", "pools=8"]
+
+
+def test_stream_args_pins_options_to_one_stream():
+    assert encoders.stream_args(["-c:v", "libx264", "-crf", "20"], 1) == ["-c:v:1", "libx264", "-crf:v:1", "20"]
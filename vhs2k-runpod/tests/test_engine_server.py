@@ -0,0 +1,60 @@
+import concurrent.futures
+import os
+
+import pytest
+
+import upscaler
+
+WH = (24, 16)
+
+
+def frames_for(seed):
+    return [bytes((seed * 5 + i * 3 + j) % 256 for j in range(WH[0] * WH[1] * upscaler.BYTES_PER_PIXEL)) for i in range(3)]
+
+
+def upscale_in_worker(seed):
+    # Runs in a pool worker: the engine it gets must be the job process's, not a fresh one
+    engine = upscaler.get_engine("stub", "m", "/nonexistent")
+    batches = [frames_for(seed), frames_for(seed + 1)]
+    out = list(engine.upscale_stream(iter(batches), WH, 2))
+    return os.getpid(), type(engine).__name__, out
+
+
+class CountingStub(upscaler.StubBackend):
+    def __init__(self, model, work_root):
+        super(CountingStub, self).__init__(model, work_root)
+        self.pids = set()
+
+    def upscale(self, frames, in_wh, scale):
+        self.pids.add(os.getpid())
+        return super(CountingStub, self).upscale(frames, in_wh, scale)
+
+
+def test_pool_workers_upscale_through_the_parent_engine(tmp_path):
+    backend = CountingStub("m", str(tmp_path))
+    engine = upscaler.UpscalerEngine(upscaler.TilingBackend(backend, -1), 2)
+    server = upscaler.EngineServer(engine)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2, initializer=upscaler.attach_remote, initargs=server.client_args()) as pool:
+            results = list(pool.map(upscale_in_worker, range(4)))
+    finally:
+        server.close()
+    for seed, (pid, kind, out) in enumerate(results):
+        assert pid != os.getpid() and kind == "RemoteEngine"
+        expected = [upscaler.nearest_upscale(f, WH, 2) for f in frames_for(seed) + frames_for(seed + 1)]
+        assert out == expected
+    assert backend.pids == {os.getpid()}
+
+
+def test_backend_errors_reach_the_worker(tmp_path):
+    class Failing(upscaler.StubBackend):
+        def upscale(self, frames, in_wh, scale):
+            raise upscaler.UpscaleError("model exploded")
+
+    server = upscaler.EngineServer(upscaler.UpscalerEngine(upscaler.TilingBackend(Failing("m", str(tmp_path)), -1), 2))
+    try:
+        remote = upscaler.RemoteEngine(*server.client_args())
+        with pytest.raises(upscaler.UpscaleError, match="model exploded"):
+            list(remote.upscale_stream(iter([frames_for(0)]), WH, 2))
+    finally:
+        server.close()
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import estimator
+import pipeline
+import progress
+from config import Config
+
+SHAPE = {
+    "duration": 600.0, "src_wh": (720, 480), "target_wh": (1440, 1080), "renditions": [(1440, 1080)],
+    "fps": 30000 / 1001.0, "upscale": True, "streaming": False, "segmented": False, "workers": 1,
+    "backend": "stub", "model": "realesrgan-x2plus", "encoder": "libx264",
+    "input_bytes": 100 * estimator.MB, "keep_audio": False,
+}
+# Measured rates for every heavy stage of SHAPE, staged or streamed; 1 megapixel per second
+# is far too slow for a ten-minute tape
+SLOW = {"preprocess": 1.0, "upscale:stub:realesrgan-x2plus": 1.0, "encode:libx264": 1.0,
+        "stream:stub:realesrgan-x2plus:libx264": 1.0}
+
+
+@pytest.fixture
+def history(monkeypatch):
+    fresh = estimator.ThroughputHistory(None)
+    monkeypatch.setattr(estimator, "_history", fresh)
+    monkeypatch.setattr(Config, "ESTIMATE_CHECK", "enforce")
+    monkeypatch.setattr(Config, "ESTIMATE_COST_PER_HOUR", 0.0)
+    return fresh
+
+
+def test_rates_are_smoothed_and_persisted(tmp_path):
+    path = str(tmp_path / "throughput.json")
+    history = estimator.ThroughputHistory(path)
+    history.update("encode:libx264", 10.0)
+    history.update("encode:libx264", 20.0)
+    assert history.rate("encode:libx264") == pytest.approx(13.0)
+    history.save()
+    reloaded = estimator.ThroughputHistory(path)
+    assert reloaded.rate("encode:libx264") == pytest.approx(13.0) and reloaded.rates["encode:libx264"]["samples"] == 2
+    assert reloaded.rate("upload") is None
+    (tmp_path / "throughput.json").write_text("{broken")
+    assert estimator.ThroughputHistory(path).rates == {}
+
+
+def test_record_learns_rates_from_long_enough_stages(history):
+    timings = {"probe": {"wall_sec": 0.5}, "preprocess": {"wall_sec": 100.0}, "encode": {"wall_sec": 0.5}}
+    estimator.record(SHAPE, timings, out_bytes=1000000, history=history)
+    src = 720 * 480 * SHAPE["fps"] * 600 / 1e6
+    assert history.rate("probe") == 0.5
+    assert history.rate("preprocess") == pytest.approx(src / 100.0)
+    # Half a second of encode is mostly setup; it is not a throughput sample
+    assert history.rate("encode:libx264") is None
+    assert history.rate("bpp:libx264") == pytest.approx(8e6 / (1440 * 1080 * SHAPE["fps"] * 600))
+
+
+def test_estimate_prefers_measured_rates(history):
+    default = estimator.estimate(SHAPE, history=history)
+    assert default["basis"] == "default" and set(default["stages"]) == {
+        "download", "probe", "analyze", "preprocess", "upscale", "encode", "upload"}
+    for key, rate in SLOW.items():
+        history.update(key, rate)
+    measured = estimator.estimate(SHAPE, skip=("download",), history=history)
+    assert measured["basis"] == "history" and "download" not in measured["stages"]
+    assert measured["stages"]["encode"] == {"seconds": pytest.approx(1440 * 1080 * SHAPE["fps"] * 600 / 1e6, abs=0.1), "source": "history"}
+    assert measured["gpu_seconds"] == measured["stages"]["upscale"]["seconds"]
+
+
+def check(enforce=True, skip=(), done=()):
+    return pipeline.check_estimate({}, {}, {}, dict(SHAPE), skip, done, False, time.time(), progress.JobLog(), enforce)
+
+
+def test_job_within_the_limit_keeps_its_plan(history, monkeypatch):
+    monkeypatch.setattr(Config, "MAX_JOB_SECONDS", 100000)
+    shape, estimate = check()
+    assert not shape["streaming"] and estimate["replanned"] == [] and estimate["within_limit"]
+
+
+def test_overrun_on_default_rates_replans_but_is_not_refused(history, monkeypatch):
+    monkeypatch.setattr(Config, "MAX_JOB_SECONDS", 600)
+    shape, estimate = check()
+    assert shape["streaming"] and estimate["replanned"] == ["streaming"]
+    assert not estimate["within_limit"] and not estimate["rejected"]
+
+
+def test_overrun_on_measured_rates_is_refused(history, monkeypatch):
+    monkeypatch.setattr(Config, "MAX_JOB_SECONDS", 3600)
+    for key, rate in SLOW.items():
+        history.update(key, rate)
+    with pytest.raises(pipeline.PipelineError) as exc:
+        check()
+    assert exc.value.code == pipeline.ERR_TIMEOUT
+    # Dry runs report the refusal instead of raising it
+    _, estimate = check(enforce=False)
+    assert estimate["rejected"] and estimate["basis"] == "history"
+    monkeypatch.setattr(Config, "ESTIMATE_CHECK", "warn")
+    shape, estimate = check()
+    assert not shape["streaming"] and not estimate["rejected"]
+
+
+def test_finished_stages_do_not_count_against_the_budget(history, monkeypatch):
+    for key, rate in SLOW.items():
+        history.update(key, rate)
+    full = estimator.estimate(SHAPE)
+    left = full["seconds"] - full["stages"]["preprocess"]["seconds"] - full["stages"]["upscale"]["seconds"]
+    monkeypatch.setattr(Config, "MAX_JOB_SECONDS", int(left) + 60)
+    shape, estimate = check(done=("preprocess", "upscale"))
+    assert estimate["within_limit"] and estimate["replanned"] == []
+    assert estimate["seconds"] == full["seconds"]
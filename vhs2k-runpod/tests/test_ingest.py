@@ -0,0 +1,97 @@
+import http.server
+import os
+import threading
+
+import pytest
+
+import ingest
+
+MB = 1024 * 1024
+DATA = os.urandom(3 * MB + 12345)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    # Serves DATA; the server's `ranges` flag decides whether Range headers are honoured
+    def do_GET(self):
+        rng = self.headers.get("Range")
+        self.server.requests.append(rng)
+        if rng and self.server.ranges:
+            start, _, end = rng.split("=", 1)[1].partition("-")
+            start, end = int(start), min(int(end or len(DATA) - 1), len(DATA) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(DATA)))
+            body = DATA[start:end + 1]
+        else:
+            self.send_response(200)
+            body = DATA
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["ranges", "no-ranges"])
+def server(request):
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    srv.ranges = request.param
+    srv.requests = []
+    # Clients that stop reading early (max_bytes) leave broken pipes behind
+    srv.handle_error = lambda *args: None
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    srv.url = "http://127.0.0.1:%d/tape.mkv" % srv.server_port
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_probe_remote(server):
+    info = ingest.probe_remote(server.url)
+    assert info["accept_ranges"] is server.ranges
+    assert info["content_length"] == len(DATA)
+    assert info["etag"] == '"v1"'
+
+
+def test_download_matches_source(server, tmp_path):
+    info = ingest.probe_remote(server.url)
+    path = str(tmp_path / "input")
+    download = ingest.RangedDownload(server.url, path, info["content_length"], info["accept_ranges"], connections=3, part_bytes=MB)
+    download.start()
+    assert download.join() == len(DATA)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    ranged = [r for r in server.requests[1:] if r]
+    assert len(ranged) == (4 if server.ranges else 0)
+
+
+def test_growing_reader_sees_every_byte(server, tmp_path):
+    info = ingest.probe_remote(server.url)
+    download = ingest.RangedDownload(server.url, str(tmp_path / "input"), info["content_length"], info["accept_ranges"], part_bytes=MB)
+    download.start()
+    reader = ingest.GrowingFileReader(download)
+    chunks = []
+    while True:
+        data = reader.read(256 * 1024)
+        if not data:
+            break
+        chunks.append(data)
+    reader.close()
+    download.join()
+    assert b"".join(chunks) == DATA
+
+
+def test_max_bytes_rejects_known_size_before_download(server, tmp_path):
+    download = ingest.RangedDownload(server.url, str(tmp_path / "input"), len(DATA), server.ranges, max_bytes=MB)
+    with pytest.raises(ingest.InputTooLarge):
+        download.start()
+    assert server.requests == []
+
+
+def test_max_bytes_stops_unknown_size_stream(server, tmp_path):
+    download = ingest.RangedDownload(server.url, str(tmp_path / "input"), None, False, max_bytes=MB)
+    download.start()
+    with pytest.raises(ingest.InputTooLarge):
+        download.join()
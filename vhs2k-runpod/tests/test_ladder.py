@@ -0,0 +1,73 @@
+import types
+
+import pytest
+
+import pipeline
+import progress
+from config import Config
+
+X265 = ["-c:v", "libx265", "-crf", "22", "-preset", "medium"]
+META = {"streams": [{"codec_type": "video", "avg_frame_rate": "30000/1001"}]}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(Config, "LADDER_RUNGS", "1080,720,480")
+    monkeypatch.setattr(Config, "LADDER_SEGMENT_SECONDS", 4)
+    monkeypatch.setattr(Config, "LADDER_MAX_BPP", 0.1)
+
+
+def option(cmd, name):
+    return cmd[cmd.index(name) + 1]
+
+
+def test_rungs_keep_the_aspect_below_the_target(monkeypatch):
+    assert pipeline.ladder_renditions((1920, 1080)) == [(1920, 1080), (1280, 720), (854, 480)]
+    assert pipeline.ladder_renditions((1440, 1080)) == [(1440, 1080), (960, 720), (640, 480)]
+    monkeypatch.setattr(Config, "LADDER_RUNGS", "2160,x,721,480")
+    # Rungs at or above the target and malformed entries are dropped; heights stay even
+    assert pipeline.ladder_renditions((1280, 720)) == [(1280, 720), (854, 480)]
+
+
+def test_spec_only_for_ladder_containers():
+    hevc = types.SimpleNamespace(codec="h265")
+    params = {"container": "hls", "target_wh": (1440, 1080)}
+    spec = pipeline.ladder_spec(params, META, "bwdif,eq", hevc)
+    # bwdif sends one frame per field, so the ladder runs at 59.94 fps
+    assert spec["fps"] == pytest.approx(60000 / 1001.0) and spec["tag"] == "hvc1"
+    assert pipeline.ladder_spec(dict(params, container="dash"), META, "eq", types.SimpleNamespace(codec="h264"))["tag"] is None
+    assert pipeline.ladder_spec(dict(params, container="mp4"), META, "eq", hevc) is None
+    assert pipeline.ladder_summary(spec) == {"container": "hls", "manifest": "master.m3u8", "segment_seconds": 4,
+                                             "renditions": ["1440x1080", "960x720", "640x480"]}
+
+
+def ladder(container="hls"):
+    return {"container": container, "renditions": [(1440, 1080), (960, 720)], "fps": 30000 / 1001.0, "tag": "hvc1"}
+
+
+def test_hls_ladder_is_one_decode_with_aligned_keyframes():
+    audio = {"same_input": True, "path": "/in/tape.mkv", "args": ["-c:a", "aac"]}
+    cmd = pipeline.build_ladder_cmd(["-i", "/in/tape.mkv"], audio, ladder(), X265, "/out/pkg", prefilter="yadif,eq")
+    assert cmd.count("-i") == 1
+    assert option(cmd, "-filter_complex").startswith("[0:v]yadif,eq,split=2[s0][s1];[s0]scale=1440:1080:")
+    for i, (w, h) in enumerate([(1440, 1080), (960, 720)]):
+        # Every option is pinned to its own rendition's stream
+        assert option(cmd, "-crf:v:%d" % i) == "22" and option(cmd, "-g:v:%d" % i) == "120"
+        assert option(cmd, "-force_key_frames:v:%d" % i) == "expr:gte(t,n_forced*4)"
+        assert option(cmd, "-maxrate:v:%d" % i) == str(int(w * h * 30000 / 1001.0 * 0.1))
+        assert option(cmd, "-tag:v:%d" % i) == "hvc1" and option(cmd, "-colorspace:v:%d" % i) == "bt709"
+    assert option(cmd, "-var_stream_map") == "a:0,agroup:audio v:0,agroup:audio v:1,agroup:audio"
+    assert option(cmd, "-master_pl_name") == "master.m3u8" and cmd[-1] == "/out/pkg/stream_%v/index.m3u8"
+
+
+def test_dash_ladder_without_audio():
+    cmd = pipeline.build_ladder_cmd(["-i", "/in/tape.mkv"], None, ladder("dash"), X265, "/out/pkg")
+    assert option(cmd, "-filter_complex").startswith("[0:v]split=2")
+    assert option(cmd, "-adaptation_sets") == "id=0,streams=v" and "-var_stream_map" not in cmd
+    assert "0:a:0" not in cmd and cmd[-1] == "/out/pkg/manifest.mpd"
+
+
+def test_ladder_requests_drop_single_file_modes():
+    params = pipeline.resolve_params({"container": "hls", "segmented": True, "live_upload": True}, progress.JobLog())
+    assert not params["segmented"] and not params["live_upload"]
+    assert pipeline.resolve_params({"container": "mp4", "segmented": True}, progress.JobLog())["segmented"]
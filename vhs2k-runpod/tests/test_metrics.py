@@ -0,0 +1,94 @@
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import metrics
+import progress
+
+
+def spawn(code):
+    return subprocess.Popen([sys.executable, "-c", code])
+
+
+def test_wait_child_keeps_the_rusage():
+    proc = spawn("import sys; x = bytearray(64 << 20); sum(range(3000000)); sys.exit(3)")
+    usage = metrics.wait_child(proc, 60)
+    assert proc.returncode == 3
+    assert usage["cpu_sec"] > 0 and usage["peak_rss_mb"] >= 64
+    assert usage["write_bytes"] >= 0 and usage["read_bytes"] >= 0
+
+
+def test_wait_child_times_out_like_popen():
+    proc = spawn("import time; time.sleep(30)")
+    try:
+        with pytest.raises(subprocess.TimeoutExpired):
+            metrics.wait_child(proc, 0.2)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_usage_lands_in_the_innermost_stage():
+    timings = metrics.JobTimings()
+    with timings.stage("encode"):
+        timings.add_usage({"cpu_sec": 2.0, "peak_rss_mb": 50.0, "read_bytes": 10, "write_bytes": 20}, frames=30)
+        with timings.stage("upload"):
+            timings.add_bytes(read_bytes=metrics.MB)
+            # Re-entering an open stage neither nests nor double counts its wall time
+            with timings.stage("upload"):
+                timings.add_usage({"cpu_sec": 1.0})
+    timings.add_usage({"cpu_sec": 0.5})
+    stages = timings.as_dict()
+    assert stages["encode"]["cpu_sec"] == 2.0 and stages["encode"]["frames"] == 30
+    assert stages["encode"]["processes"] == 1 and stages["encode"]["peak_rss_mb"] == 50.0
+    assert stages["upload"]["read_mb"] == 1.0 and stages["upload"]["processes"] == 1
+    assert stages["other"]["cpu_sec"] == 0.5
+    assert stages["upload"]["wall_sec"] <= stages["encode"]["wall_sec"]
+    assert stages["total"]["cpu_sec"] == 3.5
+
+
+def test_merge_folds_another_process_stages():
+    timings = metrics.JobTimings()
+    worker = metrics.JobTimings()
+    with worker.stage("upscale"):
+        worker.add_usage({"cpu_sec": 1.5}, frames=12)
+    timings.merge(worker.as_dict(), "segment_")
+    timings.merge(worker.as_dict(), "segment_")
+    stages = timings.as_dict()
+    assert "segment_total" not in stages
+    assert stages["segment_upscale"]["frames"] == 24 and stages["segment_upscale"]["cpu_sec"] == 3.0
+
+
+def test_stages_are_per_thread():
+    timings = metrics.JobTimings()
+    logs = progress.JobLog(timings=timings)
+    inside, done = threading.Event(), threading.Event()
+
+    def audio():
+        with timings.stage("audio"):
+            inside.set()
+            done.wait(10)
+            timings.add_usage({"cpu_sec": 1.0})
+            logs.event("info", "audio done")
+
+    def reader():
+        # Opens no stage of its own: reports into the job thread's stage
+        timings.add_usage({"cpu_sec": 4.0})
+        logs.event("info", "reader done")
+
+    worker = threading.Thread(target=audio)
+    with timings.stage("upscale"):
+        worker.start()
+        inside.wait(10)
+        assert timings.current().name == "upscale" and logs.current_stage() == "upscale"
+        helper = threading.Thread(target=reader)
+        helper.start()
+        helper.join()
+        done.set()
+        worker.join()
+    stages = timings.as_dict()
+    assert stages["audio"]["cpu_sec"] == 1.0 and stages["upscale"]["cpu_sec"] == 4.0
+    assert dict((e["msg"], e["stage"]) for e in logs.events()) == {"audio done": "audio", "reader done": "upscale"}
+    assert timings.current() is None
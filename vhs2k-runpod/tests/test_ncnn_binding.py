@@ -0,0 +1,96 @@
+import sys
+import types
+
+import pytest
+
+import upscaler
+
+
+class FakeImage(object):
+    def __init__(self, data, w, h, channels):
+        self.data, self.wh = bytes(data), (w, h)
+
+    def get_data(self):
+        return self.data
+
+
+class FakeNet(object):
+    # Records the calls the backend makes and upscales nearest-neighbour
+    instances = []
+
+    def __init__(self, gpuid, tta):
+        self.loads, self.parameters, self.processed = [], [], 0
+        self.fail_with = None
+        FakeNet.instances.append(self)
+
+    def set_parameters(self, tilesize, scale):
+        self.parameters.append((tilesize, scale))
+
+    def load(self, param, model):
+        self.loads.append((param, model))
+
+    def process(self, src, dst):
+        if self.fail_with is not None:
+            return self.fail_with
+        self.processed += 1
+        scale = dst.wh[0] // src.wh[0]
+        dst.data = upscaler.nearest_upscale(src.data, src.wh, scale)
+        return 0
+
+
+@pytest.fixture
+def binding(tmp_path, monkeypatch):
+    package = types.ModuleType("realesrgan_ncnn_py")
+    package.__file__ = str(tmp_path / "binding" / "__init__.py")
+    wrapper = types.ModuleType("realesrgan_ncnn_py.realesrgan_ncnn_vulkan_wrapper")
+    wrapper.RealESRGANWrapped, wrapper.RealESRGANImage = FakeNet, FakeImage
+    monkeypatch.setitem(sys.modules, "realesrgan_ncnn_py", package)
+    monkeypatch.setitem(sys.modules, "realesrgan_ncnn_py.realesrgan_ncnn_vulkan_wrapper", wrapper)
+    monkeypatch.setattr(upscaler.shutil, "which", lambda name: None)
+    monkeypatch.chdir(tmp_path)
+    bundled = tmp_path / "binding" / "models"
+    bundled.mkdir(parents=True)
+    for name in ("realesrgan-x4plus", "realesrgan-x2plus"):
+        (bundled / (name + ".param")).write_text("")
+    (bundled / "realesrgan-x4plus.bin").write_text("")
+    FakeNet.instances = []
+    return bundled
+
+
+def test_describe_lists_complete_models(binding):
+    info = upscaler.NcnnBindingBackend.describe()
+    assert info["available"] and info["models"] == {"realesrgan-x4plus"}
+
+
+def test_describe_without_binding(monkeypatch):
+    monkeypatch.setitem(sys.modules, "realesrgan_ncnn_py", None)
+    info = upscaler.NcnnBindingBackend.describe()
+    assert not info["available"] and "not importable" in info["error"]
+
+
+def test_model_loads_once_and_frames_stay_in_process(binding, tmp_path):
+    backend = upscaler.TilingBackend(upscaler.NcnnBindingBackend("realesrgan-x4plus", str(tmp_path)), 200, 16)
+    engine = upscaler.UpscalerEngine(backend, 2)
+    batches = [[bytes([i, j, 7]) * 48 for j in range(3)] for i in range(5)]
+    out = list(engine.upscale_stream(iter(batches), (8, 6), 4))
+    assert out == [upscaler.nearest_upscale(f, (8, 6), 4) for batch in batches for f in batch]
+    net, = FakeNet.instances
+    assert net.loads == [(str(binding / "realesrgan-x4plus.param"), str(binding / "realesrgan-x4plus.bin"))]
+    # The tile limit and the scale read from the model name are set before the load
+    assert net.parameters == [(200, 4)] and net.processed == 15
+
+
+def test_missing_model_fails_load(binding, tmp_path):
+    with pytest.raises(upscaler.UpscaleError, match="model realesrgan-x2plus not found"):
+        upscaler.NcnnBindingBackend("realesrgan-x2plus", str(tmp_path)).load()
+
+
+def test_allocation_failure_halves_the_tile(binding, tmp_path):
+    backend = upscaler.TilingBackend(upscaler.NcnnBindingBackend("realesrgan-x4plus", str(tmp_path)), 64, 8)
+    backend.load()
+    net, = FakeNet.instances
+    net.fail_with = -100
+    with pytest.raises(upscaler.UpscaleError, match="out of memory"):
+        backend.upscale([bytes(96 * 64 * 3)], (96, 64), 4)
+    assert [tile for tile, _ in net.parameters] == [64, 32]
+    assert len(net.loads) == 1
@@ -0,0 +1,63 @@
+import pytest
+
+import capabilities
+import pipeline
+import progress
+from config import Config
+
+NTSC = {"streams": [{"codec_type": "video", "width": 720, "height": 480}]}
+
+
+@pytest.fixture(autouse=True)
+def worker(monkeypatch):
+    monkeypatch.setattr(Config, "DEFAULT_MODEL", "realesrgan-x2plus")
+    monkeypatch.setattr(Config, "PLANNER_RESIZE_SLACK", 1.5)
+    caps = capabilities.WorkerCapabilities(upscaler={"available": True, "models": {"realesrgan-x2plus", "realesrgan-x4plus"}})
+    monkeypatch.setattr(capabilities, "_capabilities", caps)
+    return caps
+
+
+def plan(target_wh, model=None, profile=None, meta=NTSC):
+    params = {"target_wh": target_wh, "model": model, "profile": profile}
+    return pipeline.plan_stages(meta, params, progress.JobLog())
+
+
+def test_target_within_the_source_skips_the_upscaler():
+    result = plan((640, 480))
+    assert result["stages"] == ["encode"] and result["fold_filters"]
+    assert not result["upscale"] and result["model"] is None
+
+
+def test_fast_preview_skips_the_upscaler():
+    assert plan((1920, 1080), profile="fast_preview")["stages"] == ["encode"]
+
+
+def test_smallest_model_that_reaches_the_target():
+    # x2.67 is within the resize slack of an x2 model; x5.3 needs x4
+    hd = plan((1920, 1080))
+    assert (hd["model"], hd["scale"], hd["required_scale"]) == ("realesrgan-x2plus", 2, 2.667)
+    assert hd["stages"] == ["preprocess", "upscale", "encode"] and not hd["fold_filters"]
+    uhd = plan((3840, 2160))
+    assert (uhd["model"], uhd["scale"]) == ("realesrgan-x4plus", 4)
+
+
+def test_requested_model_wins_even_when_not_needed():
+    result = plan((640, 480), model="realesrgan-x4plus")
+    assert result["upscale"] and result["scale"] == 4 and result["reason"] == "model requested"
+
+
+def test_upscale_needs_a_working_backend_and_model(worker):
+    with pytest.raises(pipeline.PipelineError) as exc:
+        plan((1920, 1080), model="realesrgan-x4plus-anime")
+    assert exc.value.code == pipeline.ERR_UPSCALE
+    worker.upscaler["available"] = False
+    with pytest.raises(pipeline.PipelineError):
+        plan((1920, 1080))
+    # Encode-only plans never touch the upscaler
+    assert plan((640, 480))["stages"] == ["encode"]
+
+
+def test_missing_dimensions_fail_the_probe():
+    with pytest.raises(pipeline.PipelineError) as exc:
+        plan((1920, 1080), meta={"streams": [{"codec_type": "video"}]})
+    assert exc.value.code == pipeline.ERR_INPUT_PROBE
@@ -0,0 +1,69 @@
+import pytest
+
+import pipeline
+import preview
+import progress
+from config import Config
+
+
+def options(**overrides):
+    result = {"windows": 4, "seconds": 5.0, "offsets": None, "select": "even", "output": "clips"}
+    result.update(overrides)
+    return result
+
+
+def test_windows_are_centred_in_equal_slices():
+    assert preview.plan_windows(400.0, options()) == [47.5, 147.5, 247.5, 347.5]
+    # Near the ends a window is clamped so it still lies fully inside the tape
+    assert preview.plan_windows(12.0, options(windows=2, seconds=5.0)) == [0.5, 6.5]
+    assert preview.plan_windows(9.0, options(windows=3, seconds=5.0)) == [0.0, 2.0, 4.0]
+
+
+def test_short_or_unknown_duration_gets_one_window():
+    assert preview.plan_windows(4.0, options()) == [0.0]
+    assert preview.plan_windows(0.0, options()) == [0.0]
+
+
+def test_offsets_are_clamped_and_deduplicated():
+    assert preview.plan_windows(100.0, options(offsets=[10, 97, 120, 10.0004])) == [10.0, 95.0]
+    # Without a duration the offsets are taken as given
+    assert preview.plan_windows(0.0, options(offsets=[30, 5])) == [30.0, 5.0]
+
+
+def test_window_snaps_to_the_nearest_cut_that_fits(monkeypatch):
+    searched = []
+
+    def cuts(source, threshold, logs, start, duration):
+        searched.append((start, duration))
+        return [c for c in (20.0, 112.0, 131.0, 196.0) if start <= c <= start + duration]
+
+    monkeypatch.setattr(preview, "detect_scene_cuts", cuts)
+    logs = progress.JobLog()
+    assert preview._snap_to_scene("/in/tape", 120.0, 5.0, 400.0, logs) == 112.0
+    assert searched == [(90.0, 60.0)]
+    # 196 + 5 s runs past the end, so the window stays put
+    assert preview._snap_to_scene("/in/tape", 190.0, 5.0, 200.0, logs) == 190.0
+
+
+def test_failed_scene_search_keeps_the_offset(monkeypatch):
+    def broken(source, threshold, logs, start, duration):
+        raise pipeline.PipelineError(pipeline.ERR_ENCODE, "Processing failed", logs)
+
+    monkeypatch.setattr(preview, "detect_scene_cuts", broken)
+    assert preview._snap_to_scene("/in/tape", 10.0, 5.0, 400.0, progress.JobLog()) == 10.0
+
+
+def test_options_default_from_config(monkeypatch):
+    monkeypatch.setattr(Config, "PREVIEW_WINDOWS", 3)
+    monkeypatch.setattr(Config, "PREVIEW_OUTPUT", "both")
+    assert preview.preview_options({"preview": True}, progress.JobLog()) == options(windows=3, output="both")
+
+
+@pytest.mark.parametrize("request_fields", [
+    {"preview_windows": 0}, {"preview_windows": True}, {"preview_seconds": 90}, {"preview_seconds": "x"},
+    {"preview_offsets": []}, {"preview_offsets": [-1]}, {"preview_select": "random"}, {"preview_output": "gif"},
+])
+def test_invalid_options(request_fields):
+    with pytest.raises(pipeline.PipelineError) as exc:
+        preview.preview_options(request_fields, progress.JobLog())
+    assert exc.value.code == pipeline.ERR_VALIDATION
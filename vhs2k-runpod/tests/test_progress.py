@@ -0,0 +1,167 @@
+import io
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+import metrics
+import pipeline
+import progress
+from config import Config
+
+# Stands in for ffmpeg: prints a -progress feed to the fd it is given and a lot of stderr
+FAKE_FFMPEG = """#!%s
+import os, sys
+args = sys.argv[1:]
+if "-progress" in args:
+    fd = int(args[args.index("-progress") + 1].split(":")[1])
+    for frame in (30, 60):
+        os.write(fd, ("frame=%%d\\nfps=29.97\\nout_time_us=%%d\\nspeed=2.0x\\nprogress=continue\\n" %% (frame, frame * 33366)).encode())
+    os.write(fd, b"frame=90\\nfps=30\\nout_time_us=3003000\\nspeed=2.5x\\nprogress=end\\n")
+    os.close(fd)
+for i in range(2000):
+    sys.stderr.write("line %%05d\\n" %% i)
+sys.stderr.write(os.environ.get("FAKE_ERROR", ""))
+sys.exit(int(os.environ.get("FAKE_EXIT", "0")))
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path, monkeypatch):
+    path = tmp_path / "ffmpeg"
+    path.write_text(FAKE_FFMPEG % sys.executable)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(Config, "STDERR_TAIL_BYTES", 1024)
+    return str(path)
+
+
+def test_tail_buffer_keeps_the_last_bytes():
+    buf = progress.TailBuffer(1024)
+    for i in range(100):
+        buf.write(b"%04d" % i * 16)
+    value = buf.getvalue()
+    assert len(value) == 1024 and value.endswith(b"0099" * 16)
+
+
+def test_stderr_is_bounded_unless_the_caller_parses_it(ffmpeg):
+    result = pipeline._run_streaming([ffmpeg], 30)
+    assert len(result.stderr) == 1024 and result.stderr.endswith(b"line 01999\n")
+    full = pipeline._run_streaming([ffmpeg], 30, keep_stderr=True)
+    assert full.stderr.startswith(b"line 00000\n") and len(full.stderr) == 2000 * 11
+
+
+def test_progress_feed_updates_the_stage(ffmpeg):
+    payloads = []
+    reporter = progress.ProgressReporter(sink=payloads.append, interval=3600)
+    reporter.duration = 6.006
+    logs = progress.JobLog(reporter=reporter)
+    pipeline.run_cmd([ffmpeg], 30, logs, "encode", pipeline.ERR_ENCODE)
+    tracker = reporter.stages["encode"]
+    assert (tracker.frames, tracker.fps, tracker.speed) == (90, 30.0, 2.5)
+    # Throttled to the first update plus the forced final one
+    assert len(payloads) == 2 and payloads[-1]["percent"] == 50.0 and payloads[-1]["eta_sec"] == 1
+    assert "encode: 90 frames at 30.0 fps (2.50x)" in [e["msg"] for e in logs.events()]
+
+
+def test_failure_logs_the_stderr_tail(ffmpeg, monkeypatch):
+    logs = progress.JobLog()
+    monkeypatch.setenv("FAKE_EXIT", "1")
+    with pytest.raises(pipeline.PipelineError) as exc:
+        pipeline.run_cmd([ffmpeg], 30, logs, "encode", pipeline.ERR_ENCODE)
+    assert exc.value.code == pipeline.ERR_ENCODE
+    failed = [e for e in logs.events() if e["msg"] == "encode failed"][0]
+    assert failed["level"] == "error" and failed["detail"].endswith("line 01999\n")
+    monkeypatch.setenv("FAKE_ERROR", "av_interleaved_write_frame(): No space left on device\n")
+    with pytest.raises(pipeline.PipelineError) as exc:
+        pipeline.run_cmd([ffmpeg], 30, logs, "encode", pipeline.ERR_ENCODE)
+    assert exc.value.code == pipeline.ERR_DISK_SPACE
+
+
+def test_timeout_is_a_stage_error(tmp_path):
+    with pytest.raises(pipeline.PipelineError) as exc:
+        pipeline.run_cmd([sys.executable, "-c", "import time; time.sleep(30)"], 0.5, progress.JobLog(), "upscale", pipeline.ERR_UPSCALE)
+    assert exc.value.code == pipeline.ERR_UPSCALE and exc.value.message == "Stage timeout"
+
+
+def test_progress_blocks_without_a_feed():
+    tracker = progress.ProgressReporter().stage("segments")
+    tracker.consume(io.BytesIO(b"garbage\nframe=12\nout_time_ms=500000\nprogress=end\n"))
+    assert tracker.frames == 12 and tracker.out_time == 0.5
+    tracker.update(done=1, total=4)
+    assert tracker.snapshot()["percent"] == 25.0
+
+
+def test_stderr_tail_of_a_log_file(tmp_path):
+    path = tmp_path / "upscale.log"
+    path.write_bytes(b"x" * 5000 + b"vkCreateDevice failed")
+    assert pipeline._stderr_tail(str(path), 100).endswith("vkCreateDevice failed")
+    assert len(pipeline._stderr_tail(str(path), 100)) == 100
+    assert pipeline._stderr_tail(os.path.join(str(tmp_path), "missing")) == ""
+
+
+@pytest.fixture
+def log_settings(monkeypatch, tmp_path):
+    for name, value in (("LOG_LEVEL", "info"), ("LOG_STAGE_EVENTS", 3), ("LOG_DETAIL_CHARS", 10),
+                        ("LOG_DIR", str(tmp_path / "logs")), ("LOG_RETENTION_HOURS", 72.0), ("LOG_DIR_MAX_MB", 0),
+                        ("S3_ENDPOINT", ""), ("S3_BUCKET", "")):
+        monkeypatch.setattr(Config, name, value)
+    return tmp_path / "logs"
+
+
+def test_each_stage_keeps_its_latest_events(log_settings):
+    logs = progress.JobLog()
+    for i in range(5):
+        logs.event("info", "download %d" % i, "download", t=100 + i)
+    logs.event("info", "encode", "encode", t=50)
+    # A chatty stage cannot push out another stage's events
+    assert [e["msg"] for e in logs.events()] == ["encode", "download 2", "download 3", "download 4"]
+    assert logs.dropped == 2
+
+
+def test_events_below_log_level_are_not_kept(log_settings, monkeypatch):
+    monkeypatch.setattr(Config, "LOG_LEVEL", "warning")
+    logs = progress.JobLog()
+    logs.event("debug", "noise", "x")
+    logs.event("info", "progress", "x")
+    logs.event("error", "broken", "x")
+    assert [e["level"] for e in logs.events()] == ["error"] and logs.dropped == 0
+
+
+def test_spill_keeps_everything_the_buffer_trims(log_settings):
+    logs = progress.JobLog(spill_dir=str(log_settings))
+    for i in range(5):
+        logs.event("info", "line %d" % i, "encode", detail="x" * 20 + str(i) if i == 4 else None)
+    assert logs.events()[-1]["detail"] == "x" * 9 + "4"
+    path = logs.close()
+    logs.event("info", "after close", "encode")
+    with open(path) as f:
+        spilled = [json.loads(line) for line in f]
+    assert [e["msg"] for e in spilled] == ["line %d" % i for i in range(5)]
+    assert spilled[-1]["detail"] == "x" * 20 + "4"
+
+
+def test_events_are_tagged_with_the_open_stage(log_settings):
+    logs = progress.JobLog(timings=metrics.JobTimings())
+    pipeline.log_line(logs, "outside")
+    with logs.timings.stage("encode"):
+        pipeline.log_line(logs, "inside")
+    logs.merge([{"t": 1.0, "level": "info", "stage": "encode", "msg": "from a worker"}], prefix="seg0:")
+    assert [(e["stage"], e["msg"]) for e in logs.events()] == [
+        ("seg0:encode", "from a worker"), ("job", "outside"), ("encode", "inside")]
+
+
+def test_job_entry_publishes_the_log_even_on_failure(log_settings):
+    @pipeline.job_entry
+    def failing(request, logs):
+        pipeline.log_line(logs, "started")
+        raise ValueError("boom")
+
+    with pytest.raises(pipeline.PipelineError) as exc:
+        failing({})
+    logs = exc.value.logs
+    assert exc.value.code == pipeline.ERR_INTERNAL
+    assert [e["msg"] for e in logs.events()] == ["started", "Unhandled error: boom"]
+    assert logs.log_url == "file://" + logs.spill_path and os.path.dirname(logs.spill_path) == str(log_settings)
+    assert pipeline.publish_log(progress.JobLog()) is None
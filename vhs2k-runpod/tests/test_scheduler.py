@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+GB = scheduler.GB
+
+
+@pytest.fixture(autouse=True)
+def cores(monkeypatch):
+    monkeypatch.setattr(scheduler, "available_cores", lambda: 8)
+
+
+def make(free_gb=100.0, max_jobs=4, cores_per_job=2, min_free_gb=0, timeout=0.3, pools=None):
+    sched = scheduler.Scheduler(pools or {"cpu": 1, "gpu": 1}, ["/"], max_jobs, cores_per_job,
+                                int(min_free_gb * GB), timeout)
+    sched.free_bytes = lambda: None if free_gb is None else int(free_gb * GB)
+    return sched
+
+
+def test_available_cores_honours_the_cgroup_quota(monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setattr(scheduler.os, "sched_getaffinity", lambda pid: set(range(64)))
+    monkeypatch.setattr(scheduler, "cgroup_cpu_quota", lambda: 3.5)
+    assert scheduler.available_cores() == 4
+    monkeypatch.setattr(scheduler, "cgroup_cpu_quota", lambda: None)
+    assert scheduler.available_cores() == 64
+
+
+def test_job_limit_follows_cores_and_max_jobs():
+    assert make(cores_per_job=3).job_limit() == 2
+    assert make(max_jobs=1).job_limit() == 1
+    assert make(cores_per_job=16).job_limit() == 1
+
+
+def test_pool_slots_are_handed_out_in_arrival_order():
+    pool = scheduler.ResourcePool("cpu", 1)
+    pool.acquire()
+    order = []
+
+    def wait(name):
+        pool.acquire()
+        order.append(name)
+        pool.release()
+
+    threads = []
+    for name in ("first", "second", "third"):
+        threads.append(threading.Thread(target=wait, args=(name,)))
+        threads[-1].start()
+        while pool.snapshot()["waiting"] < len(threads):
+            time.sleep(0.01)
+    pool.release()
+    for t in threads:
+        t.join()
+    assert order == ["first", "second", "third"] and pool.snapshot() == {"size": 1, "in_use": 0, "waiting": 0}
+
+
+def test_stage_slots_are_held_only_inside_the_stage():
+    sched = make()
+    with sched.slot("gpu", "cpu", "cpu") as waited:
+        pools = sched.snapshot()["pools"]
+        assert pools["cpu"]["in_use"] == 1 and pools["gpu"]["in_use"] == 1 and waited >= 0
+    assert all(p["in_use"] == 0 for p in sched.snapshot()["pools"].values())
+
+
+def test_admission_waits_for_a_running_job_to_finish():
+    sched = make(max_jobs=1, timeout=5)
+    admitted = []
+
+    def second_job():
+        with sched.admit(GB) as admission:
+            admitted.append(admission.waited)
+
+    with sched.admit(GB):
+        t = threading.Thread(target=second_job)
+        t.start()
+        time.sleep(0.2)
+        assert not admitted and sched.snapshot()["jobs"] == 1
+    t.join()
+    assert admitted[0] >= 0.2
+
+
+def test_admission_times_out_when_the_worker_stays_busy():
+    sched = make(max_jobs=1)
+    with sched.admit(GB):
+        with pytest.raises(scheduler.AdmissionError) as exc:
+            with sched.admit(GB):
+                pass
+    assert not isinstance(exc.value, scheduler.DiskSpaceError)
+
+
+def test_disk_reservations():
+    sched = make(free_gb=10, min_free_gb=2)
+    with pytest.raises(scheduler.DiskSpaceError):
+        with sched.admit(9 * GB):
+            pass
+    with sched.admit(5 * GB) as first:
+        assert sched.headroom_bytes() == 3 * GB
+        # A second job waits for the first reservation rather than overcommitting the disk
+        with pytest.raises(scheduler.AdmissionError):
+            with sched.admit(4 * GB):
+                pass
+        first.resize(6 * GB)
+        assert sched.headroom_bytes() == 2 * GB
+        with pytest.raises(scheduler.DiskSpaceError):
+            first.resize(9 * GB)
+    assert sched.headroom_bytes() == 8 * GB
+
+
+def test_target_concurrency_drops_when_disk_is_spoken_for():
+    sched = make(free_gb=10)
+    assert sched.target_concurrency() == 4
+    with sched.admit(10 * GB):
+        assert sched.target_concurrency() == 1
+    assert make(free_gb=None).target_concurrency() == 4
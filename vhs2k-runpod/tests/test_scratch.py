@@ -0,0 +1,130 @@
+import os
+import socket
+import time
+
+import pytest
+
+import scratch
+from config import Config
+
+
+@pytest.fixture
+def volume(monkeypatch, tmp_path):
+    settings = {
+        "WORK_DIR": str(tmp_path / "jobs"),
+        "TMP_DIR": str(tmp_path / "tmp"),
+        "LOG_DIR": str(tmp_path / "logs"),
+        "CACHE_DIR": str(tmp_path / "tmp" / "cache"),
+        "CLEANUP_TEMP": True,
+        "KEEP_INTERMEDIATES": False,
+        "SCRATCH_STALE_HOURS": 24,
+        "LOG_RETENTION_HOURS": 72,
+        "LOG_DIR_MAX_MB": 0,
+        "S3_ENDPOINT": "",
+        "S3_BUCKET": "",
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    for name in ("WORK_DIR", "TMP_DIR", "LOG_DIR", "CACHE_DIR"):
+        os.makedirs(settings[name], exist_ok=True)
+    return tmp_path
+
+
+def run_job(job_id, resumable=False, uploaded=False, fail=False):
+    try:
+        with scratch.job_space(job_id, resumable) as space:
+            for path in (os.path.join(space.work_dir, "final.mp4"), os.path.join(space.tmp_dir, "input"),
+                         os.path.join(space.work_dir, scratch.RESUME_MANIFEST)):
+                with open(path, "w") as f:
+                    f.write("x")
+            space.uploaded = uploaded
+            if fail:
+                raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    return os.path.join(Config.WORK_DIR, job_id), os.path.join(Config.TMP_DIR, job_id)
+
+
+def test_success_keeps_local_outputs_without_s3(volume):
+    work, tmp = run_job("a")
+    assert os.path.exists(os.path.join(work, "final.mp4")) and not os.path.exists(tmp)
+
+
+def test_success_after_upload_drops_the_work_dir(volume):
+    work, tmp = run_job("a", uploaded=True)
+    assert not os.path.exists(work) and not os.path.exists(tmp)
+
+
+def test_resumable_upload_keeps_only_the_manifest(volume):
+    work, tmp = run_job("a", resumable=True, uploaded=True)
+    assert sorted(os.listdir(work)) == sorted([scratch.LOCK_NAME, scratch.RESUME_MANIFEST])
+    assert not os.path.exists(tmp)
+
+
+def test_failures(volume):
+    work, tmp = run_job("a", fail=True)
+    assert not os.path.exists(work) and not os.path.exists(tmp)
+    work, tmp = run_job("b", resumable=True, fail=True)
+    assert os.path.exists(os.path.join(work, "final.mp4")) and os.path.exists(os.path.join(tmp, "input"))
+
+
+def test_keep_intermediates_keeps_everything(volume, monkeypatch):
+    monkeypatch.setattr(Config, "KEEP_INTERMEDIATES", True)
+    work, tmp = run_job("a", uploaded=True)
+    assert os.path.exists(work) and os.path.exists(tmp)
+
+
+def leftover(root, name, owner=None, age_hours=0):
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    with open(os.path.join(path, "data"), "w") as f:
+        f.write("x" * 4096)
+    if owner:
+        with open(os.path.join(path, scratch.LOCK_NAME), "w") as f:
+            f.write("%s 1 %s\n" % owner)
+    stamp = time.time() - age_hours * 3600
+    for entry in [path] + [os.path.join(path, n) for n in os.listdir(path)]:
+        os.utime(entry, (stamp, stamp))
+    return path
+
+
+def test_sweep_stale(volume, monkeypatch):
+    host = socket.gethostname()
+    dead = leftover(Config.TMP_DIR, "dead", (host, "scratch"))
+    kept = leftover(Config.TMP_DIR, "resumable", (host, "resumable"), age_hours=1)
+    old = leftover(Config.TMP_DIR, "old", (host, "resumable"), age_hours=48)
+    foreign = leftover(Config.TMP_DIR, "foreign", ("other-host", "scratch"), age_hours=1)
+    work = leftover(Config.WORK_DIR, "work", (host, "scratch"))
+    with scratch.job_space("running") as space:
+        removed, freed = scratch.sweep_stale()
+        assert os.path.exists(space.tmp_dir)
+    assert removed == 2 and freed > 0
+    assert not os.path.exists(dead) and not os.path.exists(old)
+    assert os.path.exists(kept) and os.path.exists(foreign) and os.path.exists(Config.CACHE_DIR)
+    # Work dirs hold file:// outputs until S3 is configured
+    assert os.path.exists(work)
+    monkeypatch.setattr(Config, "S3_ENDPOINT", "https://s3.example")
+    monkeypatch.setattr(Config, "S3_BUCKET", "b")
+    scratch.sweep_stale()
+    assert not os.path.exists(work)
+
+
+def write_log(name, size, age_hours):
+    path = os.path.join(Config.LOG_DIR, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    stamp = time.time() - age_hours * 3600
+    os.utime(path, (stamp, stamp))
+    return path
+
+
+def test_prune_logs_by_age_then_size(volume, monkeypatch):
+    expired = write_log("expired.jsonl", 100, 100)
+    oldest = write_log("oldest.jsonl", 600 * 1024, 3)
+    newer = write_log("newer.jsonl", 600 * 1024, 2)
+    newest = write_log("newest.jsonl", 100, 1)
+    other = write_log("notes.txt", 100, 100)
+    monkeypatch.setattr(Config, "LOG_DIR_MAX_MB", 1)
+    removed, freed = scratch.prune_logs()
+    assert (removed, freed) == (2, 100 + 600 * 1024)
+    assert [os.path.exists(p) for p in (expired, oldest, newer, newest, other)] == [False, False, True, True, True]
@@ -0,0 +1,39 @@
+import pytest
+
+import pipeline
+from config import Config
+
+
+def meta(duration):
+    return {"format": {"duration": str(duration)}}
+
+
+@pytest.fixture(autouse=True)
+def segment_seconds(monkeypatch):
+    monkeypatch.setattr(Config, "SEGMENT_SECONDS", 60)
+
+
+@pytest.mark.parametrize("duration,count", [(0, 1), (90, 1), (91, 2), (600, 10), (601, 11)])
+def test_segment_count(duration, count):
+    assert pipeline.plan_segment_count(meta(duration)) == count
+
+
+def test_boundaries_without_cuts_are_nominal():
+    assert pipeline.plan_segment_times(meta(200), []) == [60.0, 120.0]
+
+
+def test_boundaries_snap_to_the_nearest_cut_within_half_a_segment():
+    cuts = [10.0, 55.0, 70.0, 151.0, 179.0, 185.0]
+    # 60 -> 55 (nearer than 70); 120 has no cut within 30 s; 180 -> 179
+    assert pipeline.plan_segment_times(meta(260), cuts) == [55.0, 120.0, 179.0]
+
+
+def test_boundaries_stay_ordered_and_apart():
+    # Both nominal boundaries would snap to the same cut; the second one is dropped
+    assert pipeline.plan_segment_times(meta(200), [89.0, 90.0]) == [89.0]
+
+
+def test_no_boundary_in_the_last_half_segment():
+    assert pipeline.plan_segment_times(meta(151), [125.0]) == [60.0, 125.0]
+    assert pipeline.plan_segment_times(meta(150), [125.0]) == [60.0]
+    assert pipeline.plan_segment_times(meta(149), []) == [60.0]
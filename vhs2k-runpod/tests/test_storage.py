@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import pipeline
+import progress
+import storage
+from config import Config
+
+MB = 1024 * 1024
+BUCKET = "vhs2k-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    settings = {
+        "S3_ENDPOINT": "https://s3.us-east-1.amazonaws.com",
+        "S3_REGION": "us-east-1",
+        "S3_BUCKET": BUCKET,
+        "S3_ACCESS_KEY_ID": "testing",
+        "S3_SECRET_ACCESS_KEY": "testing",
+        "S3_PART_MB": 5,
+        "S3_MAX_CONCURRENCY": 2,
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    monkeypatch.setattr(storage, "POLL_SECONDS", 0.01)
+    monkeypatch.setattr(storage, "_client", None)
+    with moto.mock_aws():
+        client = storage.get_s3_client()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    storage._client = None
+
+
+def write_slowly(path, data, chunk=MB, pause=0.02):
+    with open(path, "wb") as f:
+        for i in range(0, len(data), chunk):
+            f.write(data[i:i + chunk])
+            f.flush()
+            time.sleep(pause)
+
+
+def read_object(client, key):
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_growing_upload_sends_parts_while_the_file_grows(s3, tmp_path):
+    path = str(tmp_path / "final.mp4")
+    data = os.urandom(12 * MB + 777)
+    open(path, "wb").close()
+    upload = storage.GrowingUpload(path, "vhs2k/final.mp4", 60).start()
+    writer = threading.Thread(target=write_slowly, args=(path, data))
+    writer.start()
+    writer.join()
+    upload.finish()
+    assert read_object(s3, "vhs2k/final.mp4") == data
+    assert upload.uploaded_bytes == len(data)
+    # Two full 5 MB parts and the tail
+    assert s3.head_object(Bucket=BUCKET, Key="vhs2k/final.mp4")["ETag"].strip('"').endswith("-3")
+
+
+def test_replaced_file_restarts_the_upload(s3, tmp_path):
+    path = str(tmp_path / "final.mkv")
+    with open(path, "wb") as f:
+        f.write(os.urandom(6 * MB))
+    upload = storage.GrowingUpload(path, "vhs2k/final.mkv", 60).start()
+    time.sleep(0.3)
+    # A stage retry writes a new file under the same name
+    retry = os.urandom(7 * MB)
+    os.remove(path)
+    write_slowly(path, retry)
+    upload.finish()
+    assert read_object(s3, "vhs2k/final.mkv") == retry
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+
+def test_empty_output_completes_as_an_empty_object(s3, tmp_path):
+    path = str(tmp_path / "empty.mp4")
+    open(path, "wb").close()
+    upload = storage.GrowingUpload(path, "vhs2k/empty.mp4", 60).start()
+    upload.finish()
+    assert read_object(s3, "vhs2k/empty.mp4") == b""
+
+
+def test_abort_leaves_no_object_or_open_upload(s3, tmp_path):
+    path = str(tmp_path / "final.mp4")
+    with open(path, "wb") as f:
+        f.write(os.urandom(6 * MB))
+    upload = storage.GrowingUpload(path, "vhs2k/final.mp4", 60).start()
+    time.sleep(0.3)
+    upload.abort()
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+
+def test_upload_files_keeps_the_tree_layout(s3, tmp_path):
+    root = tmp_path / "job"
+    (root / "stream_0").mkdir(parents=True)
+    (root / "master.m3u8").write_bytes(b"#EXTM3U\n")
+    (root / "stream_0" / "seg_00000.m4s").write_bytes(os.urandom(6 * MB))
+    uploads = storage.tree_keys("job", str(root))
+    storage.upload_files(uploads, 60)
+    keys = sorted(o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"])
+    assert keys == ["vhs2k/job/master.m3u8", "vhs2k/job/stream_0/seg_00000.m4s"]
+    assert read_object(s3, "vhs2k/job/stream_0/seg_00000.m4s") == (root / "stream_0" / "seg_00000.m4s").read_bytes()
+
+
+def test_keys_are_scoped_by_job(monkeypatch):
+    monkeypatch.setattr(Config, "S3_OUTPUT_PREFIX", "vhs2k/")
+    assert storage.object_key("job-a", "/w/job-a/final.mp4") == "vhs2k/job-a/final.mp4"
+    assert storage.object_key("job-a", "final.mp4") != storage.object_key("job-b", "final.mp4")
+
+
+def test_same_named_outputs_of_two_jobs_both_survive(s3, tmp_path):
+    for job_id in ("job-a", "job-b"):
+        path = tmp_path / job_id / "final.mp4"
+        path.parent.mkdir()
+        path.write_bytes(job_id.encode("ascii"))
+        storage.upload_files([(str(path), storage.object_key(job_id, str(path)))], 60)
+    assert read_object(s3, "vhs2k/job-a/final.mp4") == b"job-a"
+    assert read_object(s3, "vhs2k/job-b/final.mp4") == b"job-b"
+
+
+def test_live_upload_completes_under_the_job_key(s3, tmp_path):
+    path = tmp_path / "final.mp4"
+    path.write_bytes(b"")
+    logs = progress.JobLog()
+    upload = pipeline.start_live_upload("job-a", str(path), logs)
+    data = os.urandom(11 * MB)
+    write_slowly(str(path), data)
+    url = pipeline.upload_output("job-a", str(path), logs, live_upload=upload)
+    assert read_object(s3, "vhs2k/job-a/final.mp4") == data
+    assert "vhs2k/job-a/final.mp4" in url
+    assert "Live upload complete" in [event["msg"] for event in logs.events()]
@@ -0,0 +1,47 @@
+import types
+
+import pytest
+
+import threadbudget
+
+
+@pytest.mark.parametrize("stage,cpus,expected", [
+    ("preprocess", 8, (1, 4, 3)),
+    ("encode", 8, (2, 1, 5)),
+    ("analyze", 4, (2, 2, 0)),
+    ("upscale", 6, (2, 0, 4)),
+    # Every used part keeps a thread even when that oversubscribes a tiny budget
+    ("preprocess", 1, (1, 1, 1)),
+])
+def test_split_by_stage_weights(stage, cpus, expected):
+    split = threadbudget.split(stage, cpus)
+    assert (split.decode, split.filters, split.encode) == expected
+    assert split.as_dict() == dict(zip(("decode", "filters", "encode"), expected), cpus=cpus)
+
+
+def test_default_budget_is_the_jobs_share_of_the_pod(monkeypatch):
+    monkeypatch.setattr(threadbudget.scheduler, "available_cores", lambda: 16)
+    monkeypatch.setattr(threadbudget.scheduler, "get", lambda: types.SimpleNamespace(job_limit=lambda: 3))
+    assert threadbudget.job_cpus() == 5
+    assert threadbudget.split("direct").cpus == 5
+
+
+def test_ffmpeg_arguments():
+    split = threadbudget.split("preprocess", 8)
+    assert split.input_args() == ["-filter_threads", "4", "-threads", "1"]
+    assert split.input_args(complex_graph=True)[0] == "-filter_complex_threads"
+    assert threadbudget.split("upscale", 6).input_args() == ["-threads", "2"]
+    # The encoder share is divided between the outputs of one ffmpeg
+    assert split.encoder_args("libx265", outputs=2) == ["-x265-params", "pools=1"]
+    assert split.encoder_args("libx264") == ["-threads", "3"]
+    assert split.encoder_args("hevc_nvenc") == []
+    assert threadbudget.split("analyze", 4).encoder_args("libx264") == []
+
+
+def test_overrides(monkeypatch):
+    parsed = threadbudget.parse_splits("preprocess=1:4:2, encode=1:1:6,bogus=1:1:1,direct=1:1,analyze=0:0:0,stream=a:b:c")
+    assert parsed == {"preprocess": (1, 4, 2), "encode": (1, 1, 6)}
+    assert threadbudget.parse_splits("") == {}
+    monkeypatch.setattr(threadbudget, "_overrides", parsed)
+    split = threadbudget.split("preprocess", 9)
+    assert (split.decode, split.filters, split.encode) == (1, 5, 3)
@@ -0,0 +1,107 @@
+import pytest
+
+import upscaler
+
+
+def make_frame(wh, seed):
+    w, h = wh
+    return bytes((x * 7 + y * 13 + c * 31 + seed) % 256 for y in range(h) for x in range(w) for c in range(upscaler.BYTES_PER_PIXEL))
+
+
+class OomStub(upscaler.StubBackend):
+    # Runs out of memory on anything with a side above max_side
+    def __init__(self, model, work_root, max_side):
+        super(OomStub, self).__init__(model, work_root)
+        self.max_side = max_side
+        self.calls = []
+
+    def upscale(self, frames, in_wh, scale):
+        self.calls.append(in_wh)
+        if max(in_wh) > self.max_side:
+            raise upscaler.UpscaleError("vkAllocateMemory failed: out of memory")
+        return super(OomStub, self).upscale(frames, in_wh, scale)
+
+
+@pytest.mark.parametrize("wh,tile,overlap", [((100, 60), 32, 8), ((97, 71), 40, 16), ((64, 64), 64, 16), ((50, 30), 16, 0)])
+def test_tiled_stub_matches_whole_frame(tmp_path, wh, tile, overlap):
+    frames = [make_frame(wh, seed) for seed in (0, 1)]
+    whole = upscaler.StubBackend("m", str(tmp_path)).upscale(frames, wh, 2)
+    tiled = upscaler.TilingBackend(upscaler.StubBackend("m", str(tmp_path)), tile, overlap)
+    assert tiled.upscale(frames, wh, 2) == whole
+    assert tiled.last_tile == (tile if tile < max(wh) else None)
+
+
+@pytest.mark.parametrize("length,tile,overlap", [(720, 200, 16), (480, 200, 16), (97, 40, 16), (100, 32, 8), (1000, 64, 0)])
+def test_tile_origins_keep_the_configured_overlap(length, tile, overlap):
+    origins, side = upscaler.tile_origins(length, tile, overlap)
+    assert side <= tile and origins[0] == 0
+    assert all(b - a == side - overlap for a, b in zip(origins, origins[1:]))
+    assert length <= origins[-1] + side < length + len(origins)
+
+
+def test_sized_budget_compares_area(tmp_path):
+    backend = OomStub("m", str(tmp_path), 1000)
+    tiled = upscaler.TilingBackend(backend, 0, 8)
+    tiled.limit = 600
+    tiled.upscale([make_frame((72, 48), 0)], (72, 48), 2)
+    tiled.limit = 60
+    tiled.upscale([make_frame((72, 48), 0)], (72, 48), 2)
+    # 72x48 fits a 60x60 budget by area, so it is not tiled even though 72 > 60
+    assert backend.calls == [(72, 48), (72, 48)] and tiled.last_tile is None
+
+
+class NativeStub(OomStub):
+    native_tiling = True
+
+    def upscale(self, frames, in_wh, scale):
+        self.calls.append((in_wh, self.tile))
+        if self.tile == 0 or self.tile > self.max_side:
+            raise upscaler.UpscaleError("vkAllocateMemory failed: out of memory")
+        return upscaler.StubBackend.upscale(self, frames, in_wh, scale)
+
+
+def test_native_tiling_gets_the_limit_instead_of_cut_frames(tmp_path):
+    backend = NativeStub("m", str(tmp_path), 50)
+    tiled = upscaler.TilingBackend(backend, 128, 8)
+    out = tiled.upscale([make_frame((96, 64), 0)], (96, 64), 2)
+    assert out == upscaler.StubBackend("m", str(tmp_path)).upscale([make_frame((96, 64), 0)], (96, 64), 2)
+    # Whole frames every time; only the backend's own tile size halves
+    assert backend.calls == [((96, 64), 128), ((96, 64), 48)]
+    assert tiled.limit == 48 and tiled.last_tile == 48
+
+
+def test_out_of_memory_halves_the_tile_and_keeps_it(tmp_path):
+    wh = (128, 64)
+    frames = [make_frame(wh, 3)]
+    backend = OomStub("m", str(tmp_path), 40)
+    # Auto tiling before load(): no limit until the backend runs out of memory
+    tiled = upscaler.TilingBackend(backend, 0, 8)
+    out = tiled.upscale(frames, wh, 2)
+    assert out == upscaler.StubBackend("m", str(tmp_path)).upscale(frames, wh, 2)
+    # 128 -> 64 -> 32: the first side that fits, and it stays for the next batch
+    assert tiled.limit == 32 and tiled.oom_retries == 2
+    backend.calls = []
+    tiled.upscale(frames, wh, 2)
+    assert backend.calls and all(max(wh) <= 32 for wh in backend.calls)
+
+
+def test_out_of_memory_below_min_tile_fails(tmp_path):
+    tiled = upscaler.TilingBackend(OomStub("m", str(tmp_path), 8), 64, 8)
+    with pytest.raises(upscaler.UpscaleError, match="out of memory with"):
+        tiled.upscale([make_frame((96, 64), 0)], (96, 64), 2)
+
+
+def test_never_tile_reraises_out_of_memory(tmp_path):
+    backend = OomStub("m", str(tmp_path), 40)
+    tiled = upscaler.TilingBackend(backend, -1, 8)
+    with pytest.raises(upscaler.UpscaleError, match="out of memory"):
+        tiled.upscale([make_frame((96, 64), 0)], (96, 64), 2)
+    assert tiled.limit is None and tiled.oom_retries == 0
+    assert backend.calls == [(96, 64)]
+
+
+def test_engine_streams_batches_in_order(tmp_path):
+    engine = upscaler.UpscalerEngine(upscaler.TilingBackend(upscaler.StubBackend("m", str(tmp_path)), 16, 4), 2)
+    batches = [[make_frame((20, 12), i * 3 + j) for j in range(3)] for i in range(4)]
+    expected = [upscaler.nearest_upscale(f, (20, 12), 2) for batch in batches for f in batch]
+    assert list(engine.upscale_stream(iter(batches), (20, 12), 2)) == expected
@@ -0,0 +1,80 @@
+import encoders
+import scheduler
+from config import Config
+
+# Shares of a stage's cores for (decode, filters, encoder). Decoding SD tape is cheap;
+# the filter chain (bwdif, hqdn3d, unsharp) and the delivery encoder are the heavy parts.
+STAGE_SPLITS = {
+    "preprocess": (1, 3, 2),   # full filter chain into the near-lossless intermediate
+    "direct": (1, 2, 3),       # full filter chain and the delivery encoder in one pass
+    "encode": (1, 1, 4),       # scale of the upscaled frames and the delivery encoder
+    "upscale": (1, 0, 2),      # intermediate decode/encode around the upscaler engine
+    "stream": (1, 3, 3),       # filtered decode feeding the engine, delivery encoder after it
+    "analyze": (1, 1, 0),
+    "scene_detect": (1, 1, 0),
+}
+
+
+def parse_splits(value):
+    # THREAD_SPLITS overrides, e.g. "preprocess=1:4:2,encode=1:1:6", for tuning against bench/
+    splits = {}
+    for part in (value or "").split(","):
+        name, sep, shares = part.strip().partition("=")
+        try:
+            weights = tuple(int(s) for s in shares.split(":"))
+        except ValueError:
+            continue
+        if sep and name in STAGE_SPLITS and len(weights) == 3 and min(weights) >= 0 and sum(weights) > 0:
+            splits[name] = weights
+    return splits
+
+
+_overrides = parse_splits(Config.THREAD_SPLITS)
+
+
+def job_cpus():
+    # A job's share of the pod: the cgroup quota split across the jobs the scheduler admits
+    return max(1, scheduler.available_cores() // scheduler.get().job_limit())
+
+
+class ThreadSplit(object):
+    def __init__(self, stage, cpus, decode, filters, encode):
+        self.stage = stage
+        self.cpus = cpus
+        self.decode = decode
+        self.filters = filters
+        self.encode = encode
+
+    def input_args(self, complex_graph=False):
+        # Goes right after "ffmpeg": the filter option is global, -threads applies to the next input
+        args = []
+        if self.filters:
+            args += ["-filter_complex_threads" if complex_graph else "-filter_threads", str(self.filters)]
+        return args + ["-threads", str(self.decode)]
+
+    def encoder_args(self, encoder_name, outputs=1):
+        if not self.encode:
+            return []
+        return encoders.thread_args(encoder_name, max(1, self.encode // max(1, outputs)))
+
+    def as_dict(self):
+        return {"cpus": self.cpus, "decode": self.decode, "filters": self.filters, "encode": self.encode}
+
+
+def split(stage, cpus=None):
+    # Every part gets at least one thread; the rest goes by weight, largest share first
+    cpus = max(1, cpus or job_cpus())
+    weights = _overrides.get(stage) or STAGE_SPLITS[stage]
+    parts = [1 if w else 0 for w in weights]
+    spare = max(0, cpus - sum(parts))
+    total = float(sum(weights))
+    extra = [int(spare * w / total) for w in weights]
+    leftover = spare - sum(extra)
+    for i in sorted(range(3), key=lambda i: -weights[i]):
+        if leftover <= 0:
+            break
+        if weights[i]:
+            extra[i] += 1
+            leftover -= 1
+    decode, filters, encode = [p + e for p, e in zip(parts, extra)]
+    return ThreadSplit(stage, cpus, decode, filters, encode)
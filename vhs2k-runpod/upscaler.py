@@ -0,0 +1,650 @@
+import collections
+import importlib
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+BYTES_PER_PIXEL = 3  # frames are packed rgb24
+MIN_TILE = 32
+OOM_MARKERS = ("out of memory", "vkallocatememory", "vk_error_out_of", "bad_alloc", "exit -9", "memoryerror")
+
+
+class UpscaleError(Exception):
+    pass
+
+
+class UpscalerBackend(object):
+    # Backends upscale lists of packed rgb24 frames; load() is paid once per worker.
+    # bytes_per_pixel is the working memory per input pixel of one frame, for tile sizing.
+    # Backends with native_tiling cut frames into tiles themselves, `tile` px at most (0 = own choice).
+    name = None
+    bytes_per_pixel = 1024
+    native_tiling = False
+    tile = 0
+
+    def __init__(self, model, work_root):
+        self.model = model
+        self.work_root = work_root
+
+    @classmethod
+    def describe(cls):
+        # Worker-init probe: {"available", "error", "models"}; models None means any name is accepted
+        return {"available": True, "error": None, "models": None}
+
+    @staticmethod
+    def memory_budget():
+        return ram_available_bytes()
+
+    def load(self):
+        pass
+
+    def upscale(self, frames, in_wh, scale):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NcnnVulkanBackend(UpscalerBackend):
+    # realesrgan-ncnn-vulkan only takes image files, so each batch goes through a PNG
+    # directory; ffmpeg does the raw <-> PNG conversion.
+    name = "realesrgan-ncnn"
+    binary = "realesrgan-ncnn-vulkan"
+    # The binary's own auto tile choice: ~1.9 GB of VRAM for a 200x200 tile. It tiles on
+    # the GPU itself, so the tile size is passed through as -t rather than cut in Python.
+    bytes_per_pixel = 48 * 1024
+    native_tiling = True
+
+    @classmethod
+    def describe(cls):
+        path = shutil.which(cls.binary)
+        if not path:
+            return {"available": False, "error": "%s not found" % cls.binary, "models": None, "path": None}
+        info = {"available": True, "error": None, "path": path, "models": None}
+        try:
+            out = subprocess.run([path, "-h"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=5).stdout
+            info["usage"] = out.decode("utf-8", errors="ignore").strip().split("\n")[0][:200]
+        except Exception as exc:
+            return dict(info, available=False, error="%s -h failed: %s" % (cls.binary, exc))
+        # The binary resolves `models/<name>.param` against the cwd first, then its own directory
+        for models_dir in ("models", os.path.join(os.path.dirname(os.path.realpath(path)), "models")):
+            if os.path.isdir(models_dir):
+                info["models"] = find_models(models_dir)
+                info["models_dir"] = os.path.abspath(models_dir)
+                break
+        return info
+
+    def load(self):
+        self.path = shutil.which(self.binary)
+        if not self.path:
+            raise UpscaleError("%s not found" % self.binary)
+        self.batch_dir = tempfile.mkdtemp(prefix="upscale-", dir=self.work_root)
+
+    @staticmethod
+    def memory_budget():
+        return gpu_free_bytes() or ram_available_bytes()
+
+    def _run(self, cmd, stdin_data=None):
+        result = subprocess.run(cmd, input=stdin_data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise UpscaleError("%s failed (exit %d): %s" % (os.path.basename(cmd[0]), result.returncode, result.stderr.decode("utf-8", errors="ignore")[-2000:]))
+        return result.stdout
+
+    def upscale(self, frames, in_wh, scale):
+        w, h = in_wh
+        in_dir = os.path.join(self.batch_dir, "in")
+        out_dir = os.path.join(self.batch_dir, "out")
+        for d in (in_dir, out_dir):
+            shutil.rmtree(d, ignore_errors=True)
+            os.makedirs(d)
+        self._run([
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "%dx%d" % (w, h), "-i", "pipe:0",
+            os.path.join(in_dir, "%08d.png")
+        ], b"".join(frames))
+        self._run([
+            self.path, "-i", in_dir,
+            "-o", out_dir,
+            "-n", self.model,
+            "-s", str(scale),
+            "-t", str(self.tile),
+            "-f", "png"
+        ])
+        data = self._run([
+            "ffmpeg", "-v", "error",
+            "-i", os.path.join(out_dir, "%08d.png"),
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"
+        ])
+        return split_frames(data, (w * scale, h * scale), len(frames))
+
+    def close(self):
+        shutil.rmtree(getattr(self, "batch_dir", ""), ignore_errors=True)
+
+
+class NcnnBindingBackend(UpscalerBackend):
+    # The same ncnn Vulkan network driven in-process through the realesrgan-ncnn-py binding.
+    # load() puts the model on the GPU once per worker; frames then go in and out as raw
+    # rgb24, with no PNG round trip and no process per batch.
+    name = "realesrgan-ncnn-py"
+    module = "realesrgan_ncnn_py"
+    bytes_per_pixel = NcnnVulkanBackend.bytes_per_pixel
+    native_tiling = True
+
+    @classmethod
+    def _wrapper(cls):
+        return importlib.import_module(cls.module + ".realesrgan_ncnn_vulkan_wrapper")
+
+    @classmethod
+    def models_dirs(cls):
+        # cwd `models/` first, then the CLI's models next to the binary, then the ones bundled with the binding
+        dirs = ["models"]
+        binary = shutil.which(NcnnVulkanBackend.binary)
+        if binary:
+            dirs.append(os.path.join(os.path.dirname(os.path.realpath(binary)), "models"))
+        dirs.append(os.path.join(os.path.dirname(importlib.import_module(cls.module).__file__), "models"))
+        return [os.path.abspath(d) for d in dirs if os.path.isdir(d)]
+
+    @classmethod
+    def describe(cls):
+        try:
+            cls._wrapper()
+            dirs = cls.models_dirs()
+        except Exception as exc:
+            return {"available": False, "error": "%s not importable: %s" % (cls.module, exc), "models": None}
+        models = set()
+        for models_dir in dirs:
+            models |= find_models(models_dir)
+        return {"available": True, "error": None, "models": models, "models_dirs": dirs}
+
+    @staticmethod
+    def memory_budget():
+        return gpu_free_bytes() or ram_available_bytes()
+
+    def load(self):
+        try:
+            wrapper = self._wrapper()
+            dirs = self.models_dirs()
+        except Exception as exc:
+            raise UpscaleError("%s not importable: %s" % (self.module, exc))
+        files = next((os.path.join(d, self.model) for d in dirs if self.model in find_models(d)), None)
+        if files is None:
+            raise UpscaleError("model %s not found in %s" % (self.model, ", ".join(dirs) or "any models directory"))
+        self.net = wrapper.RealESRGANWrapped(0, False)
+        self.params = None
+        # Model names carry their scale (realesrgan-x4plus); set it now so the first batch does not wait
+        match = re.search(r"x(\d)", self.model)
+        self._set_parameters(int(match.group(1)) if match else 2)
+        self.net.load(files + ".param", files + ".bin")
+
+    def _set_parameters(self, scale):
+        # Tile size and scale are plain settings of the loaded network; changing them does not reload it
+        if self.params != (self.tile, scale):
+            self.net.set_parameters(self.tile, scale)
+            self.params = (self.tile, scale)
+
+    def upscale(self, frames, in_wh, scale):
+        w, h = in_wh
+        wrapper = self._wrapper()
+        self._set_parameters(scale)
+        out = wrapper.RealESRGANImage(bytes(w * h * BYTES_PER_PIXEL * scale * scale), w * scale, h * scale, BYTES_PER_PIXEL)
+        results = []
+        for frame in frames:
+            ret = self.net.process(wrapper.RealESRGANImage(frame, w, h, BYTES_PER_PIXEL), out)
+            if ret:
+                # ncnn returns -100 when a Vulkan allocation fails
+                raise UpscaleError("realesrgan process failed (%s)%s" % (ret, ": out of memory" if ret == -100 else ""))
+            results.append(out.get_data())
+        return results
+
+    def close(self):
+        self.net = None
+
+
+class StubBackend(UpscalerBackend):
+    # Nearest-neighbour CPU upscaler for tests and benchmarks; no GPU or model files.
+    # Its output does not depend on where a pixel sits, so tiled and whole-frame results
+    # must match byte for byte: the CPU reference for the tiling layer.
+    name = "stub"
+
+    def upscale(self, frames, in_wh, scale):
+        return [nearest_upscale(frame, in_wh, scale) for frame in frames]
+
+
+BACKENDS = {
+    NcnnBindingBackend.name: NcnnBindingBackend,
+    NcnnVulkanBackend.name: NcnnVulkanBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def find_models(models_dir):
+    # ncnn models are <name>.param + <name>.bin pairs
+    names = set(os.path.splitext(f)[0] for f in os.listdir(models_dir) if f.endswith(".param"))
+    return set(n for n in names if os.path.exists(os.path.join(models_dir, n + ".bin")))
+
+
+def split_frames(data, wh, count):
+    size = wh[0] * wh[1] * BYTES_PER_PIXEL
+    if len(data) != size * count:
+        raise UpscaleError("upscaler returned %d bytes for %d frames" % (len(data), count))
+    return [data[i * size:(i + 1) * size] for i in range(count)]
+
+
+def nearest_upscale(frame, in_wh, scale):
+    w, h = in_wh
+    if scale == 1:
+        return frame
+    row_in = w * BYTES_PER_PIXEL
+    row_out = bytearray(row_in * scale)
+    stride = BYTES_PER_PIXEL * scale
+    out = bytearray()
+    for y in range(h):
+        row = frame[y * row_in:(y + 1) * row_in]
+        for k in range(scale):
+            for c in range(BYTES_PER_PIXEL):
+                row_out[k * BYTES_PER_PIXEL + c::stride] = row[c::BYTES_PER_PIXEL]
+        out += bytes(row_out) * scale
+    return bytes(out)
+
+
+def gpu_free_bytes():
+    try:
+        out = subprocess.check_output(
+            ["nvidia-smi", "--query-gpu=memory.free", "--format=csv,noheader,nounits"],
+            stderr=subprocess.DEVNULL, timeout=10)
+        return int(out.decode("utf-8").split()[0]) * 1024 * 1024
+    except Exception:
+        return None
+
+
+def ram_available_bytes():
+    # MemAvailable, capped by the container's cgroup limit when there is one
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except Exception:
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current", "r") as f:
+            current = int(f.read().strip())
+        if limit != "max":
+            headroom = max(0, int(limit) - current)
+            available = headroom if available is None else min(available, headroom)
+    except Exception:
+        pass
+    return available
+
+
+def is_out_of_memory(exc):
+    return isinstance(exc, MemoryError) or any(m in str(exc).lower() for m in OOM_MARKERS)
+
+
+def tile_origins(length, tile, overlap):
+    # Evenly spaced tiles covering [0, length), neighbours sharing exactly `overlap` pixels.
+    # Returns (origins, tile side); the last tile may run a few pixels past the end, which
+    # pad_frame fills.
+    if tile >= length:
+        return [0], length
+    count = -(-(length - overlap) // (tile - overlap))
+    step = -(-(length - overlap) // count)
+    return [k * step for k in range(count)], step + overlap
+
+
+def pad_frame(frame, wh, padded_wh):
+    # Repeats the right column and the bottom row out to padded_wh
+    (w, h), (pw, ph) = wh, padded_wh
+    if (pw, ph) == (w, h):
+        return frame
+    row = w * BYTES_PER_PIXEL
+    rows = [frame[y * row:(y + 1) * row] + frame[(y + 1) * row - BYTES_PER_PIXEL:(y + 1) * row] * (pw - w) for y in range(h)]
+    return b"".join(rows + rows[-1:] * (ph - h))
+
+
+def crop_frame(frame, frame_w, x, y, tile_w, tile_h):
+    row = frame_w * BYTES_PER_PIXEL
+    start = x * BYTES_PER_PIXEL
+    return b"".join(frame[(y + r) * row + start:(y + r) * row + start + tile_w * BYTES_PER_PIXEL] for r in range(tile_h))
+
+
+def seam_spans(origins, tile, overlap, length, scale):
+    # The [start, end) of each upscaled tile that is kept: neighbours meet in the middle of
+    # their overlap, and the last tile is cut back to the frame's edge
+    spans = []
+    for k, origin in enumerate(origins):
+        start = 0 if k == 0 else overlap // 2
+        end = length - origin if k == len(origins) - 1 else tile - overlap + overlap // 2
+        spans.append((start * scale, end * scale))
+    return spans
+
+
+def stitch_tiles(tiles, x_spans, y_spans, tile_w):
+    # tiles are row-major over (y_spans, x_spans), already upscaled and tile_w pixels wide
+    row = tile_w * BYTES_PER_PIXEL
+    out = []
+    for j, (y0, y1) in enumerate(y_spans):
+        band = tiles[j * len(x_spans):(j + 1) * len(x_spans)]
+        for r in range(y0, y1):
+            out += [t[r * row + x0 * BYTES_PER_PIXEL:r * row + x1 * BYTES_PER_PIXEL] for t, (x0, x1) in zip(band, x_spans)]
+    return b"".join(out)
+
+
+class TilingBackend(object):
+    # Wraps a backend so frames larger than its memory budget are upscaled as overlapping
+    # tiles and stitched back. The tile limit comes from free GPU memory (or RAM), can be
+    # fixed, and halves whenever the backend runs out of memory; it then stays halved for
+    # later jobs on this worker. A negative tile never tiles, out of memory included.
+    # Backends with native tiling get the limit as their own tile size instead.
+    def __init__(self, backend, tile=0, overlap=16, memory_fraction=0.5):
+        self.backend = backend
+        self.name = backend.name
+        self.overlap = max(0, overlap)
+        self.memory_fraction = memory_fraction
+        self.limit = None if tile < 0 else (tile or None)
+        self.auto = tile == 0
+        self.never_tile = tile < 0
+        self.oom_retries = 0
+        self.last_tile = None
+
+    def load(self):
+        # Sized before the backend loads, so a natively tiling backend starts with its tile size
+        if self.auto:
+            budget = self.backend.memory_budget()
+            if budget:
+                side = int(math.sqrt(budget * self.memory_fraction / float(self.backend.bytes_per_pixel)))
+                self.limit = max(MIN_TILE, side // 8 * 8)
+        if self.backend.native_tiling:
+            self.backend.tile = self.limit or 0
+        self.backend.load()
+
+    def close(self):
+        self.backend.close()
+
+    def _fits(self, in_wh):
+        # A sized budget is memory, so it is compared by area; a fixed tile caps each side
+        if self.limit is None:
+            return True
+        if self.auto and not self.backend.native_tiling:
+            return in_wh[0] * in_wh[1] <= self.limit * self.limit
+        return max(in_wh) <= self.limit
+
+    def upscale(self, frames, in_wh, scale):
+        while True:
+            tile = None if self._fits(in_wh) else self.limit
+            self.last_tile = tile
+            try:
+                if self.backend.native_tiling:
+                    self.backend.tile = self.limit or 0
+                    return self.backend.upscale(frames, in_wh, scale)
+                if tile is None:
+                    return self.backend.upscale(frames, in_wh, scale)
+                return self._upscale_tiled(frames, in_wh, scale, tile)
+            except (UpscaleError, MemoryError) as exc:
+                if not is_out_of_memory(exc) or self.never_tile:
+                    raise
+                smaller = (tile or max(in_wh)) // 2 // 8 * 8
+                if smaller < MIN_TILE:
+                    raise UpscaleError("out of memory with %dpx tiles: %s" % (tile or max(in_wh), exc))
+                self.limit = smaller
+                self.oom_retries += 1
+
+    def _upscale_tiled(self, frames, in_wh, scale, tile):
+        w, h = in_wh
+        overlap_x = min(self.overlap, min(tile, w) // 2)
+        overlap_y = min(self.overlap, min(tile, h) // 2)
+        xs, tile_w = tile_origins(w, tile, overlap_x)
+        ys, tile_h = tile_origins(h, tile, overlap_y)
+        padded = (xs[-1] + tile_w, ys[-1] + tile_h)
+        tiles = []
+        for frame in frames:
+            frame = pad_frame(frame, in_wh, padded)
+            tiles += [crop_frame(frame, padded[0], x, y, tile_w, tile_h) for y in ys for x in xs]
+        upscaled = self.backend.upscale(tiles, (tile_w, tile_h), scale)
+        x_spans = seam_spans(xs, tile_w, overlap_x, w, scale)
+        y_spans = seam_spans(ys, tile_h, overlap_y, h, scale)
+        per_frame = len(xs) * len(ys)
+        return [stitch_tiles(upscaled[i * per_frame:(i + 1) * per_frame], x_spans, y_spans, tile_w * scale) for i in range(len(frames))]
+
+
+class UpscalerEngine(object):
+    # One long-lived worker thread per backend/model. Jobs submit fixed-size batches
+    # through a bounded queue, so a fast decoder blocks instead of buffering the tape.
+    def __init__(self, backend, queue_batches=2):
+        self.backend = backend
+        self.depth = max(1, queue_batches)
+        self._requests = queue.Queue(maxsize=self.depth)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loaded = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._loaded:
+                self.backend.load()
+                self._loaded = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            frames, in_wh, scale, reply = self._requests.get()
+            try:
+                reply.put((self.backend.upscale(frames, in_wh, scale), None))
+            except Exception as exc:
+                reply.put((None, exc))
+
+    def submit(self, frames, in_wh, scale):
+        self._ensure_started()
+        reply = queue.Queue(maxsize=1)
+        self._requests.put((frames, in_wh, scale, reply))
+        return reply
+
+    def upscale_stream(self, batches, in_wh, scale):
+        # Keeps up to `depth` batches in flight so decode, upscale and encode overlap
+        inflight = collections.deque()
+        for batch in batches:
+            inflight.append(self.submit(batch, in_wh, scale))
+            while len(inflight) >= self.depth:
+                for frame in self._result(inflight.popleft()):
+                    yield frame
+        while inflight:
+            for frame in self._result(inflight.popleft()):
+                yield frame
+
+    def warm(self, scale):
+        # Runs one tiny batch so the backend, model files and GPU context are loaded before a job needs them
+        self._result(self.submit([bytes(16 * 16 * BYTES_PER_PIXEL)], (16, 16), scale))
+
+    @staticmethod
+    def _result(reply):
+        frames, exc = reply.get()
+        if exc is not None:
+            if isinstance(exc, UpscaleError):
+                raise exc
+            raise UpscaleError(str(exc))
+        return frames
+
+
+class RemoteBackendState(object):
+    # What callers read off engine.backend, as last reported by the serving process
+    def __init__(self, name):
+        self.name = name
+        self.last_tile = None
+        self.oom_retries = 0
+
+
+class RemoteEngine(object):
+    # Stands in for the engine inside a pool worker: batches go over a connection to the job
+    # process, which holds the only loaded model and GPU context (see EngineServer)
+    def __init__(self, address, authkey, backend_name, queue_batches=2):
+        self.address = address
+        self.authkey = authkey
+        self.depth = max(1, queue_batches)
+        self.backend = RemoteBackendState(backend_name)
+        self._conn = None
+
+    def upscale_stream(self, batches, in_wh, scale):
+        if self._conn is None:
+            self._conn = multiprocessing.connection.Client(self.address, authkey=self.authkey)
+        conn = self._conn
+        inflight = 0
+        try:
+            for batch in batches:
+                conn.send((batch, in_wh, scale))
+                inflight += 1
+                while inflight >= self.depth:
+                    inflight -= 1
+                    for frame in self._result(conn):
+                        yield frame
+            while inflight:
+                inflight -= 1
+                for frame in self._result(conn):
+                    yield frame
+        finally:
+            if inflight:
+                # Replies still queued for an abandoned stream would answer the next one
+                conn.close()
+                self._conn = None
+
+    def _result(self, conn):
+        try:
+            frames, error, last_tile, oom_retries = conn.recv()
+        except (EOFError, OSError) as exc:
+            raise UpscaleError("upscale server went away: %s" % exc)
+        self.backend.last_tile, self.backend.oom_retries = last_tile, oom_retries
+        if error is not None:
+            raise UpscaleError(error)
+        return frames
+
+
+class EngineServer(object):
+    # Serves one engine to the pool workers of a segmented or preview job, so the model is
+    # loaded once by the job process and the GPU has a single client. Each connection gets
+    # a reader that submits batches and a writer that returns results in order.
+    def __init__(self, engine):
+        self.engine = engine
+        self.authkey = bytes(multiprocessing.current_process().authkey)
+        self._closed = False
+        self._listener = multiprocessing.connection.Listener(family="AF_UNIX", authkey=self.authkey)
+        self.address = self._listener.address
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def client_args(self):
+        return (self.address, self.authkey, self.engine.backend.name, self.engine.depth)
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, multiprocessing.AuthenticationError):
+                if self._closed:
+                    return
+                continue
+            if self._closed:
+                conn.close()
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        replies = queue.Queue()
+        writer = threading.Thread(target=self._reply, args=(conn, replies), daemon=True)
+        writer.start()
+        try:
+            while True:
+                frames, in_wh, scale = conn.recv()
+                try:
+                    replies.put(self.engine.submit(frames, in_wh, scale))
+                except Exception as exc:
+                    failed = queue.Queue(maxsize=1)
+                    failed.put((None, exc))
+                    replies.put(failed)
+        except (EOFError, OSError):
+            pass
+        finally:
+            replies.put(None)
+
+    def _reply(self, conn, replies):
+        backend = self.engine.backend
+        while True:
+            reply = replies.get()
+            if reply is None:
+                break
+            frames, exc = reply.get()
+            try:
+                conn.send((frames, None if exc is None else str(exc), backend.last_tile, backend.oom_retries))
+            except (OSError, ValueError):
+                break
+        conn.close()
+
+    def close(self):
+        self._closed = True
+        try:
+            # accept() does not return when the listening socket is closed under it
+            multiprocessing.connection.Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+        self._thread.join(5)
+        self._listener.close()
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+# Set in pool workers whose job process serves the engine (attach_remote)
+_remote = None
+
+
+def attach_remote(address, authkey, backend_name, queue_batches):
+    # ProcessPoolExecutor initializer: get_engine() then hands out RemoteEngines
+    global _remote
+    _remote = (address, authkey, backend_name, queue_batches)
+
+
+def get_engine(backend_name, model, work_root, queue_batches=2, tile=-1, tile_overlap=16, memory_fraction=0.5):
+    # tile: 0 sizes tiles from free memory, >0 caps the tile side, <0 never tiles
+    key = (backend_name, model)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None and _remote is not None:
+            engine = RemoteEngine(*_remote)
+            _engines[key] = engine
+        elif engine is None:
+            cls = BACKENDS.get(backend_name)
+            if cls is None:
+                raise UpscaleError("unknown upscaler backend %s" % backend_name)
+            os.makedirs(work_root, exist_ok=True)
+            engine = UpscalerEngine(TilingBackend(cls(model, work_root), tile, tile_overlap, memory_fraction), queue_batches)
+            _engines[key] = engine
+        return engine
+
+
+def describe_backend(backend_name):
+    cls = BACKENDS.get(backend_name)
+    if cls is None:
+        return {"backend": backend_name, "available": False, "error": "unknown upscaler backend", "models": None}
+    return dict(cls.describe(), backend=backend_name)
+
+
+def _reset_after_fork():
+    # Pool workers must not inherit a parent's worker thread or lock state
+    global _engines_lock, _remote
+    _engines.clear()
+    _engines_lock = threading.Lock()
+    _remote = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)